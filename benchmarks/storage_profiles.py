@@ -0,0 +1,73 @@
+# Compare the "durable" and "fast" storage profiles on note insert and list workloads.
+# Run from the project root: python -m benchmarks.storage_profiles [--notes 2000] [--lists 200]
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+from utils.Database import Database, STORAGE_PROFILES
+
+
+# Insert notes one transaction at a time, as PostPage.save_note_handler does
+def bench_insert(db, count):
+    start = time.perf_counter()
+    for i in range(count):
+        db.create_note(1, f'benchmark note number {i}', i % 3 + 1)
+    return time.perf_counter() - start
+
+
+# List notes the way the search box and sort dropdown do
+def bench_list(db, count):
+    start = time.perf_counter()
+    for i in range(count):
+        db.get_user_notes_sorted(str(i % 10), 'priority')
+    return time.perf_counter() - start
+
+
+# Measure list latency while another thread keeps writing
+def bench_read_during_writes(db, count):
+    stop = threading.Event()
+
+    def writer():
+        written = 0
+        while not stop.is_set():
+            written += 1
+            db.create_note(2, f'concurrent write {written}', 2)  # Distinct text, duplicates are not inserted
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    latencies = []
+    try:
+        for i in range(count):
+            start = time.perf_counter()
+            db.get_user_notes_sorted(str(i % 10), 'priority')
+            latencies.append(time.perf_counter() - start)
+    finally:
+        stop.set()
+        thread.join()
+
+    latencies.sort()
+    return latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.95)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare storage profiles')
+    parser.add_argument('--notes', type=int, default=2000, help='notes inserted per profile')
+    parser.add_argument('--lists', type=int, default=200, help='list queries per profile')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"{'profile':<10}{'insert/s':>12}{'list/s':>12}{'p50 ms':>10}{'p95 ms':>10}")
+        for name in STORAGE_PROFILES:
+            db = Database(os.path.join(tmp, f'{name}.db'), profile=name)
+            insert_time = bench_insert(db, args.notes)
+            list_time = bench_list(db, args.lists)
+            p50, p95 = bench_read_during_writes(db, args.lists)
+            print(f'{name:<10}{args.notes / insert_time:>12.0f}{args.lists / list_time:>12.0f}'
+                  f'{p50 * 1000:>10.2f}{p95 * 1000:>10.2f}')
+        Database.close_all()
+
+
+if __name__ == '__main__':
+    main()
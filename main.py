@@ -1,15 +1,52 @@
-import flet as ft
+import sys
+
+from utils import startup  # Startup profiler, enabled with --profile-startup
 
+if __name__ == '__main__' and '--profile-startup' in sys.argv:
+    startup.enable()
+
+import flet as ft
 
 from router import Router
-from utils.Database import *
+from utils import Cluster
+from utils import uiprofile  # Render-cost profiler, enabled with --profile-ui or PROFILE_UI=1
+from utils.style import defaultWidthWindows, defaultHeightWindows
+
+startup.mark('imports done')
+
+
+# Resume delivering posts left in the outbox and reload scheduled notes; imported lazily to keep startup fast
+def start_background_services():
+    from utils.Repository import open_database
+    from utils.Publisher import get_publisher
+    from utils.Scheduler import get_scheduler
+
+    db = open_database()
+    get_publisher(db)
+    get_scheduler(db)
 
 
 def main(page: ft.Page):
+    startup.mark('session started')
+
+    # Fonts and window configuration are applied once per session, not on every render
+    page.fonts = {
+        "muller-extrabold": "fonts/muller-extrabold.ttf",
+        "prisma-pro-shadow": "fonts/prisma-pro-shadow.ttf",
+    }
+    page.window.width = defaultWidthWindows
+    page.window.height = defaultHeightWindows
+    page.window.min_width = 900
+    page.window.min_height = 400
+
     Router(page)
+    if Cluster.runs_background_services():  # Web workers leave them to the supervisor (serve.py)
+        page.run_thread(start_background_services)
 
 
 
 if __name__ == '__main__':
-
-    ft.app(target=main, assets_dir='assets')
\ No newline at end of file
+    if uiprofile.requested():
+        uiprofile.enable()
+    startup.mark('starting flet app')
+    ft.app(target=main, assets_dir='assets')
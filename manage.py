@@ -0,0 +1,91 @@
+# Maintenance commands for app.db. Run from the project root: python manage.py <command> --help
+import argparse
+import sys
+
+from utils import BulkIO
+from utils.Repository import Repository, open_database
+
+
+# Build the email/login Bloom filter from the users table and print its sizing, to tune BLOOM_CAPACITY and
+# BLOOM_ERROR_RATE. The filter lives in each process's memory, so this only reports: running app processes build
+# their own on start and rebuild it in the background once it reaches its capacity.
+def rebuild_filters(args):
+    db = open_database(args.db)
+    identifier_filter = db.rebuild_identifier_filter(args.capacity, args.error_rate)
+    print(f'items: {identifier_filter.count}')
+    print(f'capacity: {identifier_filter.capacity}')
+    print(f'bits: {identifier_filter.size} ({identifier_filter.size // 8 // 1024} KiB), '
+          f'hash functions: {identifier_filter.hash_count}')
+    print(f'fill ratio: {identifier_filter.fill_ratio():.3f}, '
+          f'estimated false-positive rate: {identifier_filter.estimated_error_rate():.5f}')
+
+
+# Print progress on one stderr line
+def print_progress(done, fraction):
+    print(f'\r{done} notes ({fraction:.0%})', end='', file=sys.stderr, flush=True)
+
+
+# Stream notes from a CSV or JSON Lines file into the notes table
+def import_notes(args):
+    count, skipped = BulkIO.import_notes(open_database(args.db), args.path, args.format, args.chunk_size, args.user_id,
+                                         print_progress)
+    print(f'\nImported {count} notes, skipped {skipped} duplicates', file=sys.stderr)
+
+
+# Stream the notes table into a CSV or JSON Lines file
+def export_notes(args):
+    count = BulkIO.export_notes(open_database(args.db), args.path, args.format, args.chunk_size, print_progress)
+    print(f'\nExported {count} notes', file=sys.stderr)
+
+
+# List notes that duplicate another note of the same user, and delete them with --delete
+def dedup_report(args):
+    db = open_database(args.db)
+    duplicates = db.duplicate_notes()
+    count = sum(len(ids) for ids in duplicates.values())
+    print(f'notes: {db.count_notes()}')
+    print(f'duplicated notes: {len(duplicates)}, redundant copies: {count}')
+    largest = sorted(duplicates.items(), key=lambda item: len(item[1]), reverse=True)[:args.top]
+    for original, ids in largest:
+        print(f'  note {original}: {len(ids)} copies ({", ".join(map(str, ids[:10]))}{", ..." if len(ids) > 10 else ""})')
+    if args.delete and count:
+        print(f'deleted {db.remove_duplicate_notes(duplicates)} notes')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='app.db maintenance commands')
+    parser.add_argument('--db', help='path to the database file or a postgresql:// URL (default: DATABASE_URL, '
+                                     'else app.db)')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    command = commands.add_parser('rebuild-filters', help='show the stats of a freshly built email/login Bloom filter '
+                                                           '(running processes rebuild their own)')
+    command.add_argument('--capacity', type=int, help='expected number of identifiers (default BLOOM_CAPACITY)')
+    command.add_argument('--error-rate', type=float, help='target false-positive rate (default BLOOM_ERROR_RATE)')
+    command.set_defaults(handler=rebuild_filters)
+
+    command = commands.add_parser('import-notes', help='import notes from a CSV or JSON Lines file')
+    command.add_argument('path')
+    command.add_argument('--format', choices=BulkIO.FORMATS, help='file format (default: from the extension)')
+    command.add_argument('--chunk-size', type=int, default=1000, help='notes per transaction')
+    command.add_argument('--user-id', type=int, help='assign every imported note to this user')
+    command.set_defaults(handler=import_notes)
+
+    command = commands.add_parser('export-notes', help='export all notes to a CSV or JSON Lines file')
+    command.add_argument('path')
+    command.add_argument('--format', choices=BulkIO.FORMATS, help='file format (default: from the extension)')
+    command.add_argument('--chunk-size', type=int, default=1000, help='notes read per query')
+    command.set_defaults(handler=export_notes)
+
+    command = commands.add_parser('dedup-report', help='report notes duplicated within a user, optionally delete them')
+    command.add_argument('--top', type=int, default=20, help='number of most duplicated notes to list')
+    command.add_argument('--delete', action='store_true', help='delete the copies, keeping the original note')
+    command.set_defaults(handler=dedup_report)
+
+    args = parser.parse_args()
+    args.handler(args)
+    Repository.close_all()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+import flet as ft  # Importing Flet for UI components
+
+from utils.style import *  # Importing style variables
+
+
+# Persistent application shell: sidebar and header are built once per session and
+# only the content region changes between routes. Contents of cached routes stay mounted
+# but hidden, so switching back to them only sends a visibility change to the client.
+class ShellLayout:
+
+    def __init__(self, page: ft.Page):
+        self.page = page
+        self.mounted = {}  # route -> content control currently mounted in the body
+
+        # Define style for the menu items
+        style_menu = ft.ButtonStyle(
+            color={ft.ControlState.HOVERED: ft.colors.WHITE, ft.ControlState.DEFAULT: menuColorFont},
+            icon_size=14,
+            overlay_color=hoverBqColor,
+            shadow_color=hoverBqColor
+        )
+
+        # Sidebar components
+        logotype = ft.Container(
+            padding=ft.padding.symmetric(17, 13),
+            content=ft.Row(
+                controls=[
+                    ft.Image(src='images/logo.png', width=45, height=32, fit=ft.ImageFit.FILL),
+                    ft.Text('Tlogo', expand=True, color=defaultFontColor, font_family='muller-extrabold', size=16)
+                ], alignment=ft.MainAxisAlignment.START,
+                spacing=5,
+                vertical_alignment=ft.CrossAxisAlignment.CENTER
+            )
+        )
+
+        sidebar_menu = ft.Container(
+            padding=ft.padding.symmetric(0, 13),
+            content=ft.Column(
+                controls=[
+                    ft.Text('Menu', color=menuColorFont, size=12, font_family='muller-extrabold'),
+                    ft.TextButton('Header', icon='space_dashboard_rounded', style=style_menu,
+                                  on_click=lambda e: page.go('/dashboard')),
+                    ft.TextButton('Send', icon='post_add', style=style_menu,
+                                  on_click=lambda e: page.go('/posting')),
+                    ft.TextButton('Test Button', icon='verified_user', style=style_menu),
+                ],
+            )
+        )
+
+        # Header section with control panel title and icons
+        header = ft.Container(content=ft.Row(controls=[
+            ft.Text('Control Panel', color=defaultFontColor, size=20, font_family='muller-extrabold'),
+            ft.Row(controls=[
+                ft.CircleAvatar(foreground_image_src='images/avatar.png',
+                                content=ft.Text('Avatar')),
+                ft.IconButton(
+                    icon=ft.icons.NOTIFICATIONS_ROUNDED,
+                    icon_size=20,
+                    hover_color=hoverBqColor,
+                    icon_color=defaultFontColor,
+                )
+            ], alignment=ft.MainAxisAlignment.SPACE_BETWEEN
+            )
+        ], alignment=ft.MainAxisAlignment.SPACE_BETWEEN
+        ))
+
+        # Content region swapped on route change
+        self.body = ft.Column(expand=True)
+        self.content_area = ft.Container(
+            expand=4,
+            padding=ft.padding.symmetric(15, 10),
+            content=ft.Column([header, self.body], expand=True)
+        )
+
+        self.view = ft.View(
+            "/dashboard",
+            controls=[
+                ft.Row(
+                    expand=True,
+                    controls=[
+                        # Sidebar container
+                        ft.Container(
+                            expand=1,
+                            content=ft.Column(
+                                controls=[logotype, sidebar_menu]
+                            ),
+                            bgcolor=secondaryBqColor,
+                        ),
+                        # Main content area with header and the current page content
+                        self.content_area
+                    ]
+                )
+            ], bgcolor=defaultBqColor,
+            padding=0
+        )
+
+    # Show a route's content; contents of routes not in keep_routes are unmounted
+    def show(self, route, content, keep_routes=(), background_image=None):
+        self.view.route = route
+        self.content_area.image_src = background_image
+        self.content_area.image_fit = ft.ImageFit.COVER if background_image else None
+        self.content_area.bgcolor = secondaryBqColor if background_image else None
+
+        for mounted_route, control in list(self.mounted.items()):
+            if mounted_route != route and mounted_route not in keep_routes or \
+                    mounted_route == route and control is not content:
+                self.body.controls.remove(control)
+                del self.mounted[mounted_route]
+
+        if route not in self.mounted:
+            content.expand = True
+            self.body.controls.append(content)
+            self.mounted[route] = content
+
+        for mounted_route, control in self.mounted.items():
+            control.visible = mounted_route == route
@@ -1,13 +1,19 @@
+import asyncio  # Running the credentials lookup off the event loop
 import flet as ft  # Importing Flet for UI components
 
 from utils.style import *  # Importing styling variables
-from utils.Database import Database  # Importing the Database class for user management
-from utils.function import hesh_password  # Importing function for password hashing
+from utils.Repository import open_database  # Opening the configured database for user management
+from utils.PasswordHasher import get_password_hasher  # Salted password hashing on a worker pool
+from utils.Sessions import get_sessions  # Server-side signed-in sessions
 
 
 class LoginPage:
     # Initialize UI components of the login page
     def __init__(self):
+        # Shared database handle, opened on first use; connections come from the process-wide pool
+        self._db = None
+        self.hasher = get_password_hasher()
+
         # Email input field wrapped in a container
         self.email_input = ft.Container(
             content=ft.TextField(
@@ -38,20 +44,17 @@ class LoginPage:
             content=ft.Text("Error", color=inputBqErrorColor),
         )
 
+    # Database handle, opened when first needed rather than at import or construction
+    @property
+    def db(self):
+        if self._db is None:
+            self._db = open_database()
+        return self._db
+
     # Function to define and display the page layout
     def view(self, page: ft.Page):
-        # Basic page setup
+        # Basic page setup; fonts and window size are configured once in main
         page.title = "Page Authorization"
-        page.window.width = defaultWidthWindows  # Setting window dimensions
-        page.window.height = defaultHeightWindows
-        page.window.min_width = 800
-        page.window.min_height = 400
-
-        # Loading custom fonts for the page
-        page.fonts = {
-            "muller-extrabold": "fonts/muller-extrabold.ttf",
-            "prisma-pro-shadow": "fonts/prisma-pro-shadow.ttf",
-        }
 
         # Link to navigate to the dashboard page
         dashboard_link = ft.Container(
@@ -65,15 +68,23 @@ class LoginPage:
             on_click=lambda e: page.go('/signup'),  # Redirect to signup page on click
         )
 
-        # Authorization function to handle login
-        def authorization(e):
-            db = Database()  # Creating a database instance
+        # Authorization function to handle login; hashing runs on the hasher's worker pool
+        async def authorization(e):
             email = self.email_input.content.value  # Retrieving entered email
-            password = hesh_password(self.password_input.content.value)  # Hashing entered password
+            password = self.password_input.content.value or ""
 
             # Check login credentials with the database
-            if db.login_user(email, password):
-                page.session.set("auth_user", True)  # Setting session on successful login
+            # An unknown email still runs the hash check, so timing does not tell which emails are registered
+            credentials = await asyncio.to_thread(self.db.get_credentials, email)
+            stored = credentials[1] if credentials else None
+            if await self.hasher.verify_async(password, stored) and credentials:
+                # Upgrade legacy or weaker hashes now that the plain password is known
+                if self.hasher.needs_rehash(credentials[1]):
+                    new_hash = await self.hasher.hash_async(password)
+                    await asyncio.to_thread(self.db.update_password, credentials[0], new_hash)
+
+                # Sign the session in; the user's notes and settings are prefetched in the background
+                get_sessions().login(page.session_id, credentials[0], self.db)
                 page.go('/dashboard')  # Redirecting to the dashboard
             else:
                 self.message_error.open = True  # Show error message if login fails
@@ -119,7 +130,7 @@ class LoginPage:
                                         alignment=ft.alignment.center,
                                         height=40,
                                         bgcolor=hoverBqColor,  # Background color for the button
-                                        on_click=lambda e: authorization(e),  # Call authorization function on click
+                                        on_click=authorization,  # Call authorization function on click
                                     ),
 
                                     # Signup and dashboard navigation links
@@ -0,0 +1,220 @@
+from bisect import bisect_left  # Finding where a new note belongs in the loaded list
+
+import flet as ft  # Importing Flet for UI components
+
+from utils.SortedIndex import SortedNoteIndex  # NULL-first sort keys, as in the database listings
+from utils.style import *  # Style configuration
+
+
+# Virtualized list of notes that loads keyset-paginated pages as the user scrolls.
+# A search lists the best matches by relevance instead, each with a snippet that highlights the matched words.
+# Rows are keyed by note id and reused between loads, so Flet only sends the rows that changed.
+class NotesPanel:
+    page_size = 50  # Notes fetched per page
+    search_limit = 200  # Best matches listed for a search; ranked results are not paged
+    preload_pixels = 300  # Fetch the next page when this close to the bottom
+    highlight = ('\x02', '\x03')  # Markers around matched words in search snippets
+
+    def __init__(self, db, user_id, on_delete, on_publish=None):
+        self.db = db
+        self.user_id = user_id  # Only this user's notes are listed
+        self.on_delete = on_delete  # Called with the note id when its delete button is clicked
+        self.on_publish = on_publish  # Called with the note id when its publish button is clicked
+
+        # Current listing state
+        self.search_query = ""
+        self.sort_by = "priority"
+        self.has_more = False
+        self.loading = False
+
+        # Loaded notes: sort keys (has value, value, id) in display order, and note id -> (note, row control)
+        self.keys = []
+        self.rows = {}
+
+        # ListView only builds the rows that are visible on screen
+        self.list_view = ft.ListView(
+            expand=True,
+            spacing=5,
+            on_scroll_interval=100,
+            on_scroll=self.on_scroll,
+        )
+
+    # Keyset cursor (sort value, id) of the last loaded note
+    @property
+    def cursor(self):
+        if not self.keys:
+            return None
+        has_value, value, note_id = self.keys[-1]
+        return (value if has_value else None), note_id
+
+    # Comparable sort key of a note: NULL sort values (e.g. imported notes without a priority) order first
+    def sort_key(self, note):
+        return SortedNoteIndex.key(*self.db.note_cursor(note, self.sort_by))
+
+    # Text shown for a note: the highlighted snippet for search results (note columns + snippet, rank), else the note
+    @staticmethod
+    def display_text(note):
+        return note[6] if len(note) > 6 else note[2]
+
+    # Build the text control of a note, with the words matched by a search in bold
+    def build_text(self, note):
+        start, stop = self.highlight
+        text = self.display_text(note)
+        if start not in text:
+            return ft.Text(text)
+
+        spans = []
+        for i, part in enumerate(text.split(start)):
+            matched, _, rest = part.partition(stop) if i else ('', '', part)
+            if matched:
+                spans.append(ft.TextSpan(matched, style=ft.TextStyle(weight=ft.FontWeight.BOLD)))
+            if rest:
+                spans.append(ft.TextSpan(rest))
+        return ft.Text(spans=spans)
+
+    # Build the row displayed for a single note
+    def build_row(self, note):
+        return ft.Row(
+            controls=[
+                self.build_text(note),  # Note text, or its search snippet
+                ft.Text(f"Priority: {note[3]}"),  # Priority
+                ft.IconButton(icon=ft.icons.DELETE,
+                              on_click=lambda e, note_id=note[0]: self.on_delete(note_id)),  # Delete button
+                ft.IconButton(icon=ft.icons.SEND, tooltip="Publish to channel", visible=self.on_publish is not None,
+                              on_click=lambda e, note_id=note[0]: self.on_publish(note_id)),  # Publish button
+            ],
+            alignment=ft.MainAxisAlignment.SPACE_BETWEEN
+        )
+
+    # Return the row for a note, reusing the existing control and patching only changed fields
+    def row_for(self, note):
+        known = self.rows.get(note[0])
+        if known is None:
+            row = self.build_row(note)
+        else:
+            old_note, row = known
+            if self.display_text(old_note) != self.display_text(note):
+                row.controls[0] = self.build_text(note)
+            if old_note[3] != note[3]:
+                row.controls[1].value = f"Priority: {note[3]}"
+        self.rows[note[0]] = (note, row)
+        return row
+
+    # Make the list show exactly these notes, keeping the controls of notes that are still present
+    def reconcile(self, notes):
+        wanted = {note[0] for note in notes}
+        for note_id in [note_id for note_id in self.rows if note_id not in wanted]:
+            del self.rows[note_id]
+
+        self.list_view.controls = [self.row_for(note) for note in notes]
+        self.keys = [self.sort_key(note) for note in notes]
+
+    # Show the first page for a search query and sort order
+    def load(self, search_query="", sort_by="priority", update=True):
+        self.show_first_page(search_query, sort_by, self.fetch_first_page(search_query, sort_by), update)
+
+    # Query the first page, or the ranked matches of a search; safe to call from a worker thread.
+    # Setting cancel_event interrupts the query.
+    def fetch_first_page(self, search_query="", sort_by="priority", cancel_event=None):
+        if cancel_event is None:
+            return self.query_first_page(search_query, sort_by)
+        with self.db.cancellable(cancel_event):
+            return self.query_first_page(search_query, sort_by)
+
+    # Blocking query behind fetch_first_page; search results are ordered by relevance whatever sort_by is
+    def query_first_page(self, search_query, sort_by):
+        if (search_query or "").strip():
+            return self.db.search_notes(search_query, self.user_id, self.search_limit, self.highlight)
+        return self.db.get_notes_page("", sort_by or "priority", page_size=self.page_size, user_id=self.user_id)
+
+    # Display a first page fetched by fetch_first_page
+    def show_first_page(self, search_query, sort_by, notes, update=True):
+        self.search_query = (search_query or "").strip()
+        self.sort_by = sort_by or "priority"
+        self.has_more = not self.search_query and len(notes) == self.page_size
+        self.reconcile(notes)
+
+        if update:
+            self.list_view.update()
+
+    # Append the next page of notes
+    def load_more(self, update=True):
+        if self.loading or not self.has_more:
+            return
+        self.loading = True
+        try:
+            after_value, after_id = self.cursor or (None, None)
+            notes = self.db.get_notes_page(self.search_query, self.sort_by, after_value, after_id, self.page_size,
+                                           self.user_id)
+
+            self.has_more = len(notes) == self.page_size
+            for note in notes:
+                self.list_view.controls.append(self.row_for(note))
+                self.keys.append(self.sort_key(note))
+        finally:
+            self.loading = False
+
+        if update:
+            self.list_view.update()
+
+    # Insert one new note at its sorted position without reloading the list
+    def insert_note(self, note, update=True):
+        if self.search_query:
+            # Only the database knows whether the note matches the search
+            self.load(self.search_query, self.sort_by, update)
+            return
+
+        key = self.sort_key(note)
+        position = bisect_left(self.keys, key)
+        if position == len(self.keys) and self.has_more:
+            return  # Sorts after the loaded pages, it will arrive with a later page
+
+        self.keys.insert(position, key)
+        self.list_view.controls.insert(position, self.row_for(note))
+
+        if update:
+            self.list_view.update()
+
+    # Loaded note with this id, or None
+    def get_note(self, note_id):
+        known = self.rows.get(note_id)
+        return known[0] if known else None
+
+    # Remove one note's row without reloading the list
+    def remove_note(self, note_id, update=True):
+        known = self.rows.pop(note_id, None)
+        if known is None:
+            return
+
+        position = self.list_view.controls.index(known[1])
+        del self.list_view.controls[position]
+        del self.keys[position]
+
+        if update:
+            self.list_view.update()
+
+    # Give a row shown optimistically under a temporary id the note's real id once it is written
+    def rekey(self, temp_id, note_id, update=True):
+        if note_id in self.rows:
+            # The note was a duplicate of one already listed, drop the optimistic copy
+            self.remove_note(temp_id, update)
+            return
+        known = self.rows.pop(temp_id, None)
+        if known is None:
+            return
+
+        old_note, row = known
+        note = (note_id,) + tuple(old_note[1:])
+        self.rows[note_id] = (note, row)
+        row.controls[2].on_click = lambda e: self.on_delete(note_id)
+        row.controls[3].on_click = lambda e: self.on_publish(note_id)
+
+        position = self.list_view.controls.index(row)
+        self.keys[position] = self.sort_key(note)
+        if update:
+            row.update()
+
+    # Fetch more notes when the user scrolls near the end of the list
+    def on_scroll(self, e):
+        if e.max_scroll_extent is not None and e.pixels >= e.max_scroll_extent - self.preload_pixels:
+            self.load_more()
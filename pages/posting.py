@@ -1,78 +1,37 @@
-import os
+import time
+from datetime import datetime
 import flet as ft
-from utils.Database import Database  # Database class for note handling
+from utils.Repository import open_database  # Configured database for note handling
+from pages.notes_panel import NotesPanel  # Paginated, virtualized notes list
+from utils.SearchPipeline import SearchPipeline  # Debounced background search
+from utils.Publisher import get_publisher, chat_id_from_link  # Outbox-backed channel publishing
+from utils.Scheduler import get_scheduler  # Publishes notes at their publish-at time
+from utils.Sessions import current_user_id  # Signed-in user of a session
+from utils.Settings import get_settings  # Cached application settings
 from utils.Validation import Validation  # Validation helper
 from utils.style import *  # Style configuration
 
 
 class PostPage:
 
-    # Load environment variables for bot and channel link
-    token_bot = os.getenv('TOKEN_BOT')
-    channel_link = os.getenv('CHANNEL_LINK')
     validation = Validation()
-    db = Database()  # Instance of Database class
-
-    # Main view method
-    def view(self, page: ft.Page):
-        # Page configurations
-        page.title = "Add post"
-        page.window.width = defaultWidthWindows
-        page.window.height = defaultHeightWindows
-        page.window.min_width = 900
-        page.window.min_height = 400
-
-        # Define fonts for the page
-        page.fonts = {
-            "muller-extrabold": "fonts/muller-extrabold.ttf",
-            "prisma-pro-shadow": "fonts/prisma-pro-shadow.ttf",
-        }
-
-        # Style for sidebar menu buttons
-        style_menu = ft.ButtonStyle(color={ft.ControlState.HOVERED: ft.colors.WHITE,
-                                           ft.ControlState.DEFAULT: menuColorFont},
-                                    icon_size=14,
-                                    overlay_color=hoverBqColor,
-                                    shadow_color=hoverBqColor)
-
-        # Sidebar with navigation options
-        logotype = ft.Container(
-            padding=ft.padding.symmetric(17, 13),
-            content=ft.Row(
-                controls=[
-                    ft.Image(src='images/logo.png', width=45, height=32, fit=ft.ImageFit.FILL),
-                    ft.Text('First Program', expand=True, color=defaultFontColor, font_family='muller-extrabold', size=16)
-                ],
-                alignment=ft.MainAxisAlignment.START,
-                spacing=5,
-                vertical_alignment=ft.CrossAxisAlignment.CENTER
-            )
-        )
-
-        sidebar_menu = ft.Container(
-            padding=ft.padding.symmetric(0, 13),
-            content=ft.Column(
-                controls=[
-                    ft.Text('Menu', color=menuColorFont, size=12),
-                    ft.TextButton('Header', icon='space_dashboard_rounded', style=style_menu,
-                                  on_click=lambda e: page.go('/dashboard')),
-                    ft.TextButton('Send', icon='post_add', style=style_menu,
-                                  on_click=lambda e: page.go('/posting')),
-                    ft.TextButton('Test Button', icon='verified_user', style=style_menu),
-                ]
-            )
-        )
-
-        # Header
-        header = ft.Container(content=ft.Row(controls=[
-            ft.Text('Control Panel', color=defaultFontColor, size=20, font_family='muller-extrabold'),
-            ft.Row(controls=[
-                ft.CircleAvatar(foreground_image_src='images/avatar.png', content=ft.Text('Avatar')),
-                ft.IconButton(icon=ft.icons.NOTIFICATIONS_ROUNDED, icon_size=20, hover_color=hoverBqColor,
-                              icon_color=defaultFontColor)
-            ], alignment=ft.MainAxisAlignment.SPACE_BETWEEN)
-        ], alignment=ft.MainAxisAlignment.SPACE_BETWEEN))
-
+    search_debounce = 0.25  # Seconds of typing pause before the notes search runs
+    schedule_format = "%Y-%m-%d %H:%M"  # Publish-at input, in local time
+    _db = None  # Database handle, opened on first use
+
+    # Database handle, opened when first needed rather than at import or construction
+    @property
+    def db(self):
+        if self._db is None:
+            self._db = open_database()
+        return self._db
+
+    # Page title and background shown while the page is open
+    title = "Add post"
+    background_image = "images/bg_login1.webp"
+
+    # Build the notes content shown inside the shell layout (pages/layout.py)
+    def content(self, page: ft.Page):
         # Note input fields
         self.note_input = ft.TextField(
             hint_text="Write a new note...",
@@ -99,6 +58,15 @@ class PostPage:
             color=secondaryFontColor
         )
 
+        self.schedule_input = ft.TextField(
+            hint_text="Publish at (YYYY-MM-DD HH:MM)",
+            width=260,
+            bgcolor=secondaryBqColor,
+            border=ft.InputBorder.NONE,
+            filled=True,
+            color=secondaryFontColor
+        )
+
         # Search field and sorting dropdown
         search_field = ft.TextField(
             hint_text="Search notes...",
@@ -124,13 +92,19 @@ class PostPage:
             on_click=self.save_note_handler
         )
 
-        # Notes list section
-        self.notes_list = ft.Column()
+        # Notes list section; the first page is loaded before the view is shown
+        self.page = page
+        self.user_id = current_user_id(page)  # The router only shows this page to signed-in sessions
+        self.notes_panel = NotesPanel(self.db, self.user_id, on_delete=self.delete_note_handler,
+                                      on_publish=self.publish_note_handler)
+        self.notes_panel.load(update=False)
+        self.search = SearchPipeline(self.notes_panel.fetch_first_page, self.notes_panel.show_first_page,
+                                     debounce=self.search_debounce)
         notes_section = ft.Container(
             content=ft.Column([
                 ft.Row(controls=[search_field, sort_dropdown], alignment=ft.MainAxisAlignment.SPACE_BETWEEN),
-                self.notes_list
-            ]),
+                self.notes_panel.list_view
+            ], expand=True),
             padding=ft.padding.all(10),
             expand=True
         )
@@ -139,42 +113,14 @@ class PostPage:
         new_note_section = ft.Container(
             content=ft.Column([
                 ft.Row([self.note_input, self.priority_input], alignment=ft.MainAxisAlignment.SPACE_BETWEEN),
-                save_button
+                ft.Row([self.schedule_input, save_button])
             ]),
             padding=ft.padding.all(10),
             expand=True
         )
 
-        # Page layout with sidebar and content
-        view = ft.View(
-            "/dashboard",
-            controls=[
-                ft.Row(
-                    expand=True,
-                    controls=[
-                        # Sidebar
-                        ft.Container(
-                            expand=1,
-                            content=ft.Column(controls=[logotype, sidebar_menu]),
-                            bgcolor=secondaryBqColor,
-                        ),
-                        # Main content area
-                        ft.Container(
-                            image_src="images/bg_login1.webp",
-                            image_fit=ft.ImageFit.COVER,
-                            expand=4,
-                            padding=ft.padding.symmetric(15, 10),
-                            content=ft.Column([header, new_note_section, notes_section]),
-                            bgcolor=secondaryBqColor
-                        )
-                    ]
-                )
-            ], bgcolor=defaultBqColor, padding=0
-        )
-
-        # Load notes on page load
-        page.on_load = lambda e: self.load_notes()
-        return view
+        # Note editor above the notes list; the shell supplies the sidebar and header
+        return ft.Column([new_note_section, notes_section])
 
     # Save note and reset fields
     def save_note_handler(self, e):
@@ -183,50 +129,100 @@ class PostPage:
 
         if note_text and priority_text:
             priority = int(priority_text.split(" - ")[0])  # Extract priority as an integer
-            user_id = 1  # Use a user ID placeholder; replace in production
-
-            # Save note to database
-            self.db.create_note(user_id, note_text, priority)
+            user_id = self.user_id
+
+            # Optional publish-at time; the note is scheduled once it has a real id
+            scheduled_at = None
+            if self.schedule_input.value:
+                try:
+                    scheduled_at = datetime.strptime(self.schedule_input.value.strip(), self.schedule_format).timestamp()
+                except ValueError:
+                    self.schedule_input.error_text = "Use YYYY-MM-DD HH:MM"
+                    self.schedule_input.update()
+                    return
+            self.schedule_input.error_text = None
+
+            # Show the note optimistically under a temporary id instead of reloading the list. The row is added
+            # before the note is queued, so the batch cannot commit before there is a row to give the real id to.
+            write_queue = self.db.write_queue
+            temp_id = write_queue.reserve_id()
+            created_at = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+            self.notes_panel.insert_note((temp_id, user_id, note_text, priority, created_at, scheduled_at))
+
+            # Queue the note; it is committed with the next write-behind batch
+            write_queue.create_note(user_id, note_text, priority, temp_id=temp_id,
+                                    on_done=lambda note_id: self.note_saved(temp_id, note_id, scheduled_at))
 
             # Clear input fields after saving
             self.note_input.value = ""
             self.priority_input.value = None
-
-            # Reload notes view
-            self.load_notes()
+            self.schedule_input.value = ""
             self.note_input.update()
             self.priority_input.update()
-            self.notes_list.update()
+            self.schedule_input.update()
 
-    # Load and display notes, with optional search and sorting
+    # Load and display the first page of notes, with optional search and sorting
     def load_notes(self, search_query="", sort_by="priority"):
-        self.notes_list.controls.clear()  # Clear the list before loading
-
-        # Fetch notes from the database based on search and sorting
-        notes = self.db.get_user_notes_sorted(search_query, sort_by)
-
-        # Create a display for each note
-        for note in notes:
-            note_control = ft.Row(
-                controls=[
-                    ft.Text(note[2]),  # Note text
-                    ft.Text(f"Priority: {note[3]}"),  # Priority
-                    ft.IconButton(icon=ft.icons.DELETE,
-                                  on_click=lambda e, note_id=note[0]: self.delete_note_handler(note_id))  # Delete button
-                ],
-                alignment=ft.MainAxisAlignment.SPACE_BETWEEN
-            )
-            self.notes_list.controls.append(note_control)
-
-        self.notes_list.update()
-
-    # Update notes view on search or sort change
-    def update_notes_view(self, e):
+        self.notes_panel.load(search_query, sort_by)
+
+    # Update notes view on search or sort change; typing is debounced, a sort change applies at once
+    async def update_notes_view(self, e):
         search_query = e.control.parent.controls[0].value  # Get search input
         sort_by = e.control.parent.controls[1].value  # Get sorting preference
-        self.load_notes(search_query, sort_by)
+        debounce = None if e.control is e.control.parent.controls[0] else 0
+        self.search.submit(search_query, sort_by, debounce)
 
-    # Delete a note and refresh the list
+    # Delete a note and remove its row from the list
     def delete_note_handler(self, note_id):
-        self.db.delete_note(note_id)  # Delete note from database
-        self.load_notes()  # Reload notes after deletion
+        note = self.notes_panel.get_note(note_id)
+        if note is not None and note_id > 0 and note[5] is not None:
+            get_scheduler(self.db).cancel(note_id)  # Drop it from the heap before the row goes
+        # Queue the deletion with the next write batch
+        self.db.write_queue.delete_note(note_id, on_done=self.note_deleted)
+        self.notes_panel.remove_note(note_id)  # Send only the removed row
+
+    # Called from the write-behind thread once a queued deletion is committed (note_id is None if it failed)
+    def note_deleted(self, note_id):
+        if note_id is None:
+            # The row was removed optimistically; show the stored notes again
+            self.load_notes(self.notes_panel.search_query, self.notes_panel.sort_by)
+            self.show_message("The note could not be deleted, please try again")
+
+    # Called from the write-behind thread once a queued note is committed (note_id is None if it failed)
+    def note_saved(self, temp_id, note_id, scheduled_at=None):
+        if note_id is None:
+            note = self.notes_panel.get_note(temp_id)
+            self.notes_panel.remove_note(temp_id)
+            # Give the text back so it is not lost, unless the user has started a new note
+            if note is not None and not self.note_input.value:
+                self.note_input.value = note[2]
+                self.note_input.update()
+            self.show_message("The note could not be saved, please try again")
+            return
+        if scheduled_at is not None:
+            get_scheduler(self.db).schedule(note_id, scheduled_at)
+        if self.notes_panel.search_query:
+            # The optimistic row could not be matched against the search, reload now that it is stored
+            self.load_notes(self.notes_panel.search_query, self.notes_panel.sort_by)
+        else:
+            self.notes_panel.rekey(temp_id, note_id)
+
+    # Queue a note for publishing to the configured channel; delivery happens in the background
+    def publish_note_handler(self, note_id):
+        note = self.notes_panel.get_note(note_id)
+        channel_link = get_settings(self.db).get('CHANNEL_LINK')
+        if note is None or note_id < 0 or not channel_link:
+            message = "Set the channel link on the dashboard first" if not channel_link else "Note is still saving"
+        else:
+            _, status = get_publisher(self.db).publish(note_id, chat_id_from_link(channel_link), note[2])
+            if status == 'sent':
+                message = "This text was already published to the channel"
+            else:
+                message = "Post queued for publishing"
+        self.show_message(message)
+
+    # Show a short message at the bottom of the page
+    def show_message(self, message):
+        self.page.snack_bar = ft.SnackBar(ft.Text(message))
+        self.page.snack_bar.open = True
+        self.page.update()
@@ -1,10 +1,10 @@
 import flet as ft  # Importing Flet for building the UI
-import time  # Importing time for delay in redirection
+import asyncio  # Importing asyncio for delay in redirection
 from pages.login import LoginPage  # Importing login page for navigation
-from utils.Database import Database  # Importing database operations
+from utils.Repository import open_database  # Importing database operations
 from utils.style import *  # Importing style variables for consistency
 from utils.Validation import Validation  # Importing validation utilities
-from utils.function import hesh_password  # Importing password hashing function
+from utils.PasswordHasher import get_password_hasher  # Salted password hashing on a worker pool
 
 
 class SignupPage:
@@ -12,7 +12,11 @@ class SignupPage:
     validators = Validation()
 
     def __init__(self):
-        # Define the email input field with error-clearing on change
+        # Shared database handle, opened on first use; connections come from the process-wide pool
+        self._db = None
+        self.hasher = get_password_hasher()
+
+        # Define the email input field with error-clearing and availability hint on change
         self.email_input = ft.Container(
             content=ft.TextField(
                 label="Email",
@@ -20,12 +24,12 @@ class SignupPage:
                 border=ft.InputBorder.NONE,  # No border style
                 filled=True,
                 color=secondaryFontColor,  # Font color for input text
-                on_change=self.clear_error  # Clear error when field changes
+                on_change=lambda e: self.check_availability(e, 'email')  # Clear error and show availability
             ),
             border_radius=15,  # Rounded corners for container
         )
 
-        # Define the login input field with error-clearing on change
+        # Define the login input field with error-clearing and availability hint on change
         self.login_input = ft.Container(
             content=ft.TextField(
                 label="Login",
@@ -33,7 +37,7 @@ class SignupPage:
                 border=ft.InputBorder.NONE,
                 filled=True,
                 color=secondaryFontColor,
-                on_change=self.clear_error
+                on_change=lambda e: self.check_availability(e, 'login')
             ),
             border_radius=15,
         )
@@ -71,19 +75,35 @@ class SignupPage:
         # Text element for displaying error messages to the user
         self.error_field = ft.Text('', color='red')
 
+    # Database handle, opened when first needed rather than at import or construction
+    @property
+    def db(self):
+        if self._db is None:
+            self._db = open_database()
+        return self._db
+
     # Clear error message when input changes
     def clear_error(self, e):
         self.error_field.value = ""
         self.error_field.update()
 
+    # Show whether the typed email or login is free; the Bloom filter answers most keystrokes without a query
+    def check_availability(self, e, column):
+        self.clear_error(e)
+        value = e.control.value
+
+        if not value or (column == 'email' and not self.validators.is_valid_email(value)):
+            e.control.helper_text = None
+        elif not (self.db.check_email(value) if column == 'email' else self.db.check_login(value)):
+            e.control.helper_text = f"This {column} is available"
+        else:
+            e.control.helper_text = f"This {column} is already taken"
+        e.control.update()
+
     # Define the layout of the signup page
     def view(self, page: ft.Page):
-        # Setup basic page properties
+        # Setup basic page properties; fonts and window size are configured once in main
         page.title = "Page Registration"
-        page.window.width = defaultWidthWindows
-        page.window.height = defaultHeightWindows
-        page.window.min_width = 800
-        page.window.min_height = 400
 
         # Link to redirect to the login page
         login_link = ft.Container(
@@ -91,11 +111,8 @@ class SignupPage:
             on_click=lambda e: page.go('/'),  # Redirect to login page
         )
 
-        # Load custom fonts for the page
-        page.fonts = {"muller-extrabold": "fonts/muller-extrabold.ttf"}
-
-        # Function to handle user signup
-        def signup(e):
+        # Function to handle user signup; hashing runs on the hasher's worker pool
+        async def signup(e):
             # Retrieve values from input fields
             email_value = self.email_input.content.value
             login_value = self.login_input.content.value
@@ -104,8 +121,6 @@ class SignupPage:
 
             # Validate fields
             if email_value and login_value and password_value and confirm_password_value:
-                db = Database()  # Initialize database connection
-
                 # Check email format
                 if not self.validators.is_valid_email(email_value):
                     self.email_input.content.bgcolor = inputBqErrorColor
@@ -114,8 +129,8 @@ class SignupPage:
                     self.email_input.update()
                     self.error_field.update()
 
-                # Check if email is already in use
-                elif db.check_email(email_value):
+                # Check if email is already in use (answered from the lookup cache when possible)
+                elif await asyncio.to_thread(self.db.check_email, email_value):
                     self.email_input.content.bgcolor = inputBqErrorColor
                     self.error_field.value = "This email is already taken"
                     self.error_field.size = 12
@@ -123,7 +138,7 @@ class SignupPage:
                     self.error_field.update()
 
                 # Check if login is already taken
-                elif db.check_login(login_value):
+                elif await asyncio.to_thread(self.db.check_login, login_value):
                     self.login_input.content.bgcolor = inputBqErrorColor
                     self.error_field.value = "This login is already taken"
                     self.error_field.size = 12
@@ -146,12 +161,25 @@ class SignupPage:
 
                 # If all validations pass, register the user
                 else:
-                    db.register_user(email_value, login_value, hesh_password(password_value))
+                    password_hash = await self.hasher.hash_async(password_value)
+                    user_id, conflict = await asyncio.to_thread(self.db.register_user, email_value, login_value,
+                                                                password_hash)
+
+                    # Someone else took the email or login after the checks above
+                    if conflict:
+                        field = self.email_input if conflict == 'email' else self.login_input
+                        field.content.bgcolor = inputBqErrorColor
+                        self.error_field.value = f"This {conflict} is already taken"
+                        self.error_field.size = 12
+                        field.update()
+                        self.error_field.update()
+                        return
+
                     self.error_field.value = "Registration successful!"
                     self.error_field.size = 12
                     self.error_field.color = ft.colors.GREEN
                     self.error_field.update()
-                    time.sleep(2)  # Delay before redirecting
+                    await asyncio.sleep(2)  # Delay before redirecting
                     page.go("/")  # Redirect to login page
 
             else:
@@ -196,7 +224,7 @@ class SignupPage:
                                         alignment=ft.alignment.center,
                                         height=40,
                                         bgcolor=hoverBqColor,  # Button background color
-                                        on_click=lambda e: signup(e),  # Trigger signup on click
+                                        on_click=signup,  # Trigger signup on click
                                     ),
                                     login_link  # Link to login page
                                 ]
@@ -1,27 +1,76 @@
+import importlib  # Page modules are imported on the first visit of their route
+from collections import OrderedDict  # Least recently used ordering for cached views
+
 import flet as ft
 
-from pages.login import LoginPage
-from pages.signup import SignupPage
-from pages.dashboard import DashboardPage
-from pages.posting import PostPage
+from pages.layout import ShellLayout  # Persistent sidebar and header for signed-in routes
+from utils import startup  # First-frame mark for --profile-startup
+from utils import uiprofile  # Build timing for --profile-ui
+from utils.Sessions import current_user_id  # Signed-in user of the Flet session
+
+
+# View cache policies
+REBUILD = 'rebuild'  # Build a fresh view on every visit
+KEEP_ALIVE = 'keep-alive'  # Build once per session and always reuse
+LRU = 'lru'  # Reuse while among the most recently visited LRU routes
+
+
+# Per-session cache of built views following each route's policy
+class ViewCache:
+
+    def __init__(self, max_size=2):
+        self.max_size = max_size  # Views kept for LRU routes; keep-alive views are not counted
+        self._keep_alive = {}
+        self._lru = OrderedDict()
+
+    # Return the cached view for a route, building it with build() when the policy requires
+    def get(self, route, policy, build):
+        if policy == KEEP_ALIVE:
+            if route not in self._keep_alive:
+                self._keep_alive[route] = build()
+            return self._keep_alive[route]
 
+        if policy == LRU:
+            if route in self._lru:
+                self._lru.move_to_end(route)
+                return self._lru[route]
+            view = build()
+            self._lru[route] = view
+            while len(self._lru) > self.max_size:
+                self._lru.popitem(last=False)
+            return view
 
+        return build()
 
+    # Routes whose view is currently cached
+    def cached_routes(self):
+        return set(self._keep_alive) | set(self._lru)
 
+    # Forget cached views, e.g. after logout
+    def clear(self):
+        self._keep_alive.clear()
+        self._lru.clear()
 
 
 class Router:
     def __init__(self, page: ft.Page):
         self.page = page
 
-        # Define routing table
+        # Define routing table: route -> (module, page class, cache policy); pages are imported on first visit
         self.app_router = {
-            "/": LoginPage().view,
-            "/signup": SignupPage().view,
-            "/dashboard": DashboardPage().view,
-            "/posting": PostPage().view
-
+            "/": ("pages.login", "LoginPage", REBUILD),
+            "/signup": ("pages.signup", "SignupPage", REBUILD),
+            "/dashboard": ("pages.dashboard", "DashboardPage", KEEP_ALIVE),
+            "/posting": ("pages.posting", "PostPage", LRU),
         }
+        self.pages = {}
+        self.views = ViewCache()
+
+        # Routes rendered inside the shared shell; their pages provide content() instead of view()
+        # and are only shown to a signed-in session
+        self.shell_routes = {"/dashboard", "/posting"}
+        self.shell = None
+        self.user_id = None  # User the cached shell views were built for
 
         # Attach route change handler
         page.on_route_change = self.route_change
@@ -29,11 +78,52 @@ class Router:
         # Go to the current route
         page.go(page.route)
 
-    def route_change(self, route, ft=None):
-        view_fn = self.app_router.get(self.page.route, None)
-        if view_fn:
+    # Page object serving a route, imported and constructed lazily
+    def get_page(self, route):
+        if route not in self.pages:
+            module_name, class_name, _ = self.app_router[route]
+            page_class = getattr(importlib.import_module(module_name), class_name)
+            self.pages[route] = page_class()
+        return self.pages[route]
+
+    def route_change(self, route):
+        route = self.page.route
+        entry = self.app_router.get(route)
+        if entry and route in self.shell_routes:
+            self.show_in_shell(route, entry[2])
+        elif entry:
+            view = self.views.get(route, entry[2],
+                                  uiprofile.measure(route, 'view', lambda: self.get_page(route).view(self.page)))
             self.page.views.clear()  # Clear the previous view if needed
-            self.page.views.append(view_fn(self.page))  # Load the new view
+            self.page.views.append(view)  # Load the new view
         else:
-            self.page.views.append(ft.Text("404 Page not found"))
-        self.page.update()  # Refresh the page
\ No newline at end of file
+            self.page.views.clear()
+            self.page.views.append(ft.View(route, controls=[ft.Text("404 Page not found")]))
+        self.page.update()  # Refresh the page
+        startup.first_frame()
+
+    # Swap the shell's content region, building the shell on the first signed-in route
+    def show_in_shell(self, route, policy):
+        user_id = current_user_id(self.page)
+        if user_id is None:
+            self.page.go('/')  # Not signed in, or the session expired
+            return
+        if user_id != self.user_id:
+            # Another user signed in to this session: drop views built with the previous user's data
+            self.user_id = user_id
+            self.views.clear()
+            self.pages = {route: page_obj for route, page_obj in self.pages.items() if route not in self.shell_routes}
+            self.shell = None
+
+        if self.shell is None:
+            self.shell = ShellLayout(self.page)
+
+        page_obj = self.get_page(route)
+        build = uiprofile.measure(route, 'content', lambda: page_obj.content(self.page))
+        content = self.views.get(route, policy, build)
+        self.shell.show(route, content, self.views.cached_routes(), getattr(page_obj, 'background_image', None))
+        self.page.title = page_obj.title
+
+        if not self.page.views or self.page.views[-1] is not self.shell.view:
+            self.page.views.clear()
+            self.page.views.append(self.shell.view)
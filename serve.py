@@ -0,0 +1,51 @@
+# Serve the app to web browsers from several worker processes behind one port.
+# Run from the project root: python serve.py --workers 4 --port 8550
+import argparse
+import asyncio
+import logging
+import os
+
+from utils import Cluster
+from utils.Repository import Repository, open_database
+
+
+async def run(proxy, workers):
+    await asyncio.gather(proxy.serve(), workers.supervise())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve the web app from several worker processes')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='number of worker processes')
+    parser.add_argument('--host', default='0.0.0.0', help='public address to listen on')
+    parser.add_argument('--port', type=int, default=8550, help='public port')
+    parser.add_argument('--worker-port', type=int, default=8600, help='first local port used by the workers')
+    parser.add_argument('--poll', type=float, default=2.0,
+                        help='seconds between checks for changes made by other processes')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    # The supervisor polls the shared database for posts and schedules queued by the workers
+    os.environ[Cluster.POLL_ENV] = str(args.poll)
+    from utils.Publisher import get_publisher
+    from utils.Scheduler import get_scheduler
+
+    # Create and migrate the schema once, before the workers open the database
+    db = open_database()
+    workers = Cluster.WorkerPool(args.workers, args.worker_port, poll=args.poll)
+    workers.start()
+    get_publisher(db)
+    get_scheduler(db)
+
+    proxy = Cluster.AffinityProxy(args.host, args.port, workers.backends)
+    print(f'Serving on http://{args.host}:{args.port} with {args.workers} workers')
+    try:
+        asyncio.run(run(proxy, workers))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        workers.stop()
+        Repository.close_all()
+
+
+if __name__ == '__main__':
+    main()
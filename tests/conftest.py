@@ -0,0 +1,75 @@
+import itertools  # Names of the per-test PostgreSQL databases
+import os  # Project root and TEST_POSTGRES_URL
+import sys  # Making the project importable from the tests
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.Repository import Repository, open_database  # noqa: E402
+
+# Every storage test runs once per backend. SQLite uses a file in the test's temporary directory.
+# PostgreSQL runs against TEST_POSTGRES_URL when set (a server the tests may create databases on), otherwise
+# against a throwaway local server started with pgserver (pip install pgserver "psycopg[binary]" psycopg_pool),
+# no container needed. Without psycopg or a server the PostgreSQL cases are skipped.
+
+_database_names = (f'notes_test_{os.getpid()}_{i}' for i in itertools.count())
+
+
+# Admin URL of the PostgreSQL server used for the whole session
+@pytest.fixture(scope='session')
+def postgres_server(tmp_path_factory):
+    pytest.importorskip('psycopg')
+    pytest.importorskip('psycopg_pool')
+    url = os.getenv('TEST_POSTGRES_URL')
+    if url:
+        yield url
+        return
+
+    pgserver = pytest.importorskip('pgserver')
+    server = pgserver.get_server(tmp_path_factory.mktemp('pgdata'), cleanup_mode='stop')
+    yield server.get_uri()
+    server.cleanup()
+
+
+# Create an empty database on the session's server and return its URL
+def create_postgres_database(admin_url):
+    import psycopg
+    from urllib.parse import urlsplit, urlunsplit
+
+    name = next(_database_names)
+    with psycopg.connect(admin_url, autocommit=True) as conn:
+        conn.execute(f'CREATE DATABASE {name}')
+    return urlunsplit(urlsplit(admin_url)._replace(path='/' + name))
+
+
+# URL of an empty database for one test, on each backend in turn
+@pytest.fixture(params=['sqlite', 'postgres'])
+def db_url(request, tmp_path):
+    if request.param == 'sqlite':
+        yield str(tmp_path / 'app.db')
+    else:
+        yield create_postgres_database(request.getfixturevalue('postgres_server'))
+    Repository.close_all()
+
+
+# Open repository for the test's database
+@pytest.fixture
+def db(db_url):
+    return open_database(db_url)
+
+
+# Function running one statement written with ? placeholders on the test database, bypassing the repository
+# (to set up rows the application would never write itself); returns the fetched rows, if any
+@pytest.fixture
+def sql(db):
+    from utils.PostgresDatabase import PostgresDatabase
+
+    def execute(statement, params=()):
+        if isinstance(db, PostgresDatabase):
+            statement = statement.replace('?', '%s')
+        with db.connection() as conn:
+            cursor = conn.execute(statement, params)
+            return cursor.fetchall() if cursor.description else None
+
+    return execute
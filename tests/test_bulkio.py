@@ -0,0 +1,24 @@
+import pytest
+
+from utils import BulkIO
+
+
+@pytest.mark.parametrize('fmt', BulkIO.FORMATS)
+def test_export_import_round_trip(db, tmp_path, fmt):
+    db.create_note(1, 'plain', None)
+    scheduled = db.create_note(1, 'scheduled', 2)
+    db.schedule_note(scheduled, 4102444800.5)
+    db.create_note(2, 'other user', 1)
+
+    path = str(tmp_path / f'notes.{fmt}')
+    assert BulkIO.export_notes(db, path) == 3
+    exported = sorted(note[1:] for note in db.iter_notes())
+
+    for note in list(db.iter_notes()):
+        db.delete_note(note[0])
+    assert BulkIO.import_notes(db, path) == (3, 0)
+    assert sorted(note[1:] for note in db.iter_notes()) == exported
+    assert [at for _, at in db.scheduled_notes()] == [4102444800.5]
+
+    # Importing again only finds duplicates
+    assert BulkIO.import_notes(db, path, user_id=1) == (1, 2)
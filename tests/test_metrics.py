@@ -0,0 +1,90 @@
+import logging
+import urllib.request
+
+import pytest
+
+from utils import Metrics
+from utils.Metrics import QueryMetrics, instrument
+from utils.Repository import open_database
+
+
+# Open the test database with its storage methods traced by metrics, without wrapping the backend classes
+# for the rest of the test session: the repository gets a traced subclass of its own
+def traced_database(db_url, monkeypatch, metrics):
+    monkeypatch.setattr(Metrics, '_metrics', metrics)  # Connections opened from now on report their statements
+    db = open_database(db_url)
+    traced_class = type(type(db).__name__, (type(db),), {})
+    instrument(traced_class, metrics)
+    db.__class__ = traced_class
+    return db
+
+
+# Value of one sample line of a Prometheus text export
+def sample(text, line_start):
+    values = [line.rsplit(' ', 1)[1] for line in text.splitlines() if line.startswith(line_start + ' ')]
+    assert len(values) == 1, line_start
+    return float(values[0])
+
+
+def test_prometheus_export(db_url, monkeypatch, tmp_path):
+    metrics = QueryMetrics(slow_threshold=60)
+    db = traced_database(db_url, monkeypatch, metrics)
+    db.create_note(1, 'first', 1)
+    db.get_user_notes(1)
+    db.create_note(1, 'second', 2)
+    db.get_user_notes(1)
+    with pytest.raises(ValueError):
+        db.get_notes_page(sort_by='colour')
+
+    text = metrics.prometheus()
+    assert '# TYPE db_call_duration_seconds histogram' in text and '# TYPE db_call_errors_total counter' in text
+    assert sample(text, 'db_call_duration_seconds_count{method="get_user_notes"}') == 2
+    assert sample(text, 'db_call_duration_seconds_bucket{method="get_user_notes",le="+Inf"}') == 2
+    assert sample(text, 'db_call_duration_seconds_sum{method="get_user_notes"}') > 0
+    assert sample(text, 'db_call_rows_bucket{method="get_user_notes",le="0"}') == 0
+    assert sample(text, 'db_call_rows_bucket{method="get_user_notes",le="1"}') == 1  # One note, then two
+    assert sample(text, 'db_call_rows_bucket{method="get_user_notes",le="5"}') == 2
+    assert sample(text, 'db_call_rows_sum{method="get_user_notes"}') == 3
+    assert sample(text, 'db_call_errors_total{method="get_notes_page"}') == 1
+    assert 'db_slow_calls_total{' not in text
+
+    buckets = [float(line.rsplit(' ', 1)[1]) for line in text.splitlines()
+               if line.startswith('db_call_duration_seconds_bucket{method="create_note"')]
+    assert len(buckets) == len(Metrics.LATENCY_BUCKETS) + 1 and buckets == sorted(buckets) and buckets[-1] == 2
+
+    path = tmp_path / 'db.prom'
+    metrics.write(str(path))
+    assert path.read_text(encoding='utf-8') == text
+
+    server = metrics.serve(0)
+    try:
+        with urllib.request.urlopen(f'http://127.0.0.1:{server.server_port}/metrics', timeout=5) as response:
+            assert response.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+            assert response.read().decode() == metrics.prometheus()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_slow_calls_are_logged_with_their_query_plans(db_url, monkeypatch, caplog):
+    metrics = QueryMetrics(slow_threshold=0, explain=True)  # Every call counts as slow
+    db = traced_database(db_url, monkeypatch, metrics)
+    db.create_note(1, 'first', 1)
+    with caplog.at_level(logging.WARNING, logger='utils.Metrics'):
+        db.get_user_notes(1)
+
+    write = next(entry for entry in metrics.slow_log if entry['method'] == 'create_note')
+    insert = next(sql for sql in write['sql'] if sql.startswith('INSERT'))
+    assert insert not in write['plans']  # Only reads are explained
+
+    entry = metrics.slow_log[-1]
+    assert entry['method'] == 'get_user_notes' and entry['rows'] == 1
+    select = next(sql for sql in entry['sql'] if sql.startswith('SELECT') and 'FROM notes' in sql)
+    assert entry['plans'][select] and all(isinstance(line, str) for line in entry['plans'][select])
+    assert 'notes' in ' '.join(entry['plans'][select])
+    assert not any(sql.startswith('EXPLAIN') for logged in metrics.slow_log for sql in logged['sql'])
+
+    message = caplog.records[-1].getMessage()
+    assert message.startswith('Slow call get_user_notes:') and select in message
+    assert f'    {entry["plans"][select][0]}' in message.splitlines()
+    assert sample(metrics.prometheus(), 'db_slow_calls_total{method="get_user_notes"}') == 1
@@ -0,0 +1,83 @@
+import time
+
+from utils import PasswordHasher as password_hashing
+from utils.PasswordHasher import PasswordHasher
+from utils.function import hesh_password
+
+
+def test_hashes_verify_in_every_format():
+    for hasher in (PasswordHasher(iterations=1000), PasswordHasher('scrypt', scrypt_n=2 ** 4)):
+        stored = hasher.hash('secret')
+        assert hasher.verify('secret', stored) and not hasher.verify('wrong', stored)
+    assert PasswordHasher().verify('secret', hesh_password('secret'))
+    assert not PasswordHasher().verify('secret', 'pbkdf2_sha256$x$y')
+
+
+def test_only_weaker_hashes_need_a_rehash():
+    hasher = PasswordHasher(iterations=2000)
+    assert not hasher.needs_rehash(hasher.hash('secret'))
+    assert not hasher.needs_rehash(PasswordHasher(iterations=5000).hash('secret'))
+    assert hasher.needs_rehash(PasswordHasher(iterations=1000).hash('secret'))
+    assert hasher.needs_rehash(PasswordHasher('scrypt', scrypt_n=2 ** 4).hash('secret'))
+    assert hasher.needs_rehash(hesh_password('secret'))
+    assert hasher.needs_rehash('pbkdf2_sha256')
+
+    scrypt = PasswordHasher('scrypt', scrypt_n=2 ** 5)
+    assert not scrypt.needs_rehash(PasswordHasher('scrypt', scrypt_n=2 ** 6).hash('secret'))
+    assert scrypt.needs_rehash(PasswordHasher('scrypt', scrypt_n=2 ** 4).hash('secret'))
+
+
+def test_calibration_does_not_block_the_caller(monkeypatch):
+    monkeypatch.setattr(password_hashing, '_hasher', None)
+    monkeypatch.setenv('PASSWORD_HASH_ITERATIONS', '1000')
+    monkeypatch.setenv('PASSWORD_HASH_TARGET_MS', '50')
+    calibrated = []
+
+    def slow_calibrate(self, target_ms=250, sample_iterations=20000):
+        time.sleep(0.5)
+        self.iterations = 4000
+        calibrated.append(target_ms)
+
+    monkeypatch.setattr(PasswordHasher, 'calibrate', slow_calibrate)
+    start = time.perf_counter()
+    hasher = password_hashing.get_password_hasher()
+    assert time.perf_counter() - start < 0.25
+    assert hasher.iterations == 1000 and calibrated == []
+
+    deadline = time.monotonic() + 5
+    while not calibrated and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert calibrated == [50.0] and hasher.iterations == 4000
+    hasher.close()
+
+
+def test_scrypt_calibration_tunes_n():
+    hasher = PasswordHasher('scrypt', scrypt_n=2 ** 10)
+    start = time.perf_counter()
+    hasher._scrypt('x', b'salt', 2 ** 10, 8, 1)
+    sample_ms = (time.perf_counter() - start) * 1000
+
+    n = hasher.calibrate(target_ms=sample_ms * 8)
+    assert n == hasher.scrypt_n and 2 ** 11 <= n <= 2 ** 15 and n & (n - 1) == 0
+    assert hasher.verify('secret', hasher.hash('secret'))
+
+    hasher.scrypt_max_memory = 128 * 8 * 2 ** 12
+    assert hasher.calibrate(target_ms=10 ** 6) == 2 ** 12
+
+
+def test_unknown_account_costs_a_hash_check():
+    hasher = PasswordHasher(iterations=200000)
+    stored = hasher.hash('secret')
+    assert not hasher.verify('secret', None)  # Builds the dummy hash
+
+    start = time.perf_counter()
+    assert not hasher.verify('secret', None)
+    unknown = time.perf_counter() - start
+    start = time.perf_counter()
+    assert not hasher.verify('wrong', stored)
+    known = time.perf_counter() - start
+    assert unknown > known / 3
+
+    dummy = hasher.dummy_hash()
+    hasher.iterations = 300000
+    assert hasher.dummy_hash() != dummy and not hasher.needs_rehash(hasher.dummy_hash())
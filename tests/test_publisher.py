@@ -0,0 +1,170 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from utils.Database import Database
+from utils.Publisher import Publisher, TelegramTransport
+from utils.Repository import Repository
+
+
+# Local Bot API stub: answers each request with the next queued (status, body), 200 OK once the queue is empty
+class BotApiStub:
+
+    def __init__(self):
+        self.responses = []
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                stub.requests.append((self.path, body))
+                status, response = stub.responses.pop(0) if stub.responses else (200, {'ok': True, 'result': {}})
+                data = json.dumps(response).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def db(tmp_path):
+    yield Database(str(tmp_path / 'app.db'))
+    Repository.close_all()
+
+
+@pytest.fixture
+def api():
+    stub = BotApiStub()
+    yield stub
+    stub.close()
+
+
+@pytest.fixture
+def publisher(db, api):
+    return Publisher(db, lambda: 'TOKEN', TelegramTransport(api.url, timeout=5), per_chat_burst=10, global_rate=100)
+
+
+def deliver_due(publisher):
+    for post in publisher.db.due_posts(time.time()):
+        asyncio.run(publisher.deliver(*post))
+
+
+def test_sent_post_leaves_the_queue(db, api, publisher):
+    db.enqueue_post(None, '@channel', 'Hello')
+    deliver_due(publisher)
+    assert api.requests == [('/botTOKEN/sendMessage', {'chat_id': '@channel', 'text': 'Hello'})]
+    assert db.next_post_due() is None
+
+
+def test_rate_limited_post_waits_retry_after(db, api, publisher):
+    post_id, _ = db.enqueue_post(None, '@channel', 'Hello')
+    api.responses.append((429, {'ok': False, 'description': 'Too Many Requests', 'parameters': {'retry_after': 30}}))
+    start = time.time()
+    deliver_due(publisher)
+    assert start + 30 <= db.next_post_due() <= time.time() + 33  # Up to 10% jitter
+    assert db.due_posts(time.time()) == []
+    assert db.due_posts(time.time() + 34) == [(post_id, '@channel', 'Hello', 1)]
+
+
+def test_server_errors_back_off_exponentially(db, api, publisher):
+    post_id, _ = db.enqueue_post(None, '@channel', 'Hello')
+    api.responses += [(502, {'ok': False, 'description': 'Bad Gateway'})] * 2
+    start = time.time()
+    deliver_due(publisher)
+    assert start + 2 <= db.next_post_due() <= time.time() + 2.2
+
+    post = db.due_posts(time.time() + 3)[0]
+    asyncio.run(publisher.deliver(*post))
+    assert post[3] == 1 and start + 4 <= db.next_post_due() <= time.time() + 4.4
+    assert db.due_posts(time.time() + 5) == [(post_id, '@channel', 'Hello', 2)]
+
+
+def test_client_errors_are_not_retried(db, api, publisher):
+    db.enqueue_post(None, '@missing', 'Hello')
+    api.responses.append((400, {'ok': False, 'description': 'Bad Request: chat not found'}))
+    deliver_due(publisher)
+    assert len(api.requests) == 1
+    assert db.next_post_due() is None
+    assert db.due_posts(time.time() + 10 ** 6) == []
+
+
+def test_worker_survives_database_errors(db, api, publisher):
+    db.enqueue_post(None, '@channel', 'Hello')
+    due_posts = db.due_posts
+    calls = []
+
+    # The first two reads of the outbox fail, as they would while the database is locked or unreachable
+    def flaky_due_posts(now):
+        calls.append(now)
+        if len(calls) <= 2:
+            raise RuntimeError('database is unavailable')
+        return due_posts(now)
+
+    db.due_posts = flaky_due_posts
+    publisher.base_delay = 0.01
+
+    async def run_until_sent():
+        worker = asyncio.ensure_future(publisher.run())
+        try:
+            while not api.requests:
+                assert not worker.done(), worker
+                await asyncio.sleep(0.01)
+        finally:
+            worker.cancel()
+
+    asyncio.run(asyncio.wait_for(run_until_sent(), 10))
+    assert len(calls) >= 3 and len(api.requests) == 1
+
+
+def test_published_text_is_reported_instead_of_queued_again(db, api, publisher):
+    assert publisher.publish(None, '@channel', 'Hello')[1] == 'pending'
+    deliver_due(publisher)
+    post_id, status = publisher.publish(None, '@channel', 'hello')
+    assert status == 'sent' and db.next_post_due() is None and len(api.requests) == 1
+
+
+def test_post_queued_during_a_pass_is_not_missed(db, api, publisher):
+    next_post_due = db.next_post_due
+    queued = []
+
+    # A post arrives after the worker found the outbox empty but before it goes to sleep
+    def queue_while_checking():
+        due = next_post_due()
+        if not queued:
+            queued.append(True)
+            publisher.loop.call_soon_threadsafe(publisher.publish, None, '@channel', 'Late')
+            time.sleep(0.1)
+        return due
+
+    db.next_post_due = queue_while_checking
+
+    async def run_until_sent():
+        publisher.loop = asyncio.get_running_loop()
+        publisher._wake = asyncio.Event()
+        worker = asyncio.ensure_future(publisher.run())
+        try:
+            while not api.requests:
+                await asyncio.sleep(0.01)
+        finally:
+            worker.cancel()
+
+    asyncio.run(asyncio.wait_for(run_until_sent(), 5))
+    assert api.requests[0][1]['text'] == 'Late'
@@ -0,0 +1,439 @@
+import threading
+import time
+from contextlib import contextmanager
+
+import pytest
+
+from utils.Database import Database
+from utils.Repository import Repository, open_database
+from utils.SortedIndex import SortedNoteIndex
+
+
+def is_postgres(db):
+    return not isinstance(db, Database)
+
+
+# Notes of two users with NULL, repeated and distinct priorities; returns {note_id: (user_id, text, priority)}
+def add_notes(db, count=40):
+    notes = {}
+    for i in range(count):
+        user_id = 1 + i % 2
+        priority = None if i % 7 == 0 else i % 4
+        text = f'note {i} about {"apples" if i % 3 else "pears"}'
+        notes[db.create_note(user_id, text, priority)] = (user_id, text, priority)
+    return notes
+
+
+# All pages of a listing read through get_notes_page (or the SQL path with use_index False)
+def read_pages(db, search_query='', sort_by='priority', user_id=None, page_size=7, use_index=True):
+    rows, after = [], (None, None)
+    while True:
+        if use_index:
+            page = db.get_notes_page(search_query, sort_by, *after, page_size=page_size, user_id=user_id)
+        else:
+            page = db._select_notes_page(search_query, sort_by, *after, page_size, user_id)
+        rows += page
+        if len(page) < page_size:
+            return rows
+        after = db.note_cursor(page[-1], sort_by)
+
+
+# Backend on a pool of its own, as another process would have; the schema is not created
+def separate_backend(db_url):
+    if db_url.startswith('postgresql://'):
+        from utils.PostgresDatabase import PostgresDatabase, PostgresPool
+        backend = PostgresDatabase.__new__(PostgresDatabase)
+        backend.pool = PostgresPool(db_url, 2)
+    else:
+        from utils.Database import ConnectionPool, get_storage_profile
+        backend = Database.__new__(Database)
+        backend.pool = ConnectionPool(db_url, get_storage_profile(None))
+    backend.path = db_url
+    return backend
+
+
+def expected_order(notes, sort_by):
+    position = {'priority': 3, 'date': 4}[sort_by]
+    return sorted(notes, key=lambda note: SortedNoteIndex.key(note[position], note[0]))
+
+
+class TestInterface:
+
+    def test_incomplete_backend_cannot_be_created(self):
+        class Incomplete(Repository):
+            def create_db(self):
+                pass
+
+        with pytest.raises(TypeError, match='abstract'):
+            Incomplete()
+
+    def test_open_database_picks_the_backend(self, db_url):
+        backend = open_database(db_url)
+        assert is_postgres(backend) == db_url.startswith('postgresql://')
+        assert open_database(db_url).pool is backend.pool  # One pool per database
+
+
+class TestUsers:
+
+    def test_register_and_conflicts(self, db):
+        user_id, conflict = db.register_user('ann@example.com', 'ann', 'hash1')
+        assert conflict is None and user_id
+
+        assert db.register_user('ann@example.com', 'other', 'hash2') == (None, 'email')
+        assert db.register_user('new@example.com', 'ann', 'hash2') == (None, 'login')
+        assert db.check_email('ann@example.com') and db.check_login('ann')
+        assert not db.check_email('nobody@example.com') and not db.check_login('nobody')
+
+        assert db.get_credentials('ann@example.com') == (user_id, 'hash1')
+        assert db.get_credentials('nobody@example.com') is None
+        db.update_password(user_id, 'hash3')
+        assert db.get_credentials('ann@example.com') == (user_id, 'hash3')
+
+    def test_identifier_filter_is_rebuilt_from_the_table(self, db):
+        db.register_user('bob@example.com', 'bob', 'hash')
+        identifier_filter = db.rebuild_identifier_filter(capacity=100)
+        assert 'email:bob@example.com' in identifier_filter and 'login:bob' in identifier_filter
+        assert db.may_be_taken('login', 'bob')
+
+    def test_full_identifier_filter_is_rebuilt_in_the_background(self, db):
+        small = db.rebuild_identifier_filter(capacity=4)
+        db.register_user('carol@example.com', 'carol', 'hash')
+        assert db.pool.identifier_filter is small  # 2 identifiers of 4
+        db.register_user('dave@example.com', 'dave', 'hash')
+
+        deadline = time.monotonic() + 5
+        while db.pool.identifier_filter is small and time.monotonic() < deadline:
+            time.sleep(0.01)
+        rebuilt = db.pool.identifier_filter
+        assert rebuilt is not small and rebuilt.capacity > 4 and rebuilt.count == 4
+        assert all(db.may_be_taken(*identifier) for identifier in
+                   [('email', 'carol@example.com'), ('login', 'carol'), ('email', 'dave@example.com'), ('login', 'dave')])
+
+
+    def test_registration_during_a_rebuild_reaches_the_new_filter(self, db):
+        connection = db.connection
+        registered = []
+
+        # Another session registers right after the rebuild has read the users table
+        @contextmanager
+        def connection_then_register():
+            with connection() as conn:
+                yield conn
+            if not registered:
+                registered.append(True)
+                thread = threading.Thread(target=db.register_user, args=('erin@example.com', 'erin', 'hash'))
+                thread.start()
+                thread.join()
+
+        db.connection = connection_then_register
+        rebuilt = db.rebuild_identifier_filter(capacity=100)
+        del db.connection
+        assert registered and db.pool.identifier_filter is rebuilt
+        assert 'email:erin@example.com' in rebuilt and 'login:erin' in rebuilt
+        assert db.pool.filter_backlogs == []
+
+
+    def test_worker_does_not_trust_free_answers(self, db, sql):
+        db.pool.shared_identifiers = True  # As in a web worker process
+        assert not db.check_login('frank')
+
+        # Another worker registers the login; this process's filter and cache never heard of it
+        sql("INSERT INTO users (email, login, password) VALUES ('frank@example.com', 'frank', 'hash')")
+        assert not db.may_be_taken('login', 'frank')
+        assert db.check_login('frank') and db.check_email('frank@example.com')
+
+
+class TestNotes:
+
+    def test_create_get_delete(self, db):
+        note_id = db.create_note(1, 'Buy milk', 2)
+        note = db.get_note(note_id)
+        assert note[:4] == (note_id, 1, 'Buy milk', 2)
+        assert time.strptime(note[4], '%Y-%m-%d %H:%M:%S') and note[5] is None
+
+        # Same text up to case and spacing is the same note for the same user, a new note for another user
+        assert db.create_note(1, '  buy   MILK ', 3) == note_id
+        assert db.create_note(2, 'Buy milk', 2) != note_id
+        assert db.count_notes() == 2
+        assert [row[0] for row in db.get_user_notes(1)] == [note_id]
+
+        db.delete_note(note_id)
+        assert db.get_note(note_id) is None
+        assert db.count_notes() == 1
+
+    def test_batch_and_bulk_insert(self, db):
+        first = db.create_note(1, 'first', 1)
+        ids = db.apply_note_batch([(1, 'second', 2), (1, 'FIRST', 5)], [first])
+        assert db.get_note(first) is None
+        assert db.get_note(ids[1])[2:4] == ('FIRST', 5)  # Deleted and written again: the new note survives
+        assert db.get_note(ids[0])[2] == 'second'
+        assert db.apply_note_batch([(1, 'second', 3)], []) == [ids[0]]  # A plain duplicate keeps the stored note
+
+        inserted = db.insert_notes([(1, 'imported', None, '2020-01-02 03:04:05', None), (1, 'second', 1, None, None),
+                                    (2, 'later', 4, None, 4102444800.0)])
+        assert inserted == 2  # "second" already exists for user 1
+        imported = [note for note in db.get_user_notes(1) if note[2] == 'imported'][0]
+        assert imported[3] is None and imported[4] == '2020-01-02 03:04:05'
+        assert db.scheduled_notes() == [(db.get_user_notes(2)[0][0], 4102444800.0)]
+        assert sorted(note[2] for note in db.iter_notes(chunk_size=1)) == ['FIRST', 'imported', 'later', 'second']
+
+    @pytest.mark.parametrize('sort_by', ['priority', 'date'])
+    def test_keyset_pages_match_the_full_order(self, db, sort_by):
+        add_notes(db)
+        db.insert_notes([(1, 'no date', 2, None, None)])
+        for user_id in (None, 1, 2):
+            notes = db.get_user_notes(user_id) if user_id else list(db.iter_notes())
+            expected = expected_order(notes, sort_by)
+            assert read_pages(db, sort_by=sort_by, user_id=user_id) == expected
+            assert read_pages(db, sort_by=sort_by, user_id=user_id, use_index=False) == expected
+            assert db.get_user_notes_sorted('', sort_by, user_id) == expected
+            assert db._select_notes('', sort_by, user_id) == expected
+
+    def test_index_follows_writes(self, db):
+        notes = add_notes(db, 10)
+        assert len(db.note_index(1)) == 5
+        new_id = db.create_note(1, 'fresh', None)
+        db.delete_note(next(iter(notes)))
+        db.schedule_note(new_id, 123.0)
+        listed = db.get_user_notes_sorted(user_id=1)
+        assert listed == expected_order(db.get_user_notes(1), 'priority')
+        assert (new_id, 123.0) in [(note[0], note[5]) for note in listed]
+
+    def test_index_loaded_during_a_write_is_not_kept(self, db):
+        db.create_note(1, 'first', 1)
+        load = db._load_index_notes
+
+        # Another thread commits a note after this listing read the table but before its index is installed
+        def load_then_write(user_id):
+            snapshot = load(user_id)
+            db.create_note(1, 'written meanwhile', 2)
+            return snapshot
+
+        db._load_index_notes = load_then_write
+        assert [note[2] for note in db.note_index(1).page('priority')] == ['first']
+        assert 1 not in db.pool.note_indexes
+        del db._load_index_notes
+        assert [note[2] for note in db.note_index(1).page('priority')] == ['first', 'written meanwhile']
+        assert 1 in db.pool.note_indexes
+
+    def test_index_cache_is_bounded_by_rows(self, db):
+        for user_id in (1, 2, 3):
+            for i in range(user_id * 2):
+                db.create_note(user_id, f'note {i}', i)
+        db.note_index_rows = 12
+        db.note_index(3)
+        db.note_index(2)
+        assert list(db.pool.note_indexes) == [3, 2]  # 7 + 5 rows
+        db.note_index(1)
+        assert list(db.pool.note_indexes) == [2, 1]  # 3 more would make 15, the least recently used goes
+
+    def test_cold_listing_is_served_while_the_index_loads(self, db):
+        add_notes(db, 10)
+        load = db._load_index_notes
+        loading = threading.Event()
+
+        def slow_load(user_id):
+            loading.wait(5)
+            return load(user_id)
+
+        db._load_index_notes = slow_load
+        page = db.get_notes_page(sort_by='priority', page_size=3, user_id=1)
+        assert page == expected_order(db.get_user_notes(1), 'priority')[:3]
+        assert 1 not in db.pool.note_indexes and db.pool.index_loads == {1}
+        assert db.get_notes_page(sort_by='priority', page_size=3, user_id=1) == page  # No second load starts
+
+        loading.set()
+        deadline = time.monotonic() + 5
+        while 1 not in db.pool.note_indexes and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert len(db.pool.note_indexes[1]) == 5 and db.pool.index_loads == set()
+        assert db.get_notes_page(sort_by='priority', page_size=3, user_id=1) == page
+
+    def test_unknown_sort_is_rejected(self, db):
+        with pytest.raises(ValueError):
+            db.get_notes_page(sort_by='colour')
+
+
+class TestSearch:
+
+    def test_prefix_search_and_paging(self, db):
+        notes = add_notes(db)
+        pears = [note_id for note_id, (_, text, _) in notes.items() if 'pears' in text]
+        assert sorted(note[0] for note in db.get_user_notes_sorted('pea')) == sorted(pears)
+
+        user_pears = [note_id for note_id in pears if notes[note_id][0] == 2]
+        paged = read_pages(db, 'PEAR', 'date', user_id=2, page_size=3)
+        assert sorted(note[0] for note in paged) == sorted(user_pears)
+        assert paged == expected_order(paged, 'date')
+
+    def test_ranked_search_with_snippets(self, db):
+        db.create_note(1, 'tomatoes and more tomatoes, ripe tomatoes', 1)
+        db.create_note(1, 'a single tomato salad', 1)
+        db.create_note(2, 'tomatoes elsewhere', 1)
+        db.create_note(1, 'cucumbers', 1)
+
+        rows = db.search_notes('tomat', user_id=1, highlight=('<b>', '</b>'))
+        assert [row[2] for row in rows][0].startswith('tomatoes and more')
+        assert len(rows) == 2
+        assert all('<b>' in row[6] for row in rows)
+        assert rows[0][7] <= rows[1][7]  # Lower rank is better
+
+    def test_query_without_words_falls_back_to_substring_match(self, db):
+        db.create_note(1, 'price: 5$ only', 1)
+        db.create_note(1, 'no dollars here', 1)
+        assert [note[2] for note in db.get_user_notes_sorted('5$')] == ['price: 5$ only']
+        assert [row[2] for row in db.search_notes('$')] == ['price: 5$ only']
+
+    def test_query_can_be_cancelled(self, db):
+        slow = 'SELECT pg_sleep(10)' if is_postgres(db) else \
+            'WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c) SELECT COUNT(*) FROM c'
+        cancel_event = threading.Event()
+        threading.Timer(0.2, cancel_event.set).start()
+        start = time.monotonic()
+        with pytest.raises(Exception):
+            with db.cancellable(cancel_event) as conn:
+                conn.execute(slow).fetchall()
+        assert time.monotonic() - start < 5
+
+
+class TestDeduplication:
+
+    def test_duplicates_without_hash_are_reported_and_removed(self, db, sql):
+        original = db.create_note(1, 'Same text', 1)
+        sql("INSERT INTO notes (user_id, note, priority, created_at) VALUES (1, 'same   TEXT', 2, '2020-01-01 00:00:00')")
+        sql("INSERT INTO notes (user_id, note, priority, created_at) VALUES (1, 'unhashed', 2, '2020-01-01 00:00:00')")
+        sql("INSERT INTO notes (user_id, note, priority, created_at) VALUES (1, 'Unhashed', 2, '2020-01-01 00:00:00')")
+        copy, first, second = [row[0] for row in sql('SELECT id FROM notes WHERE content_hash IS NULL ORDER BY id')]
+        post_id, _ = db.enqueue_post(copy, 'chat', 'posted copy')
+
+        duplicates = db.duplicate_notes(chunk_size=1)
+        assert duplicates == {original: [copy], first: [second]}
+
+        assert db.remove_duplicate_notes(duplicates) == 2
+        assert db.duplicate_notes() == {}
+        assert sql('SELECT note_id FROM outbox WHERE id = ?', (post_id,)) == [(original,)]
+        assert sql('SELECT COUNT(*) FROM notes WHERE content_hash IS NULL') == [(0,)]
+        assert db.count_notes() == 2
+
+
+class TestOutbox:
+
+    def test_posts_are_queued_once_and_retried(self, db):
+        post_id, status = db.enqueue_post(None, 'chat', 'Hello')
+        assert status == 'pending'
+        assert db.enqueue_post(None, 'chat', 'hello ') == (post_id, 'pending')  # Duplicate text
+        other, _ = db.enqueue_post(None, 'other chat', 'Hello')
+        assert other != post_id
+        assert db.next_post_due() == 0
+
+        now = time.time()
+        assert [row[0] for row in db.due_posts(now)] == [post_id, other]
+        db.mark_post_failed(post_id, 1, 'timeout', next_attempt_at=now + 60)
+        assert db.due_posts(now) == [(other, 'other chat', 'Hello', 0)]
+        assert db.next_post_due() == 0
+        db.mark_post_sent(other)
+        assert db.enqueue_post(None, 'other chat', 'hello') == (other, 'sent')  # Published before, not queued again
+        assert db.next_post_due() == pytest.approx(now + 60)
+        assert db.due_posts(now + 61) == [(post_id, 'chat', 'Hello', 1)]
+
+        # A post given up on leaves the dedup index, so the text can be queued again
+        db.mark_post_failed(post_id, 2, 'forbidden')
+        assert db.next_post_due() is None
+        assert db.enqueue_post(None, 'chat', 'Hello')[0] not in (post_id, other)
+
+    def test_settings(self, db):
+        assert db.get_settings() == {}
+        db.save_settings({'TOKEN_BOT': 'token', 'CHANNEL_LINK': None})
+        db.save_settings({'TOKEN_BOT': 'changed'})
+        assert db.get_settings() == {'TOKEN_BOT': 'changed', 'CHANNEL_LINK': None}
+
+
+class TestScheduling:
+
+    def test_due_notes_are_dispatched_once(self, db):
+        due = db.create_note(1, 'due', 1)
+        later = db.create_note(1, 'later', 1)
+        db.schedule_note(due, time.time() - 1)
+        db.schedule_note(later, time.time() + 3600)
+        assert {note_id for note_id, _ in db.scheduled_notes()} == {due, later}
+
+        post_id = db.dispatch_scheduled_note(due, 'chat')
+        assert post_id is not None
+        assert db.dispatch_scheduled_note(due, 'chat') is None
+        assert db.dispatch_scheduled_note(later, 'chat') is None
+        assert [note_id for note_id, _ in db.scheduled_notes()] == [later]
+        assert db.due_posts(time.time())[0][:3] == (post_id, 'chat', 'due')
+        assert db.get_note(due)[5] is None
+
+
+class TestMigrations:
+
+    def test_reopening_is_idempotent(self, db_url):
+        db = open_database(db_url)
+        note_id = db.create_note(1, 'kept', 1)
+        with db.connection() as conn:
+            version = db.schema_version(conn)
+        Repository.close_all()
+
+        db = open_database(db_url)
+        with db.connection() as conn:
+            assert db.schema_version(conn) == version
+        assert db.get_note(note_id)[2] == 'kept'
+
+    def test_concurrent_processes_migrate_once(self, db_url):
+        results = []
+
+        # Each thread opens its own pool, bypassing the process-wide registry, and races to create the schema
+        # like worker processes do on first start
+        def create_schema():
+            backend = separate_backend(db_url)
+            try:
+                backend.create_db()
+                with backend.connection() as conn:
+                    results.append(backend.schema_version(conn))
+            except Exception as error:
+                results.append(error)
+            finally:
+                backend.pool.close()
+
+        threads = [threading.Thread(target=create_schema) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(set(results)) == 1 and isinstance(results[0], int)
+
+        with open_database(db_url).connection() as conn:
+            versions = [row[0] for row in conn.execute('SELECT version FROM schema_version').fetchall()]
+        assert sorted(versions) == list(range(1, results[0] + 1))
+
+    def test_explain_describes_the_plan(self, db):
+        statement = 'SELECT id FROM notes WHERE user_id = %s' if is_postgres(db) else \
+            'SELECT id FROM notes WHERE user_id = ?'
+        plan = db.explain(statement, (1,))
+        assert plan and all(isinstance(line, str) for line in plan)
+
+
+class TestOtherProcesses:
+
+    # A write made outside this process's repository must drop its loaded note indexes
+    def test_foreign_writes_invalidate_the_index(self, db, sql, db_url):
+        db.index_check_interval = 0
+        db.create_note(1, 'mine', 1)
+        assert len(db.note_index(1)) == 1
+
+        if is_postgres(db):
+            import psycopg
+            with psycopg.connect(db_url, autocommit=True) as conn:
+                conn.execute("INSERT INTO notes (user_id, note, priority) VALUES (1, 'theirs', 2)")
+        else:
+            import sqlite3
+            with sqlite3.connect(db_url) as conn:
+                conn.execute("INSERT INTO notes (user_id, note, priority) VALUES (1, 'theirs', 2)")
+
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            if [note[2] for note in db.get_user_notes_sorted(user_id=1)] == ['mine', 'theirs']:
+                break
+            time.sleep(0.05)
+        assert [note[2] for note in db.get_user_notes_sorted(user_id=1)] == ['mine', 'theirs']
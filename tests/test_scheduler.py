@@ -0,0 +1,72 @@
+import time
+
+from utils.Scheduler import Scheduler
+
+
+class FailingDispatch:
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.calls = []
+
+    def __call__(self, note_id):
+        self.calls.append(note_id)
+        if len(self.calls) <= self.failures:
+            raise RuntimeError('No channel link is configured')
+
+
+def test_failed_dispatch_is_retried_with_backoff(db):
+    note_id = db.create_note(1, 'due', 1)
+    dispatch = FailingDispatch(failures=2)
+    scheduler = Scheduler(db, dispatch, retry_delay=30)
+    scheduler.load()
+    scheduler.schedule(note_id, time.time() - 1)
+
+    assert scheduler._pop_due(time.time()) == [note_id]
+    scheduler._dispatched(note_id, failed=True)
+    assert len(scheduler) == 1
+    assert time.time() + 29 < scheduler._next_deadline() <= time.time() + 30
+
+    # A reload from the database keeps the retry deadline instead of the past publish-at time
+    scheduler.load()
+    assert time.time() + 29 < scheduler._next_deadline() <= time.time() + 30
+
+    assert scheduler._pop_due(time.time() + 31) == [note_id]
+    scheduler._dispatched(note_id, failed=True)
+    assert time.time() + 59 < scheduler._next_deadline() <= time.time() + 60
+
+    assert scheduler._pop_due(time.time() + 61) == [note_id]
+    scheduler._dispatched(note_id, failed=False)
+    assert len(scheduler) == 0 and scheduler._retries == {}
+
+
+def test_note_cancelled_during_dispatch_is_not_retried(db):
+    note_id = db.create_note(1, 'due', 1)
+    scheduler = Scheduler(db, FailingDispatch(failures=1))
+    scheduler.load()
+    scheduler.schedule(note_id, time.time() - 1)
+
+    assert scheduler._pop_due(time.time()) == [note_id]
+    scheduler.cancel(note_id)
+    scheduler._dispatched(note_id, failed=True)
+    assert len(scheduler) == 0 and scheduler._next_deadline() is None
+
+
+def test_note_rescheduled_during_dispatch_keeps_the_new_time(db):
+    note_id = db.create_note(1, 'due', 1)
+    scheduler = Scheduler(db, FailingDispatch(failures=1))
+    scheduler.load()
+    scheduler.schedule(note_id, time.time() - 1)
+
+    assert scheduler._pop_due(time.time()) == [note_id]
+    scheduler.schedule(note_id, 4102444800.0)
+    scheduler._dispatched(note_id, failed=True)
+    assert scheduler._next_deadline() == 4102444800.0 and len(scheduler) == 1
+
+
+def test_scheduler_that_never_runs_only_records_schedules(db):
+    note_id = db.create_note(1, 'later', 1)
+    scheduler = Scheduler(db, FailingDispatch(failures=0))  # As in a web worker, where it is never started
+    scheduler.schedule(note_id, 4102444800.0)
+    assert len(scheduler) == 0 and scheduler._heap == []
+    assert db.scheduled_notes() == [(note_id, 4102444800.0)]
@@ -0,0 +1,49 @@
+import flet as ft
+import pytest
+
+from utils import uiprofile
+
+
+@pytest.fixture
+def profiler(monkeypatch):
+    monkeypatch.setattr(uiprofile, '_enabled', True)  # Records without patching Flet's Page.update
+    monkeypatch.setattr(uiprofile, '_stats', {})
+    return uiprofile
+
+
+def build_tree():
+    return ft.Column([ft.Text('title'), ft.Row([ft.Text('a'), ft.Text('b')])])
+
+
+def test_control_trees_are_counted():
+    assert uiprofile.count_controls(build_tree()) == 5
+    assert uiprofile.count_controls(ft.Container(content=None)) == 1
+
+
+def test_builders_are_only_wrapped_when_enabled(monkeypatch):
+    monkeypatch.setattr(uiprofile, '_enabled', False)
+    assert uiprofile.measure('/posting', 'view', build_tree) is build_tree
+
+
+def test_builds_are_timed_and_reported(profiler, capsys):
+    build = profiler.measure('/posting', 'view', build_tree)
+    assert profiler.count_controls(build()) == 5
+    build()
+
+    stat = profiler._stats[('build', '/posting', 'view()')]
+    assert stat.calls == 2 and stat.controls == 10 and stat.max_controls == 5
+    assert 0 < stat.max_seconds <= stat.seconds and stat.bytes == 0
+
+    profiler._record('update', '/posting', 'pages/posting.py:PostPage.save_note_handler', 0.5, 3, 2048)
+    profiler.report()
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[1] == '=== UI render profile ==='
+    rows = lines[4:]
+    assert len(rows) == 2 and rows[0].endswith('update  /posting  pages/posting.py:PostPage.save_note_handler')
+    assert rows[0].split()[:2] == ['1', '500.0'] and rows[0].split()[6:8] == ['2.0', '2.0']
+    assert rows[1].endswith('build   /posting  view()')
+
+
+def test_empty_report_prints_nothing(profiler, capsys):
+    profiler.report()
+    assert capsys.readouterr().out == ''
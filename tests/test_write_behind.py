@@ -0,0 +1,91 @@
+import pytest
+
+from utils.WriteBehind import WriteBehindQueue
+
+
+@pytest.fixture
+def queue(db):
+    queue = WriteBehindQueue(db, max_delay=60, retry_delay=0.01)
+    yield queue
+    queue.close()
+
+
+# Make the next `failures` batches fail like a locked or unreachable database
+def fail_batches(db, failures):
+    apply_note_batch = db.apply_note_batch
+    calls = []
+
+    def flaky(creates, deletes):
+        calls.append((creates, deletes))
+        if len(calls) <= failures:
+            raise RuntimeError('database is locked')
+        return apply_note_batch(creates, deletes)
+
+    db.apply_note_batch = flaky
+    return calls
+
+
+def test_batch_commits_and_resolves_ids(db, queue):
+    existing = db.create_note(1, 'old', 1)
+    created, deleted = [], []
+    temp_id = queue.create_note(1, 'new', 2, on_done=created.append)
+    queue.delete_note(existing, on_done=deleted.append)
+    queue.flush()
+
+    assert deleted == [existing] and db.get_note(existing) is None
+    assert db.get_note(created[0])[2] == 'new'
+    queue.delete_note(temp_id, on_done=deleted.append)  # Deleting by temporary id after the flush
+    queue.flush()
+    assert deleted == [existing, created[0]] and db.get_note(created[0]) is None
+
+
+def test_failed_batch_is_retried(db, queue):
+    calls = fail_batches(db, failures=2)
+    created = []
+    queue.create_note(1, 'kept', 1, on_done=created.append)
+    queue.flush()
+
+    assert len(calls) == 3
+    assert created[0] is not None and db.get_note(created[0])[2] == 'kept'
+
+
+def test_batch_that_keeps_failing_reports_every_operation(db, queue):
+    existing = db.create_note(1, 'old', 1)
+    calls = fail_batches(db, failures=queue.retries + 1)
+    created, deleted = [], []
+    queue.create_note(1, 'lost', 1, on_done=created.append)
+    queue.delete_note(existing, on_done=deleted.append)
+    queue.flush()
+
+    assert len(calls) == queue.retries + 1
+    assert created == [None] and deleted == [None]
+    assert db.get_note(existing) is not None
+
+
+def test_note_deleted_before_its_batch_never_reaches_the_database(db, queue):
+    calls = fail_batches(db, failures=0)
+    deleted = []
+    temp_id = queue.create_note(1, 'draft', 1)
+    queue.delete_note(temp_id, on_done=deleted.append)
+    queue.flush()
+    assert deleted == [temp_id] and calls == [] and db.count_notes() == 0
+
+
+def test_note_deleted_and_written_again_in_one_batch_survives(db, queue):
+    existing = db.create_note(1, 'same text', 1)
+    created = []
+    queue.delete_note(existing)
+    queue.create_note(1, 'same text', 2, on_done=created.append)
+    queue.flush()
+    assert created[0] != existing and db.get_note(created[0])[2:4] == ('same text', 2)
+
+
+def test_reserved_id_is_used_for_the_queued_note(db, queue):
+    temp_id = queue.reserve_id()
+    assert temp_id < 0 and queue.reserve_id() != temp_id
+    created = []
+    assert queue.create_note(1, 'reserved', 1, on_done=created.append, temp_id=temp_id) == temp_id
+    queue.flush()
+    queue.delete_note(temp_id)  # The temporary id resolves to the stored note
+    queue.flush()
+    assert db.get_note(created[0]) is None
@@ -0,0 +1,50 @@
+import hashlib  # Deriving bit positions from items
+import math  # Sizing the filter
+import threading  # Items are added from several session threads
+
+
+# Probabilistic set: "not in the filter" is certain, "in the filter" may be a false positive
+class BloomFilter:
+
+    def __init__(self, capacity=100000, error_rate=0.01):
+        if capacity <= 0:
+            raise ValueError('capacity must be positive')
+        if not 0 < error_rate < 1:
+            raise ValueError('error_rate must be between 0 and 1')
+
+        self.capacity = capacity
+        self.error_rate = error_rate
+
+        # Optimal bit count and number of hash functions for the capacity and false-positive rate
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0  # Items added (duplicates included)
+        self._lock = threading.Lock()
+
+    # Bit positions for an item, using double hashing over one blake2b digest
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hash_count)]
+
+    # Add an item to the filter
+    def add(self, item):
+        positions = self._positions(item)
+        with self._lock:
+            for position in positions:
+                self.bits[position >> 3] |= 1 << (position & 7)
+            self.count += 1
+
+    # False means the item was definitely never added
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+    # Share of bits set; the filter degrades once it grows well past one half
+    def fill_ratio(self):
+        return sum(bin(byte).count('1') for byte in self.bits) / self.size
+
+    # False-positive rate expected at the current fill
+    def estimated_error_rate(self):
+        return self.fill_ratio() ** self.hash_count
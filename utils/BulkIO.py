@@ -0,0 +1,104 @@
+import csv  # CSV reading and writing
+import itertools  # Cutting the input stream into chunks
+import json  # JSON Lines reading and writing
+import os  # File sizes for progress reporting
+
+# Streaming bulk import and export of the notes table in CSV or JSON Lines.
+# Rows are read and written one at a time and committed in chunks, so memory use
+# does not depend on the file size.
+
+FORMATS = ('csv', 'jsonl')
+FIELDS = ('id', 'user_id', 'note', 'priority', 'created_at', 'scheduled_at')
+
+
+# Guess the format from the file extension
+def detect_format(path):
+    extension = os.path.splitext(path)[1].lower().lstrip('.')
+    if extension in ('jsonl', 'ndjson'):
+        return 'jsonl'
+    if extension == 'csv':
+        return 'csv'
+    raise ValueError(f'Cannot tell the format of {path}, use csv or jsonl')
+
+
+# Yield note dicts from a CSV file with a header row
+def read_csv(file):
+    yield from csv.DictReader(file)
+
+
+# Yield note dicts from a JSON Lines file, skipping blank lines
+def read_jsonl(file):
+    for line_number, line in enumerate(file, 1):
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as error:
+                raise ValueError(f'Line {line_number}: {error.msg}') from None
+
+
+# Turn an imported record into an insert row; user_id overrides the record's owner when given
+def to_row(record, user_id=None):
+    priority = record.get('priority')
+    scheduled_at = record.get('scheduled_at')
+    return (
+        user_id if user_id is not None else int(record['user_id']),
+        record['note'],
+        int(priority) if priority not in (None, '') else None,
+        record.get('created_at') or None,
+        float(scheduled_at) if scheduled_at not in (None, '') else None,
+    )
+
+
+# Import notes from path; each chunk is one executemany transaction. Returns (imported, skipped), where skipped
+# counts duplicates of notes the owner already has. progress(done, fraction) is called after every chunk.
+# Imported notes get new ids and keep their publish-at time; a running scheduler picks them up on its next
+# reload (poll interval or restart).
+def import_notes(db, path, fmt=None, chunk_size=1000, user_id=None, progress=None):
+    fmt = fmt or detect_format(path)
+    if fmt not in FORMATS:
+        raise ValueError(f'Unknown format: {fmt}')
+
+    total_bytes = os.path.getsize(path) or 1
+    read = imported = 0
+    with open(path, newline='', encoding='utf-8') as file:
+        records = read_csv(file) if fmt == 'csv' else read_jsonl(file)
+        rows = (to_row(record, user_id) for record in records)
+
+        while True:
+            chunk = list(itertools.islice(rows, chunk_size))
+            if not chunk:
+                break
+            imported += db.insert_notes(chunk)
+            read += len(chunk)
+            if progress:
+                # The buffered position is approximate but good enough for a progress bar
+                progress(read, min(1.0, file.buffer.tell() / total_bytes))
+
+    return imported, read - imported
+
+
+# Export every note to path, reading the table in keyset chunks. Returns the number of notes exported.
+def export_notes(db, path, fmt=None, chunk_size=1000, progress=None):
+    fmt = fmt or detect_format(path)
+    if fmt not in FORMATS:
+        raise ValueError(f'Unknown format: {fmt}')
+
+    total = db.count_notes() or 1
+    exported = 0
+    with open(path, 'w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file) if fmt == 'csv' else None
+        if writer:
+            writer.writerow(FIELDS)
+
+        for note in db.iter_notes(chunk_size):
+            if writer:
+                writer.writerow(note)
+            else:
+                file.write(json.dumps(dict(zip(FIELDS, note)), ensure_ascii=False) + '\n')
+            exported += 1
+            if progress and exported % chunk_size == 0:
+                progress(exported, min(1.0, exported / total))
+
+    if progress:
+        progress(exported, 1.0)
+    return exported
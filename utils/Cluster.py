@@ -0,0 +1,133 @@
+import asyncio  # Proxy and worker supervision
+import logging  # Worker restarts and proxy errors
+import os  # Worker configuration is passed through the environment
+import subprocess  # Worker processes
+import sys  # Python interpreter running the workers
+import zlib  # Stable hash of client addresses
+
+logger = logging.getLogger(__name__)
+
+# Multi-process web serving: N Flet web workers listen on local ports and a TCP proxy on the public
+# port sends every client IP to the same worker, so a Flet session (kept in the worker's memory) always
+# reaches the process that owns it. The supervisor process runs the publisher and scheduler; workers only
+# queue posts and schedules in the shared database.
+
+WORKER_ENV = 'APP_WORKER'  # Worker number, set in worker processes only
+POLL_ENV = 'APP_POLL_INTERVAL'  # Seconds between checks for changes made by other processes
+
+
+# False in a web worker: the publisher and scheduler run in the supervisor instead
+def runs_background_services():
+    return os.getenv(WORKER_ENV) is None
+
+
+# True in a web worker, where the other workers register users and write notes in the same database
+def is_worker():
+    return os.getenv(WORKER_ENV) is not None
+
+
+# How often in-memory state is refreshed from the database, or None when one process owns it
+def poll_interval():
+    value = os.getenv(POLL_ENV)
+    return float(value) if value else None
+
+
+# Starts the Flet web workers and restarts any that exit
+class WorkerPool:
+
+    def __init__(self, count, base_port=8600, host='127.0.0.1', script='main.py', poll=2.0):
+        self.count = count
+        self.base_port = base_port  # Worker i listens on base_port + i
+        self.host = host
+        self.script = script
+        self.poll = poll
+        self.processes = [None] * count
+
+    # (host, port) of every worker, in worker order
+    @property
+    def backends(self):
+        return [(self.host, self.base_port + i) for i in range(self.count)]
+
+    def start(self):
+        for i in range(self.count):
+            self.spawn(i)
+
+    # Run worker i as a headless Flet web server on its own port
+    def spawn(self, i):
+        env = dict(os.environ)
+        env.update({
+            'FLET_FORCE_WEB_SERVER': 'true',
+            'FLET_SERVER_IP': self.host,
+            'FLET_SERVER_PORT': str(self.base_port + i),
+            WORKER_ENV: str(i),
+            POLL_ENV: str(self.poll),
+        })
+        self.processes[i] = subprocess.Popen([sys.executable, self.script], env=env)
+
+    # Restart workers that exited; runs until cancelled
+    async def supervise(self, interval=1.0):
+        while True:
+            await asyncio.sleep(interval)
+            for i, process in enumerate(self.processes):
+                if process.poll() is not None:
+                    logger.warning('Worker %d exited with code %s, restarting', i, process.returncode)
+                    self.spawn(i)
+
+    # Stop every worker, killing those that do not exit in time
+    def stop(self, timeout=10):
+        for process in self.processes:
+            if process and process.poll() is None:
+                process.terminate()
+        for process in self.processes:
+            if process:
+                try:
+                    process.wait(timeout)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+
+
+# TCP proxy that hashes the client IP to pick a worker (session affinity without parsing HTTP).
+# If that worker does not accept the connection, the next ones are tried in order.
+class AffinityProxy:
+
+    def __init__(self, host, port, backends, buffer_size=64 * 1024):
+        self.host = host
+        self.port = port
+        self.backends = backends
+        self.buffer_size = buffer_size
+
+    # Backends in the order they are tried for a client IP
+    def backends_for(self, ip):
+        start = zlib.crc32(ip.encode()) % len(self.backends)
+        return self.backends[start:] + self.backends[:start]
+
+    async def serve(self):
+        server = await asyncio.start_server(self.handle, self.host, self.port)
+        async with server:
+            await server.serve_forever()
+
+    async def handle(self, client_reader, client_writer):
+        ip = (client_writer.get_extra_info('peername') or ('',))[0]
+        for host, port in self.backends_for(ip):
+            try:
+                backend_reader, backend_writer = await asyncio.open_connection(host, port)
+                break
+            except OSError:
+                continue
+        else:
+            logger.error('No worker accepted a connection from %s', ip)
+            client_writer.close()
+            return
+
+        await asyncio.gather(self.pipe(client_reader, backend_writer), self.pipe(backend_reader, client_writer))
+
+    # Copy bytes one way until the sender closes, then close the other side
+    async def pipe(self, reader, writer):
+        try:
+            while data := await reader.read(self.buffer_size):
+                writer.write(data)
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
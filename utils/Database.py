@@ -1,134 +1,737 @@
+import functools  # Wrapping write methods with busy retries
+import os  # Reading the storage profile from the environment
+import random  # Jitter between busy retries
+import re  # Tokenising search queries for FTS5
 import sqlite3  # Importing SQLite3 library for database management
+import threading  # Locks and thread-local state for the connection pool
+import time  # Creation timestamps shared by the table and the sorted note index
+from contextlib import contextmanager  # Context-manager API for pooled connections
+from queue import Queue, Empty, Full  # Idle connection storage
 
+from utils import Metrics  # Statement tracing when query metrics are enabled
+from utils.Repository import PoolState, Repository, content_hash  # Backend-agnostic caches and note indexes
 
-class Database:
+# Set of pragmas applied to every connection when it is opened
+class StorageProfile:
+    journal_modes = ('delete', 'truncate', 'persist', 'memory', 'wal', 'off')
+    synchronous_levels = ('off', 'normal', 'full', 'extra')
+    temp_stores = ('default', 'file', 'memory')
 
-    def __init__(self):
-        # Initialize the database by creating tables if they don't exist
-        self.create_db()
+    def __init__(self, journal_mode='wal', synchronous='normal', cache_size=-16000, mmap_size=0,
+                 temp_store='default', busy_timeout=5000):
+        # Only whitelisted values are accepted because pragmas cannot take bound parameters
+        if journal_mode not in self.journal_modes:
+            raise ValueError(f'Unknown journal_mode: {journal_mode}')
+        if synchronous not in self.synchronous_levels:
+            raise ValueError(f'Unknown synchronous level: {synchronous}')
+        if temp_store not in self.temp_stores:
+            raise ValueError(f'Unknown temp_store: {temp_store}')
 
-    # Function to create necessary database tables if they don't exist
-    def create_db(self):
-        # Connect to the SQLite database (or create it if it doesn't exist)
-        conn = sqlite3.connect('app.db')
-        cursor = conn.cursor()
+        self.journal_mode = journal_mode
+        self.synchronous = synchronous
+        self.cache_size = int(cache_size)  # Negative values are KiB, positive values are pages
+        self.mmap_size = int(mmap_size)  # Bytes of the file mapped into memory, 0 disables mmap
+        self.temp_store = temp_store
+        self.busy_timeout = int(busy_timeout)  # Milliseconds to wait on a locked database
 
-        # Create 'users' table with unique email and login fields
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            email TEXT UNIQUE,
-            login TEXT UNIQUE,
-            password TEXT
-        )
-        ''')
+    # Apply the pragmas to a freshly opened connection
+    def apply(self, conn):
+        conn.execute(f'PRAGMA busy_timeout = {self.busy_timeout}')
+        conn.execute(f'PRAGMA journal_mode = {self.journal_mode}')
+        conn.execute(f'PRAGMA synchronous = {self.synchronous}')
+        conn.execute(f'PRAGMA cache_size = {self.cache_size}')
+        conn.execute(f'PRAGMA mmap_size = {self.mmap_size}')
+        conn.execute(f'PRAGMA temp_store = {self.temp_store}')
+
+
+# Presets: "durable" fsyncs every commit, "fast" may lose the last commits on power loss but never corrupts
+STORAGE_PROFILES = {
+    'durable': StorageProfile(journal_mode='wal', synchronous='full', cache_size=-16000, mmap_size=0,
+                              temp_store='default', busy_timeout=5000),
+    'fast': StorageProfile(journal_mode='wal', synchronous='normal', cache_size=-64000, mmap_size=256 * 1024 * 1024,
+                           temp_store='memory', busy_timeout=5000),
+}
+
+
+# Resolve a profile given by name (or DB_PROFILE from the environment) or as a StorageProfile
+def get_storage_profile(profile=None):
+    if isinstance(profile, StorageProfile):
+        return profile
+    name = profile or os.getenv('DB_PROFILE', 'durable')
+    if name not in STORAGE_PROFILES:
+        raise ValueError(f'Unknown storage profile: {name}')
+    return STORAGE_PROFILES[name]
+
+
+# SQLite connection that reports each statement it executes to the query metrics
+class TracedConnection(sqlite3.Connection):
+
+    def execute(self, sql, parameters=(), /):
+        Metrics.record_statement(sql, parameters)
+        return super().execute(sql, parameters)
+
+    def executemany(self, sql, parameters, /):
+        Metrics.record_statement(sql, None)  # One statement, many parameter sets: not explained
+        return super().executemany(sql, parameters)
+
+
+# Pool of persistent SQLite connections shared by every Database instance of one file
+class ConnectionPool(PoolState):
+
+    def __init__(self, path, profile, size=5, timeout=5.0):
+        super().__init__()
+        self.path = path
+        self.profile = profile  # StorageProfile applied to each new connection
+        self.size = size  # Maximum number of open connections
+        self.timeout = timeout  # Seconds to wait for a free connection when the pool is full
+        self._idle = Queue(maxsize=size)
+        self._opened = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()  # Connection currently checked out by each thread
+
+    # Open a new connection; it may be handed to another thread after release
+    def _connect(self):
+        factory = TracedConnection if Metrics.active() else sqlite3.Connection
+        conn = sqlite3.connect(self.path, check_same_thread=False, timeout=self.profile.busy_timeout / 1000,
+                               factory=factory)
+        self.profile.apply(conn)
+        return conn
+
+    # Take an idle connection, opening a new one while the pool is not full
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except Empty:
+            pass
+
+        with self._lock:
+            can_open = self._opened < self.size
+            if can_open:
+                self._opened += 1
+        if can_open:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._opened -= 1
+                raise
+
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except Empty:
+            raise sqlite3.OperationalError('connection pool exhausted')
+
+    # Give a connection back to the pool, closing it if the pool was shrunk meanwhile
+    def _release(self, conn):
+        try:
+            self._idle.put_nowait(conn)
+        except Full:
+            with self._lock:
+                self._opened -= 1
+            conn.close()
 
-        # Create 'notes' table, each note linked to a specific user
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS notes (
+    # Check out a connection for the duration of a block; commits on success, rolls back on error
+    @contextmanager
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            # Nested use in the same thread joins the outer transaction
+            yield conn
+            return
+
+        conn = self._acquire()
+        self._local.conn = conn
+        try:
+            with conn:
+                yield conn
+        finally:
+            self._local.conn = None
+            self._release(conn)
+
+    # True while the calling thread has a connection checked out, i.e. is inside a transaction block
+    def in_transaction(self):
+        return getattr(self._local, 'conn', None) is not None
+
+    # Close every idle connection (used on shutdown)
+    def close(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except Empty:
+                break
+            with self._lock:
+                self._opened -= 1
+            conn.close()
+
+
+# Fill in content_hash for rows that have none, in id order: the first row with a given text claims the hash,
+# later duplicates keep NULL (UPDATE OR IGNORE skips the unique index conflict) and show up in the dedup report
+def backfill_content_hashes(conn, table, text_column, chunk_size=1000):
+    last_id = 0
+    while True:
+        rows = conn.execute(f'SELECT id, {text_column} FROM {table} WHERE content_hash IS NULL AND id > ? '
+                            f'ORDER BY id LIMIT ?', (last_id, chunk_size)).fetchall()
+        if not rows:
+            return
+        conn.executemany(f'UPDATE OR IGNORE {table} SET content_hash = ? WHERE id = ?',
+                         [(content_hash(text), row_id) for row_id, text in rows])
+        last_id = rows[-1][0]
+
+
+# Retry a write when SQLite still reports the database busy or locked after busy_timeout, which happens
+# when several worker processes write at once. Calls nested in an outer transaction are left to the outer call.
+def retry_on_busy(method):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        for attempt in range(self.busy_retries + 1):
+            try:
+                return method(self, *args, **kwargs)
+            except sqlite3.OperationalError as error:
+                message = str(error)
+                if ('locked' not in message and 'busy' not in message) or attempt == self.busy_retries \
+                        or self.pool.in_transaction():
+                    raise
+                time.sleep(min(1.0, 0.05 * 2 ** attempt) * random.uniform(0.5, 1.5))
+
+    return wrapper
+
+
+# Versioned schema changes applied in order on top of the base tables created by Database.create_db.
+# Each entry is (version, description, steps); a step is an SQL string or a callable taking the connection.
+# Released entries must never be edited: add a new version instead.
+MIGRATIONS = [
+    (1, 'Index notes by user and sort keys', [
+        'CREATE INDEX IF NOT EXISTS idx_notes_user_priority ON notes (user_id, priority, id)',
+        'CREATE INDEX IF NOT EXISTS idx_notes_priority ON notes (priority, id)',
+    ]),
+    (2, 'Add notes.created_at for the Date sort', [
+        'ALTER TABLE notes ADD COLUMN created_at TEXT',
+        'UPDATE notes SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL',
+        'CREATE INDEX IF NOT EXISTS idx_notes_user_created ON notes (user_id, created_at, id)',
+        'CREATE INDEX IF NOT EXISTS idx_notes_created ON notes (created_at, id)',
+    ]),
+    (3, 'Add the outbox of posts waiting to be published', [
+        '''
+        CREATE TABLE IF NOT EXISTS outbox (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            note TEXT,
-            priority INTEGER,
-            FOREIGN KEY (user_id) REFERENCES users(id)
+            note_id INTEGER,
+            chat_id TEXT NOT NULL,
+            text TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL DEFAULT 0,
+            last_error TEXT,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            sent_at TEXT,
+            FOREIGN KEY (note_id) REFERENCES notes(id)
         )
-        ''')
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (status, next_attempt_at, id)',
+    ]),
+    (4, 'Add notes.scheduled_at for scheduled publishing', [
+        'ALTER TABLE notes ADD COLUMN scheduled_at REAL',
+        'CREATE INDEX IF NOT EXISTS idx_notes_scheduled ON notes (scheduled_at, id) WHERE scheduled_at IS NOT NULL',
+    ]),
+    (5, 'Add content hashes to deduplicate notes per user and posts per chat', [
+        'ALTER TABLE notes ADD COLUMN content_hash TEXT',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_notes_user_hash ON notes (user_id, content_hash)',
+        lambda conn: backfill_content_hashes(conn, 'notes', 'note'),
+        'ALTER TABLE outbox ADD COLUMN content_hash TEXT',
+        # Failed posts leave the index so the same text can be published again
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_outbox_chat_hash ON outbox (chat_id, content_hash) "
+        "WHERE status != 'failed'",
+        lambda conn: backfill_content_hashes(conn, 'outbox', 'text'),
+    ]),
+    (6, 'Add the application settings table', [
+        '''
+        CREATE TABLE IF NOT EXISTS settings (
+            key TEXT PRIMARY KEY,
+            value TEXT,
+            updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+    ]),
+    (7, 'Count changes to notes so other processes can tell their in-memory indexes are stale', [
+        'CREATE TABLE IF NOT EXISTS notes_version (id INTEGER PRIMARY KEY CHECK (id = 1), version INTEGER NOT NULL)',
+        'INSERT OR IGNORE INTO notes_version (id, version) VALUES (1, 0)',
+        'CREATE TRIGGER IF NOT EXISTS notes_version_insert AFTER INSERT ON notes BEGIN '
+        'UPDATE notes_version SET version = version + 1 WHERE id = 1; END',
+        'CREATE TRIGGER IF NOT EXISTS notes_version_delete AFTER DELETE ON notes BEGIN '
+        'UPDATE notes_version SET version = version + 1 WHERE id = 1; END',
+        'CREATE TRIGGER IF NOT EXISTS notes_version_update AFTER UPDATE ON notes BEGIN '
+        'UPDATE notes_version SET version = version + 1 WHERE id = 1; END',
+    ]),
+]
 
-        conn.commit()  # Save changes to the database
-        conn.close()  # Close the database connection
 
-    # Check if an email is already registered
-    def check_email(self, email):
-        conn = sqlite3.connect('app.db')
-        cursor = conn.cursor()
+# SQLite storage backend: one database file shared by every thread and worker process of the app
+class Database(Repository):
+    # Extra attempts for a write that fails with "database is locked"
+    busy_retries = 5
 
-        # Query to check if email already exists in the users table
-        cursor.execute("SELECT * FROM users WHERE email = ?", (email,))
-        user = cursor.fetchone()  # Fetch the first matching result
+    def __init__(self, path='app.db', profile=None):
+        self.path = path
 
-        conn.close()
-        return user is not None  # Return True if email exists, False if it doesn't
+        # Reuse the process-wide pool; the schema is created only when the pool is first opened.
+        # The storage profile is fixed by whichever instance opens the pool first.
+        with Repository._pools_lock:
+            self.pool = Repository._pools.get(path)
+            if self.pool is None:
+                self.pool = ConnectionPool(path, get_storage_profile(profile))
+                self.create_db()
+                self.rebuild_identifier_filter()
+                Repository._pools[path] = self.pool
 
-    # Check if a login is already taken
-    def check_login(self, login):
-        conn = sqlite3.connect('app.db')
-        cursor = conn.cursor()
+    # Like connection(), but statements are aborted with OperationalError once cancel_event is set.
+    # Queries issued by other methods inside the block share the connection and are interruptible too.
+    @contextmanager
+    def cancellable(self, cancel_event):
+        with self.connection() as conn:
+            conn.set_progress_handler(lambda: 1 if cancel_event.is_set() else 0, 1000)
+            try:
+                yield conn
+            finally:
+                conn.set_progress_handler(None, 1000)
 
-        # Query to check if login already exists in the users table
-        cursor.execute("SELECT * FROM users WHERE login = ?", (login,))
-        user = cursor.fetchone()  # Fetch the first matching result
+    # Write transaction on notes that keeps this process's sorted note indexes in step with other processes.
+    # The write lock is taken up front, so if the change counter moved since the last sync, another process wrote
+    # notes and the loaded indexes are dropped; otherwise the caller's own changes are applied to them afterwards.
+    @contextmanager
+    def notes_transaction(self):
+        with self.connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            before = self._notes_version(conn)
+            yield conn
+            after = self._notes_version(conn)
 
-        conn.close()
-        return user is not None  # Return True if login exists, False if it doesn't
+        with self.pool.index_lock:
+            self.pool.sync_notes_version(before)
+            if after != before:
+                self.pool.index_generation += 1  # Indexes being loaded may have read the notes before this write
+            self.pool.notes_version = after
 
-    # Register a new user by inserting their details into the users table
-    def register_user(self, email, login, password):
-        conn = sqlite3.connect('app.db')
-        cursor = conn.cursor()
+    # Value of the notes change counter (migration 7)
+    def _notes_version(self, conn):
+        return conn.execute('SELECT version FROM notes_version WHERE id = 1').fetchone()[0]
 
-        # Insert the user's email, login, and password into the users table
-        cursor.execute('INSERT INTO users (email, login, password) VALUES (?, ?, ?)', (email, login, password))
-        conn.commit()  # Save the new user to the database
-        conn.close()
+    # Function to create necessary database tables if they don't exist
+    @retry_on_busy
+    def create_db(self):
+        with self.connection() as conn:
+            cursor = conn.cursor()
 
-        return True
+            # Create 'users' table with unique email and login fields
+            cursor.execute('''
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                email TEXT UNIQUE,
+                login TEXT UNIQUE,
+                password TEXT
+            )
+            ''')
 
-    # Authenticate a user by checking if email and password match a user record
-    def login_user(self, email, password):
-        conn = sqlite3.connect('app.db')
-        cursor = conn.cursor()
+            # Create 'notes' table, each note linked to a specific user
+            cursor.execute('''
+            CREATE TABLE IF NOT EXISTS notes (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                note TEXT,
+                priority INTEGER,
+                FOREIGN KEY (user_id) REFERENCES users(id)
+            )
+            ''')
 
-        # Query to check if provided email and password match a record in users
-        cursor.execute('SELECT * FROM users WHERE email=? AND password=?', (email, password))
-        user = cursor.fetchone()  # Fetch the first matching result
-        conn.close()
+            # Table recording which migrations have been applied
+            cursor.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description TEXT,
+                applied_at TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+            ''')
 
-        if user:
-            return user[0]  # Return the user ID if login successful
-        else:
-            return None  # Return None if login failed
+        self.migrate()
+        self.pool.fts_enabled = self.create_search_index()
+
+    # Current schema version (0 for a database created before migrations existed)
+    def schema_version(self, conn):
+        return conn.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version').fetchone()[0]
+
+    # Apply pending migrations, each one in its own write transaction
+    def migrate(self):
+        for version, description, steps in MIGRATIONS:
+            with self.connection() as conn:
+                # The write lock makes concurrent processes apply each migration exactly once
+                conn.execute('BEGIN IMMEDIATE')
+                if self.schema_version(conn) >= version:
+                    continue
+
+                for step in steps:
+                    if callable(step):
+                        step(conn)
+                    else:
+                        conn.execute(step)
+                conn.execute('INSERT INTO schema_version (version, description) VALUES (?, ?)',
+                             (version, description))
+
+    # Create the FTS5 index over notes.note and the triggers keeping it in sync; False if FTS5 is unavailable
+    def create_search_index(self):
+        with self.connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'notes_fts'").fetchone():
+                return True
 
-    # Create a new note for a user by inserting it into the notes table
+            try:
+                # External-content table: the text lives only in notes, the index stores tokens
+                conn.execute('''
+                CREATE VIRTUAL TABLE notes_fts USING fts5(
+                    note, content='notes', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+                )
+                ''')
+            except sqlite3.OperationalError:
+                return False  # SQLite was built without FTS5, searches fall back to LIKE
+
+            conn.execute('''
+            CREATE TRIGGER notes_fts_insert AFTER INSERT ON notes BEGIN
+                INSERT INTO notes_fts (rowid, note) VALUES (new.id, new.note);
+            END
+            ''')
+            conn.execute('''
+            CREATE TRIGGER notes_fts_delete AFTER DELETE ON notes BEGIN
+                INSERT INTO notes_fts (notes_fts, rowid, note) VALUES ('delete', old.id, old.note);
+            END
+            ''')
+            conn.execute('''
+            CREATE TRIGGER notes_fts_update AFTER UPDATE OF note ON notes BEGIN
+                INSERT INTO notes_fts (notes_fts, rowid, note) VALUES ('delete', old.id, old.note);
+                INSERT INTO notes_fts (rowid, note) VALUES (new.id, new.note);
+            END
+            ''')
+
+            # Index the notes that existed before the search index
+            conn.execute("INSERT INTO notes_fts (notes_fts) VALUES ('rebuild')")
+            return True
+
+    # Turn free text into an FTS5 query: every word must match as a prefix. None if there are no words.
+    def fts_query(self, search_query):
+        words = re.findall(r'\w+', search_query or '')
+        if not words:
+            return None
+        return ' '.join('"' + word + '"*' for word in words)
+
+    # True if a user with this email or login exists
+    def _identifier_exists(self, column, value):
+        with self.connection() as conn:
+            return conn.execute(f"SELECT 1 FROM users WHERE {column} = ? LIMIT 1", (value,)).fetchone() is not None
+
+    # Register a new user in one insert; returns (user_id, None) or (None, 'email' / 'login') naming the taken key
+    @retry_on_busy
+    def register_user(self, email, login, password):
+        try:
+            with self.connection() as conn:
+                # Insert the user's email, login, and password into the users table
+                cursor = conn.execute('INSERT INTO users (email, login, password) VALUES (?, ?, ?)',
+                                      (email, login, password))
+        except sqlite3.IntegrityError as error:
+            # The message names the violated constraint, e.g. "UNIQUE constraint failed: users.email"
+            conflict = 'login' if 'users.login' in str(error) else 'email'
+            self._remember_conflict(conflict, email, login)
+            return None, conflict
+
+        self._remember_user(email, login)
+        return cursor.lastrowid, None
+
+    # Fetch the user ID and stored password hash for an email, or None if it is not registered.
+    # Passwords are verified by PasswordHasher because salted hashes cannot be compared in SQL.
+    def get_credentials(self, email):
+        with self.connection() as conn:
+            return conn.execute('SELECT id, password FROM users WHERE email=?', (email,)).fetchone()
+
+    # Replace a user's stored password hash (used to upgrade hashes on login)
+    @retry_on_busy
+    def update_password(self, user_id, password):
+        with self.connection() as conn:
+            conn.execute('UPDATE users SET password=? WHERE id=?', (password, user_id))
+
+    # Create a new note for a user by inserting it into the notes table; returns the new note ID.
+    # A note with the same normalised text as one the user already has is not inserted, its ID is returned instead.
+    @retry_on_busy
     def create_note(self, user_id, note, priority):
-        conn = sqlite3.connect('app.db')
-        cursor = conn.cursor()
+        with self.notes_transaction() as conn:
+            note_id, added = self._insert_note(conn, user_id, note, priority)
+        self._index_notes(added=[added] if added else ())
+        return note_id
 
+    # Insert one note; returns its ID and the inserted note tuple, or the existing ID and None for a duplicate
+    def _insert_note(self, conn, user_id, note, priority):
+        digest = content_hash(note)
+        created_at = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())  # Same format as CURRENT_TIMESTAMP
         # Insert note content and priority linked to the user ID
-        cursor.execute('INSERT INTO notes (user_id, note, priority) VALUES (?, ?, ?)', (user_id, note, priority))
-        conn.commit()  # Save the new note to the database
-        conn.close()
+        cursor = conn.execute('INSERT INTO notes (user_id, note, priority, created_at, content_hash) '
+                              'VALUES (?, ?, ?, ?, ?) ON CONFLICT (user_id, content_hash) DO NOTHING',
+                              (user_id, note, priority, created_at, digest))
+        if cursor.rowcount:
+            return cursor.lastrowid, (cursor.lastrowid, user_id, note, priority, created_at, None)
+        return conn.execute('SELECT id FROM notes WHERE user_id = ? AND content_hash = ?',
+                            (user_id, digest)).fetchone()[0], None
+
+    # Retrieve a single note by its ID, or None if it does not exist
+    def get_note(self, note_id):
+        with self.connection() as conn:
+            return conn.execute(f'SELECT {self.note_columns} FROM notes WHERE id=?', (note_id,)).fetchone()
+
+    # Insert and delete notes in one transaction; creates are (user_id, note, priority), returns the new IDs
+    # (the existing ID for a duplicate). Deletes go first, as a single executemany, so a note deleted and written
+    # again in one batch is re-created instead of deduplicated into the deleted row. Inserts run one statement per
+    # row to learn each ID.
+    @retry_on_busy
+    def apply_note_batch(self, creates, deletes):
+        with self.notes_transaction() as conn:
+            conn.executemany('DELETE FROM notes WHERE id=?', [(note_id,) for note_id in deletes])
+            inserted = [self._insert_note(conn, user_id, note, priority) for user_id, note, priority in creates]
+
+        self._index_notes(added=[note for _, note in inserted if note], removed=deletes)
+        return [note_id for note_id, _ in inserted]
+
+    # Insert many notes in one transaction with a single executemany; rows are
+    # (user_id, note, priority, created_at, scheduled_at), a missing created_at defaults to now and scheduled_at is
+    # a unix time or None. Duplicates of existing notes are skipped; returns the number inserted.
+    @retry_on_busy
+    def insert_notes(self, rows):
+        with self.notes_transaction() as conn:
+            cursor = conn.executemany('INSERT INTO notes (user_id, note, priority, created_at, scheduled_at, '
+                                      'content_hash) VALUES (?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP), ?, ?) '
+                                      'ON CONFLICT (user_id, content_hash) DO NOTHING',
+                                      (row + (content_hash(row[1]),) for row in rows))
+        self._drop_note_indexes()  # Rebuilt on next use rather than patched row by row
+        return cursor.rowcount
+
+    # Yield every note in id order, reading chunk_size rows at a time so memory stays constant
+    def iter_notes(self, chunk_size=1000):
+        last_id = 0
+        while True:
+            with self.connection() as conn:
+                chunk = conn.execute(f'SELECT {self.note_columns} FROM notes WHERE id > ? ORDER BY id LIMIT ?',
+                                     (last_id, chunk_size)).fetchall()
+            if not chunk:
+                return
+            yield from chunk
+            last_id = chunk[-1][0]
+
+    # Add a post to the outbox; it stays there until the publisher delivers it. Returns (outbox ID, status).
+    # The same text queued or sent to the chat before is not added again: the earlier post's ID is returned with
+    # its status, 'pending' or 'sent', so callers can tell the user it was already published.
+    @retry_on_busy
+    def enqueue_post(self, note_id, chat_id, text):
+        digest = content_hash(text)
+        with self.connection() as conn:
+            cursor = conn.execute("INSERT INTO outbox (note_id, chat_id, text, content_hash) VALUES (?, ?, ?, ?) "
+                                  "ON CONFLICT (chat_id, content_hash) WHERE status != 'failed' DO NOTHING",
+                                  (note_id, chat_id, text, digest))
+            if cursor.rowcount:
+                return cursor.lastrowid, 'pending'
+            return tuple(conn.execute("SELECT id, status FROM outbox WHERE chat_id = ? AND content_hash = ? "
+                                      "AND status != 'failed'", (chat_id, digest)).fetchone())
+
+    # Pending posts whose next attempt is due at unix time `now`: rows of (id, chat_id, text, attempts)
+    def due_posts(self, now, limit=50):
+        with self.connection() as conn:
+            return conn.execute("SELECT id, chat_id, text, attempts FROM outbox "
+                                "WHERE status = 'pending' AND next_attempt_at <= ? ORDER BY next_attempt_at, id LIMIT ?",
+                                (now, limit)).fetchall()
+
+    # Record a delivered post
+    @retry_on_busy
+    def mark_post_sent(self, post_id):
+        with self.connection() as conn:
+            conn.execute("UPDATE outbox SET status = 'sent', sent_at = CURRENT_TIMESTAMP, last_error = NULL "
+                         "WHERE id = ?", (post_id,))
+
+    # Record a failed attempt; the post is retried at next_attempt_at, or given up on when next_attempt_at is None
+    @retry_on_busy
+    def mark_post_failed(self, post_id, attempts, error, next_attempt_at=None):
+        status = 'pending' if next_attempt_at is not None else 'failed'
+        with self.connection() as conn:
+            conn.execute('UPDATE outbox SET status = ?, attempts = ?, last_error = ?, next_attempt_at = ? WHERE id = ?',
+                         (status, attempts, error, next_attempt_at or 0, post_id))
+
+    # Store several settings in one transaction; values are text or None
+    @retry_on_busy
+    def save_settings(self, values):
+        with self.connection() as conn:
+            conn.executemany('INSERT INTO settings (key, value) VALUES (?, ?) ON CONFLICT (key) '
+                             'DO UPDATE SET value = excluded.value, updated_at = CURRENT_TIMESTAMP',
+                             list(values.items()))
+
+    # Set (or with None, clear) the unix time at which a note is published
+    @retry_on_busy
+    def schedule_note(self, note_id, scheduled_at):
+        with self.notes_transaction() as conn:
+            conn.execute('UPDATE notes SET scheduled_at = ? WHERE id = ?', (scheduled_at, note_id))
+        self._reindex_note(note_id)
+
+    # Move a due note into the outbox and clear its schedule in one transaction, so a crash
+    # cannot publish it twice or lose it. Returns the outbox ID, or None if it is no longer scheduled or was
+    # rescheduled to a later time (possibly by another process).
+    @retry_on_busy
+    def dispatch_scheduled_note(self, note_id, chat_id):
+        with self.notes_transaction() as conn:
+            note = conn.execute('SELECT note FROM notes WHERE id = ? AND scheduled_at <= ?',
+                                (note_id, time.time())).fetchone()
+            if note is None:
+                return None
+            conn.execute('UPDATE notes SET scheduled_at = NULL WHERE id = ?', (note_id,))
+            post_id, _ = self.enqueue_post(note_id, chat_id, note[0])
+        self._reindex_note(note_id)
+        return post_id
+
+    # Find notes that duplicate another note of the same user; returns {original ID: [duplicate IDs]}.
+    # Only notes without a content hash can be duplicates: the unique index keeps all others distinct.
+    def duplicate_notes(self, chunk_size=1000):
+        duplicates = {}
+        originals = {}  # (user_id, hash) -> ID of the note the others duplicate
+        last_id = 0
+        while True:
+            with self.connection() as conn:
+                rows = conn.execute('SELECT id, user_id, note FROM notes WHERE content_hash IS NULL AND id > ? '
+                                    'ORDER BY id LIMIT ?', (last_id, chunk_size)).fetchall()
+                for note_id, user_id, note in rows:
+                    key = (user_id, content_hash(note))
+                    original = originals.get(key)
+                    if original is None:
+                        hashed = conn.execute('SELECT id FROM notes WHERE user_id = ? AND content_hash = ?',
+                                              key).fetchone()
+                        original = originals[key] = hashed[0] if hashed else note_id
+                    if original != note_id:
+                        duplicates.setdefault(original, []).append(note_id)
+            if not rows:
+                return duplicates
+            last_id = rows[-1][0]
+
+    # Delete the duplicates found by duplicate_notes in one transaction; their outbox entries are moved to the
+    # original note and the remaining notes get their content hash. Returns the number of notes deleted.
+    @retry_on_busy
+    def remove_duplicate_notes(self, duplicates):
+        pairs = [(original, duplicate) for original, ids in duplicates.items() for duplicate in ids]
+        with self.notes_transaction() as conn:
+            conn.executemany('UPDATE outbox SET note_id = ? WHERE note_id = ?', pairs)
+            conn.executemany('DELETE FROM notes WHERE id = ?', [(duplicate,) for _, duplicate in pairs])
+            backfill_content_hashes(conn, 'notes', 'note')
+        self._index_notes(removed=[duplicate for _, duplicate in pairs])
+        return len(pairs)
+
+    # (notes version, notes) of user_id (None: all) for a new sorted index; notes is None when there are more than
+    # note_index_max. Read in one transaction so the version matches the rows.
+    def _load_index_notes(self, user_id):
+        where, params = ('WHERE user_id = ?', (user_id,)) if user_id is not None else ('', ())
+        with self.connection() as conn:
+            if not conn.in_transaction:
+                conn.execute('BEGIN')
+            version = self._notes_version(conn)
+            count = conn.execute(f'SELECT COUNT(*) FROM notes {where}', params).fetchone()[0]
+            if count > self.note_index_max:
+                return version, None
+            return version, conn.execute(f'SELECT {self.note_columns} FROM notes {where}', params).fetchall()
+
+    # Drop the loaded indexes if another process changed notes; checked at most every index_check_interval
+    # seconds so listings stay free of queries. Caller holds index_lock.
+    def _check_notes_version(self):
+        now = time.monotonic()
+        if not self.pool.note_indexes or now - self.pool.notes_version_checked < self.index_check_interval:
+            return
+        self.pool.notes_version_checked = now
+        with self.connection() as conn:
+            version = self._notes_version(conn)
+        self.pool.sync_notes_version(version)
 
     # Retrieve all notes for a specific user
     def get_user_notes(self, user_id):
-        conn = sqlite3.connect('app.db')
-        cursor = conn.cursor()
-
-        # Select all notes for a given user ID
-        cursor.execute('SELECT * FROM notes WHERE user_id=?', (user_id,))
-        notes = cursor.fetchall()  # Fetch all matching notes
-        conn.close()
+        with self.connection() as conn:
+            # Select all notes for a given user ID
+            notes = conn.execute(f'SELECT {self.note_columns} FROM notes WHERE user_id=?', (user_id,)).fetchall()
 
         return notes
 
     # Delete a specific note by its note ID
+    @retry_on_busy
     def delete_note(self, note_id):
-        conn = sqlite3.connect('app.db')
-        cursor = conn.cursor()
+        with self.notes_transaction() as conn:
+            # Delete a note with the specified note ID
+            conn.execute('DELETE FROM notes WHERE id=?', (note_id,))
+        self._index_notes(removed=[note_id])
+
+    # WHERE clause and parameters for an optional search query and user
+    def _notes_filter(self, search_query="", user_id=None):
+        conditions, params = [], []
+        match = self.fts_query(search_query) if self.fts_enabled else None
+
+        if match:
+            # Use the full-text index for word-prefix search
+            conditions.append('id IN (SELECT rowid FROM notes_fts WHERE notes_fts MATCH ?)')
+            params.append(match)
+        elif search_query:
+            # Notes containing the search_query anywhere in their text
+            conditions.append('note LIKE ?')
+            params.append(f"%{search_query}%")
+
+        if user_id is not None:
+            conditions.append('user_id = ?')
+            params.append(user_id)
 
-        # Delete a note with the specified note ID
-        cursor.execute('DELETE FROM notes WHERE id=?', (note_id,))
-        conn.commit()  # Commit changes to reflect deletion in the database
-        conn.close()
+        return conditions, params
 
-    # Retrieve and sort user notes with optional search and sorting criteria
-    def get_user_notes_sorted(self, search_query="", sort_by="priority"):
-        conn = sqlite3.connect('app.db')
-        cursor = conn.cursor()
+    # Notes matching a search and/or user, sorted; used when the in-memory index cannot answer
+    def _select_notes(self, search_query, sort_by, user_id):
+        conditions, params = self._notes_filter(search_query, user_id)
+        where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+        query = f"SELECT {self.note_columns} FROM notes{where} ORDER BY {self.sort_column(sort_by)}, id"
 
-        # Query to search notes containing the search_query and sort by chosen column
-        query = "SELECT * FROM notes WHERE note LIKE ? ORDER BY " + (sort_by if sort_by else "priority")
-        cursor.execute(query, (f"%{search_query}%",))  # Execute query with search pattern
-        notes = cursor.fetchall()  # Fetch all matching notes
+        with self.connection() as conn:
+            notes = conn.execute(query, params).fetchall()
 
-        conn.close()
         return notes
+
+    # One page of notes after the keyset cursor (after_value, after_id), read through the sort indexes
+    def _select_notes_page(self, search_query, sort_by, after_value, after_id, page_size, user_id):
+        column = self.sort_column(sort_by)
+        conditions, params = self._notes_filter(search_query, user_id)
+
+        if after_id is None:
+            pass
+        elif after_value is None:
+            # NULLs sort first, and a row-value comparison with NULL matches nothing
+            conditions.append(f'({column} IS NOT NULL OR id > ?)')
+            params.append(after_id)
+        else:
+            conditions.append(f'({column}, id) > (?, ?)')
+            params.extend((after_value, after_id))
+
+        where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+        query = f"SELECT {self.note_columns} FROM notes{where} ORDER BY {column}, id LIMIT ?"
+
+        with self.connection() as conn:
+            return conn.execute(query, (*params, page_size)).fetchall()
+
+    # Rank notes by relevance (bm25) and return them with a highlighted snippet: rows are note columns + (snippet, rank).
+    # Matches are wrapped in highlight markers; without FTS5 the LIKE fallback returns the whole note and rank 0.
+    def search_notes(self, search_query, user_id=None, limit=50, highlight=('[', ']')):
+        match = self.fts_query(search_query) if self.fts_enabled else None
+        user_filter = ' AND notes.user_id = ?' if user_id is not None else ''
+        user_params = (user_id,) if user_id is not None else ()
+
+        with self.connection() as conn:
+            if match:
+                columns = ', '.join('notes.' + name for name in self.note_columns.split(', '))
+                query = (f"SELECT {columns}, snippet(notes_fts, 0, ?, ?, '...', 12), bm25(notes_fts) AS rank "
+                         f"FROM notes_fts JOIN notes ON notes.id = notes_fts.rowid "
+                         f"WHERE notes_fts MATCH ?{user_filter} ORDER BY rank LIMIT ?")
+                return conn.execute(query, (*highlight, match, *user_params, limit)).fetchall()
+
+            query = (f"SELECT {self.note_columns}, note, 0 FROM notes "
+                     f"WHERE note LIKE ?{user_filter} ORDER BY id LIMIT ?")
+            return conn.execute(query, (f"%{search_query}%", *user_params, limit)).fetchall()
+
+    # Query plan of a statement (EXPLAIN QUERY PLAN details), for the slow-query log
+    def explain(self, sql, params=()):
+        with self.connection() as conn:
+            return [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params or ())]
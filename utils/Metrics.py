@@ -0,0 +1,289 @@
+import atexit  # Writing the metrics file on shutdown
+import bisect  # Histogram bucket lookup
+import functools  # Wrapping the traced methods
+import inspect  # Skipping generators and context managers when wrapping
+import logging  # Slow-query log
+import os  # Configuration from the environment
+import threading  # Per-thread traces, the metrics lock and the export threads
+import time  # Call durations
+from collections import deque  # Most recent slow calls
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer  # Local /metrics endpoint
+
+logger = logging.getLogger(__name__)
+
+# Latency and row-count histograms for every storage method, a slow-query log with optional query plans,
+# and export in the Prometheus text format to a file or a local HTTP endpoint.
+# Off unless DB_METRICS=1 (read by open_database) or enable() is called: until then no method is wrapped.
+#   DB_SLOW_MS       calls slower than this many milliseconds go to the slow-query log (default 100)
+#   DB_EXPLAIN_SLOW  1 to log the query plan of each SELECT issued by a slow call
+#   DB_METRICS_FILE  file rewritten every 15 seconds and on exit
+#   DB_METRICS_PORT  serve http://127.0.0.1:<port>/metrics
+# Under serve.py every process exports its own metrics: worker i uses port + i + 1 and "<file>.worker<i>".
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+ROW_BUCKETS = (0, 1, 5, 10, 50, 100, 500, 1000, 5000, 10000)
+
+# Public methods that do not reach the database (or return a generator or context manager) and are not traced
+UNTRACED = {'connection', 'cancellable', 'notes_transaction', 'close_all', 'create_db', 'migrate', 'schema_version',
+            'create_search_index', 'explain', 'fts_query', 'may_be_taken', 'sort_key', 'sort_column', 'note_cursor',
+            'sort_fields'}
+
+
+# Cumulative histogram with fixed upper bounds, as in Prometheus
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # The last slot counts values above every bound
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    # (upper bound label, cumulative count) pairs ending with +Inf
+    def cumulative(self):
+        total = 0
+        for bound, count in zip((*self.buckets, '+Inf'), self.counts):
+            total += count
+            yield (bound if bound == '+Inf' else format(bound, 'g')), total
+
+
+# Metrics of the traced storage methods of one process
+class QueryMetrics:
+
+    def __init__(self, slow_threshold=0.1, explain=False, slow_log_size=100):
+        self.slow_threshold = slow_threshold  # Seconds above which a call is logged as slow
+        self.explain = explain  # Capture query plans of slow SELECTs
+        self.latency = {}  # method -> Histogram of seconds
+        self.rows = {}  # method -> Histogram of rows returned
+        self.errors = {}  # method -> calls that raised
+        self.slow_calls = {}  # method -> calls above slow_threshold
+        self.slow_log = deque(maxlen=slow_log_size)  # Recent slow calls, newest last
+        self._lock = threading.Lock()
+        self._local = threading.local()  # Statements of the traced calls in progress on each thread
+
+    # Run a traced method, recording its duration, the rows it returned and the statements it issued.
+    # Nested traced calls are recorded on their own and their statements also count for the outer call.
+    def call(self, db, name, method, args, kwargs):
+        frames = self._frames()
+        statements = []
+        frames.append(statements)
+        start = time.perf_counter()
+        try:
+            result = method(db, *args, **kwargs)
+        except Exception:
+            self._finish(frames, statements)
+            self.observe(db, name, time.perf_counter() - start, None, statements, failed=True)
+            raise
+        seconds = time.perf_counter() - start
+        self._finish(frames, statements)
+        self.observe(db, name, seconds, row_count(result), statements)
+        return result
+
+    def _frames(self):
+        frames = getattr(self._local, 'frames', None)
+        if frames is None:
+            frames = self._local.frames = []
+        return frames
+
+    @staticmethod
+    def _finish(frames, statements):
+        frames.pop()
+        if frames:
+            frames[-1].extend(statements)
+
+    # Attribute an executed statement to the traced call running on this thread
+    def record_statement(self, sql, params):
+        frames = getattr(self._local, 'frames', None)
+        if frames and not getattr(self._local, 'explaining', False):
+            frames[-1].append((sql, params))
+
+    def observe(self, db, name, seconds, rows, statements, failed=False):
+        with self._lock:
+            self.latency.setdefault(name, Histogram(LATENCY_BUCKETS)).observe(seconds)
+            if rows is not None:
+                self.rows.setdefault(name, Histogram(ROW_BUCKETS)).observe(rows)
+            if failed:
+                self.errors[name] = self.errors.get(name, 0) + 1
+            if seconds >= self.slow_threshold:
+                self.slow_calls[name] = self.slow_calls.get(name, 0) + 1
+
+        if seconds >= self.slow_threshold:
+            self.log_slow(db, name, seconds, rows, statements, explain=self.explain and not failed)
+
+    # Add a slow call to the slow-query log, with the plan of each distinct SELECT when explain is set
+    def log_slow(self, db, name, seconds, rows, statements, explain=False):
+        sql = list(dict.fromkeys(' '.join(statement.split()) for statement, _ in statements))
+        plans = {}
+        if explain:
+            self._local.explaining = True  # The EXPLAIN statements are not part of any traced call
+            try:
+                for statement, params in statements:
+                    text = ' '.join(statement.split())
+                    if text in plans or params is None or not text.upper().startswith(('SELECT', 'WITH')):
+                        continue
+                    try:
+                        plans[text] = db.explain(statement, params)
+                    except Exception as error:
+                        plans[text] = [f'EXPLAIN failed: {error}']
+            finally:
+                self._local.explaining = False
+
+        entry = {'method': name, 'seconds': seconds, 'rows': rows, 'sql': sql, 'plans': plans, 'at': time.time()}
+        with self._lock:
+            self.slow_log.append(entry)
+
+        lines = [f'Slow call {name}: {seconds * 1000:.1f} ms, {rows if rows is not None else "-"} rows']
+        for text in sql:
+            lines.append(f'  {text}')
+            lines.extend(f'    {line}' for line in plans.get(text, ()))
+        logger.warning('\n'.join(lines))
+
+    # All metrics in the Prometheus text exposition format
+    def prometheus(self):
+        with self._lock:
+            lines = []
+            histograms = (('db_call_duration_seconds', 'Wall time of storage method calls.', self.latency),
+                          ('db_call_rows', 'Rows returned by storage method calls.', self.rows))
+            for metric, description, histograms_by_method in histograms:
+                lines += [f'# HELP {metric} {description}', f'# TYPE {metric} histogram']
+                for name, histogram in sorted(histograms_by_method.items()):
+                    for bound, count in histogram.cumulative():
+                        lines.append(f'{metric}_bucket{{method="{name}",le="{bound}"}} {count}')
+                    lines.append(f'{metric}_sum{{method="{name}"}} {histogram.sum:.9g}')
+                    lines.append(f'{metric}_count{{method="{name}"}} {histogram.count}')
+
+            counters = (('db_call_errors_total', 'Storage method calls that raised.', self.errors),
+                        ('db_slow_calls_total', 'Storage method calls slower than the slow-query threshold.',
+                         self.slow_calls))
+            for metric, description, counts in counters:
+                lines += [f'# HELP {metric} {description}', f'# TYPE {metric} counter']
+                lines += [f'{metric}{{method="{name}"}} {count}' for name, count in sorted(counts.items())]
+        return '\n'.join(lines) + '\n'
+
+    # Write the metrics to path atomically, e.g. for the node_exporter textfile collector
+    def write(self, path):
+        temporary = f'{path}.tmp'
+        with open(temporary, 'w', encoding='utf-8') as file:
+            file.write(self.prometheus())
+        os.replace(temporary, path)
+
+    # Rewrite the metrics file every interval seconds and on exit
+    def write_periodically(self, path, interval=15.0):
+        def run():
+            while True:
+                time.sleep(interval)
+                self.write(path)
+
+        threading.Thread(target=run, name='db-metrics-file', daemon=True).start()
+        atexit.register(self.write, path)
+
+    # Serve the metrics at http://host:port/metrics from a background thread; returns the server
+    def serve(self, port, host='127.0.0.1'):
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # Scrapes are not worth a log line each
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, name='db-metrics-http', daemon=True).start()
+        return server
+
+
+# Rows in a method's result: list length, 1 for a single row, 0 for None; None when the result is not rows
+def row_count(result):
+    if result is None:
+        return 0
+    if isinstance(result, tuple):
+        return 1
+    if isinstance(result, (str, bytes)) or not hasattr(result, '__len__'):
+        return None
+    return len(result)
+
+
+# Wrap the public storage methods of cls, including inherited ones, so every call is recorded by metrics
+def instrument(cls, metrics):
+    for name in dir(cls):
+        method = getattr(cls, name)
+        if name.startswith('_') or name in UNTRACED or not inspect.isfunction(method) \
+                or getattr(method, 'traced', False) or inspect.isgeneratorfunction(method):
+            continue
+        setattr(cls, name, traced(name, method, metrics))
+
+
+def traced(name, method, metrics):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        return metrics.call(self, name, method, args, kwargs)
+
+    wrapper.traced = True
+    return wrapper
+
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+# Metrics of this process, or None while tracing is off
+def get_metrics():
+    return _metrics
+
+
+# True once tracing is on; backends then open connections that report their statements
+def active():
+    return _metrics is not None
+
+
+# Report a statement executed on a traced connection
+def record_statement(sql, params):
+    if _metrics is not None:
+        _metrics.record_statement(sql, params)
+
+
+# Turn tracing on for every storage backend; later calls return the metrics already enabled
+def enable(slow_threshold=0.1, explain=False):
+    from utils.Database import Database
+    from utils.PostgresDatabase import PostgresDatabase
+
+    global _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = QueryMetrics(slow_threshold, explain)
+            for cls in (Database, PostgresDatabase):
+                instrument(cls, _metrics)
+        return _metrics
+
+
+# Enable tracing and its exports as configured by DB_METRICS and the related variables (see the top of the module)
+def enable_from_env():
+    if _metrics is not None or os.getenv('DB_METRICS', '').lower() not in ('1', 'true', 'yes'):
+        return _metrics
+
+    from utils import Cluster
+
+    metrics = enable(float(os.getenv('DB_SLOW_MS', '100')) / 1000,
+                     os.getenv('DB_EXPLAIN_SLOW', '').lower() in ('1', 'true', 'yes'))
+    worker = os.getenv(Cluster.WORKER_ENV)
+    path = os.getenv('DB_METRICS_FILE')
+    if path:
+        metrics.write_periodically(path if worker is None else f'{path}.worker{worker}')
+    port = os.getenv('DB_METRICS_PORT')
+    if port:
+        metrics.serve(int(port) + (0 if worker is None else int(worker) + 1))
+    return metrics
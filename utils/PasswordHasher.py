@@ -0,0 +1,179 @@
+import asyncio  # Awaitable wrappers for Flet async handlers
+import base64  # Encoding salts and digests in stored hashes
+import hashlib  # PBKDF2 and scrypt key derivation
+import hmac  # Constant-time comparison
+import logging  # Reporting calibration results
+import os  # Random salts and configuration from the environment
+import threading  # Guarding the shared hasher
+import time  # Calibration timing
+from concurrent.futures import ThreadPoolExecutor  # Bounded pool running the KDF off the event loop
+
+from utils.function import hesh_password  # Legacy unsalted SHA-256 hashes
+
+logger = logging.getLogger(__name__)
+
+
+# Salted, cost-parameterised password hashing.
+# Stored hashes carry their parameters:
+#   pbkdf2_sha256$<iterations>$<salt>$<digest>
+#   scrypt$<n>$<r>$<p>$<salt>$<digest>
+# Bare 64-character hex strings are legacy SHA-256 hashes and are upgraded on the next login.
+class PasswordHasher:
+    algorithms = ('pbkdf2_sha256', 'scrypt')
+    salt_size = 16
+    scrypt_max_memory = 64 * 1024 * 1024  # Calibration never picks an scrypt cost needing more memory than this
+
+    def __init__(self, algorithm='pbkdf2_sha256', iterations=600000, scrypt_n=2 ** 14, scrypt_r=8, scrypt_p=1,
+                 workers=2):
+        if algorithm not in self.algorithms:
+            raise ValueError(f'Unknown password hashing algorithm: {algorithm}')
+
+        self.algorithm = algorithm
+        self.iterations = int(iterations)  # PBKDF2 cost
+        self.scrypt_n = int(scrypt_n)  # scrypt CPU/memory cost, a power of two
+        self.scrypt_r = int(scrypt_r)
+        self.scrypt_p = int(scrypt_p)
+
+        # hashlib releases the GIL while deriving keys, so a few threads hash in parallel
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+        self._dummy_hash = None  # Hash checked when there is no stored one, see verify()
+
+    # Hash a password with the current algorithm and cost
+    def hash(self, password):
+        salt = os.urandom(self.salt_size)
+        if self.algorithm == 'scrypt':
+            digest = self._scrypt(password, salt, self.scrypt_n, self.scrypt_r, self.scrypt_p)
+            return f'scrypt${self.scrypt_n}${self.scrypt_r}${self.scrypt_p}${_b64(salt)}${_b64(digest)}'
+
+        digest = self._pbkdf2(password, salt, self.iterations)
+        return f'pbkdf2_sha256${self.iterations}${_b64(salt)}${_b64(digest)}'
+
+    # Check a password against a stored hash of any supported format. Without a stored hash (unknown account) a
+    # dummy hash with the current cost is checked anyway and False returned, so the response time does not
+    # reveal whether the account exists.
+    def verify(self, password, stored):
+        if not stored:
+            self.verify(password, self.dummy_hash())
+            return False
+
+        parts = stored.split('$')
+        try:
+            if parts[0] == 'pbkdf2_sha256' and len(parts) == 4:
+                salt, expected = _unb64(parts[2]), _unb64(parts[3])
+                digest = self._pbkdf2(password, salt, int(parts[1]), len(expected))
+            elif parts[0] == 'scrypt' and len(parts) == 6:
+                salt, expected = _unb64(parts[4]), _unb64(parts[5])
+                digest = self._scrypt(password, salt, int(parts[1]), int(parts[2]), int(parts[3]), len(expected))
+            elif len(parts) == 1:
+                expected, digest = stored.encode(), hesh_password(password).encode()
+            else:
+                return False
+        except ValueError:
+            return False  # Malformed hash
+
+        return hmac.compare_digest(digest, expected)
+
+    # True if a stored hash uses a legacy format, another algorithm or a lower cost than the current one.
+    # Hashes stronger than the current parameters are kept, so a lower calibration does not weaken them.
+    def needs_rehash(self, stored):
+        parts = (stored or '').split('$')
+        if parts[0] != self.algorithm:
+            return True
+        try:
+            if self.algorithm == 'scrypt':
+                n, r, p = (int(part) for part in parts[1:4])
+                return n < self.scrypt_n or r < self.scrypt_r or p < self.scrypt_p
+            return int(parts[1]) < self.iterations
+        except (ValueError, IndexError):
+            return True  # Malformed hash
+
+    # Hash of a random password with the current parameters, regenerated after calibration changes them
+    def dummy_hash(self):
+        dummy = self._dummy_hash
+        if dummy is None or self.needs_rehash(dummy):
+            dummy = self._dummy_hash = self.hash(_b64(os.urandom(self.salt_size)))
+        return dummy
+
+    # Awaitable hash() running on the worker pool
+    def hash_async(self, password):
+        return asyncio.wrap_future(self.executor.submit(self.hash, password))
+
+    # Awaitable verify() running on the worker pool
+    def verify_async(self, password, stored):
+        return asyncio.wrap_future(self.executor.submit(self.verify, password, stored))
+
+    # Pick the cost that takes about target_ms per hash on this host and use it: the PBKDF2 iteration count, or
+    # scrypt's n (a power of two, within scrypt_max_memory) when scrypt is selected
+    def calibrate(self, target_ms=250, sample_iterations=20000):
+        salt = os.urandom(self.salt_size)
+        if self.algorithm == 'scrypt':
+            return self._calibrate_scrypt(target_ms, salt)
+        iterations = sample_iterations
+
+        # Two rounds: the first estimate may be skewed by warm-up
+        for _ in range(2):
+            start = time.perf_counter()
+            self._pbkdf2('calibration', salt, iterations)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            iterations = max(1000, int(iterations * target_ms / max(elapsed_ms, 0.001)))
+
+        self.iterations = iterations
+        logger.info('Calibrated PBKDF2 to %d iterations', iterations)
+        return iterations
+
+    # scrypt's time grows linearly with n: time the current n and scale it to the nearest power of two
+    def _calibrate_scrypt(self, target_ms, salt):
+        start = time.perf_counter()
+        self._scrypt('calibration', salt, self.scrypt_n, self.scrypt_r, self.scrypt_p)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        wanted = self.scrypt_n * target_ms / max(elapsed_ms, 0.001)
+        largest = self.scrypt_max_memory // (128 * self.scrypt_r)
+        n = 2 ** 10
+        while n * 2 <= largest and n * 2 <= wanted * 1.5:  # Roughly the nearest power of two
+            n *= 2
+        self.scrypt_n = n
+        logger.info('Calibrated scrypt to n=%d', n)
+        return n
+
+    # Run calibrate() on the worker pool; until it finishes, hashes use the configured iteration count
+    def calibrate_async(self, target_ms=250):
+        return self.executor.submit(self.calibrate, target_ms)
+
+    # Stop the worker pool (called on shutdown)
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+    def _pbkdf2(self, password, salt, iterations, length=32):
+        return hashlib.pbkdf2_hmac('sha256', password.encode(), salt, iterations, dklen=length)
+
+    def _scrypt(self, password, salt, n, r, p, length=32):
+        return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=256 * n * r + 1024 * 1024,
+                              dklen=length)
+
+
+def _b64(data):
+    return base64.b64encode(data).decode().rstrip('=')
+
+
+def _unb64(text):
+    return base64.b64decode(text + '=' * (-len(text) % 4))
+
+
+_hasher = None
+_hasher_lock = threading.Lock()
+
+
+# Process-wide hasher configured from PASSWORD_HASH_ALGORITHM, PASSWORD_HASH_ITERATIONS
+# or PASSWORD_HASH_TARGET_MS (calibrates the iteration count in the background after first use;
+# pages create the hasher, so calibration must not block them)
+def get_password_hasher():
+    global _hasher
+    with _hasher_lock:
+        if _hasher is None:
+            _hasher = PasswordHasher(algorithm=os.getenv('PASSWORD_HASH_ALGORITHM', 'pbkdf2_sha256'),
+                                     iterations=int(os.getenv('PASSWORD_HASH_ITERATIONS', '600000')))
+            target_ms = os.getenv('PASSWORD_HASH_TARGET_MS')
+            if target_ms:
+                _hasher.calibrate_async(float(target_ms))
+        return _hasher
@@ -0,0 +1,214 @@
+import asyncio  # Publishing worker
+import json  # Bot API requests and responses
+import logging  # Reporting delivery failures
+import random  # Backoff jitter
+import threading  # The worker runs its own event loop in a background thread
+import time  # Token bucket refills and retry deadlines
+import urllib.error  # Bot API error responses
+import urllib.request  # Bot API calls without extra dependencies
+
+logger = logging.getLogger(__name__)
+
+
+# Delivery failure; retry_after is the server-requested delay, permanent errors are not retried
+class TransportError(Exception):
+
+    def __init__(self, message, retry_after=None, permanent=False):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.permanent = permanent
+
+
+# Sends messages through the Telegram Bot API. api_base can point to a local HTTP stub in tests.
+class TelegramTransport:
+
+    def __init__(self, api_base='https://api.telegram.org', timeout=10):
+        self.api_base = api_base.rstrip('/')
+        self.timeout = timeout
+
+    async def send_message(self, token, chat_id, text):
+        return await asyncio.to_thread(self._post, token, 'sendMessage', {'chat_id': chat_id, 'text': text})
+
+    def _post(self, token, method, payload):
+        request = urllib.request.Request(f'{self.api_base}/bot{token}/{method}', data=json.dumps(payload).encode(),
+                                         headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as error:
+            try:
+                body = json.loads(error.read())
+            except ValueError:
+                body = {}
+            description = body.get('description', str(error))
+            if error.code == 429:
+                retry_after = body.get('parameters', {}).get('retry_after')
+                raise TransportError(description, retry_after=retry_after) from None
+            # Other client errors (bad token, unknown chat, ...) will not succeed on retry
+            raise TransportError(description, permanent=400 <= error.code < 500) from None
+        except (urllib.error.URLError, TimeoutError, OSError) as error:
+            raise TransportError(str(error)) from None
+
+
+# Token bucket: allows `rate` operations per second on average with bursts of up to `capacity`
+class TokenBucket:
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    # Wait until a token is available and take it
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+# Turn a channel link (https://t.me/name, t.me/name, @name or a numeric id) into a Bot API chat_id
+def chat_id_from_link(link):
+    link = (link or '').strip()
+    for prefix in ('https://', 'http://'):
+        if link.startswith(prefix):
+            link = link[len(prefix):]
+    if link.startswith('t.me/'):
+        link = link[len('t.me/'):]
+    link = link.strip('/')
+    if not link or link.lstrip('-').isdigit() or link.startswith('@'):
+        return link
+    return '@' + link
+
+
+# Publishes queued posts from the persistent outbox to Telegram.
+# Limits follow Telegram's guidance: about 20 messages a minute per channel or group and 30 a second overall.
+# Failed sends are retried with exponential backoff (or the server's retry_after) up to max_attempts.
+class Publisher:
+
+    def __init__(self, db, token_provider, transport=None, per_chat_rate=20 / 60, per_chat_burst=3,
+                 global_rate=30, max_attempts=8, base_delay=2.0, max_delay=600.0, poll_interval=None):
+        self.db = db
+        self.token_provider = token_provider  # Returns the current bot token
+        self.transport = transport or TelegramTransport()
+        self.per_chat_rate = per_chat_rate
+        self.per_chat_burst = per_chat_burst
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_buckets = {}
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval  # Longest sleep when other processes may queue posts; None sleeps until woken
+
+        self.loop = None
+        self._wake = None
+        self._thread = None
+
+    # Queue a post; it is stored in the outbox first so it survives restarts. Returns (outbox ID, status) as
+    # enqueue_post does; 'sent' means the same text was already published to the chat. Thread-safe.
+    def publish(self, note_id, chat_id, text):
+        post_id, status = self.db.enqueue_post(note_id, chat_id, text)
+        if status == 'pending':
+            self.wake()
+        return post_id, status
+
+    # Wake the worker early, e.g. after new posts were queued
+    def wake(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._wake.set)
+
+    # Run the worker on its own event loop in a daemon thread
+    def start(self):
+        if self._thread is not None:
+            return
+        self.loop = asyncio.new_event_loop()
+        self._wake = asyncio.Event()
+        self._thread = threading.Thread(target=self.loop.run_until_complete, args=(self.run(),),
+                                        name='publisher', daemon=True)
+        self._thread.start()
+
+    # Worker loop: deliver due posts, then sleep until the next retry deadline or a wake-up.
+    # An unexpected error (e.g. the database is unavailable) is logged and the loop backs off instead of dying.
+    async def run(self):
+        if self._wake is None:
+            self._wake = asyncio.Event()
+        failures = 0
+        while True:
+            try:
+                await self._run_once()
+                failures = 0
+            except Exception:
+                failures += 1
+                delay = min(self.max_delay, self.base_delay * 2 ** (failures - 1))
+                logger.exception('Publisher loop failed, retrying in %.1fs', delay)
+                await asyncio.sleep(delay)
+
+    # One pass of the worker loop. The wake-up flag is cleared before the outbox is read, so a post queued while
+    # the pass runs wakes the next sleep instead of being missed.
+    async def _run_once(self):
+        self._wake.clear()
+        posts = await asyncio.to_thread(self.db.due_posts, time.time())
+        for post in posts:
+            await self.deliver(*post)
+        if posts:
+            return
+
+        next_due = await asyncio.to_thread(self.db.next_post_due)
+        timeout = None if next_due is None else max(0.0, next_due - time.time())
+        if self.poll_interval is not None:
+            timeout = self.poll_interval if timeout is None else min(timeout, self.poll_interval)
+        try:
+            await asyncio.wait_for(self._wake.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    # Send one post within the rate limits and record the outcome
+    async def deliver(self, post_id, chat_id, text, attempts):
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self.chat_buckets[chat_id] = TokenBucket(self.per_chat_rate, self.per_chat_burst)
+        await bucket.acquire()
+        await self.global_bucket.acquire()
+
+        attempts += 1
+        try:
+            token = self.token_provider()
+            if not token:
+                raise TransportError('Bot token is not configured')
+            await self.transport.send_message(token, chat_id, text)
+        except TransportError as error:
+            if error.permanent or attempts >= self.max_attempts:
+                logger.error('Giving up on post %s after %d attempts: %s', post_id, attempts, error)
+                await asyncio.to_thread(self.db.mark_post_failed, post_id, attempts, str(error))
+                return
+            delay = error.retry_after or min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+            delay += random.uniform(0, delay / 10)  # Jitter spreads retries of many posts
+            logger.warning('Post %s failed (%s), retrying in %.1fs', post_id, error, delay)
+            await asyncio.to_thread(self.db.mark_post_failed, post_id, attempts, str(error), time.time() + delay)
+            return
+
+        await asyncio.to_thread(self.db.mark_post_sent, post_id)
+
+
+_publisher = None
+_publisher_lock = threading.Lock()
+
+
+# Process-wide publisher for a database, started on first use. The bot token is the TOKEN_BOT setting.
+# In a web worker process (see utils/Cluster.py) posts are only queued; the supervisor delivers them.
+def get_publisher(db):
+    from utils import Cluster
+    from utils.Settings import get_settings
+
+    global _publisher
+    with _publisher_lock:
+        if _publisher is None:
+            settings = get_settings(db)
+            _publisher = Publisher(db, lambda: settings.get('TOKEN_BOT'), poll_interval=Cluster.poll_interval())
+            if Cluster.runs_background_services():
+                _publisher.start()
+        return _publisher
@@ -0,0 +1,505 @@
+import hashlib  # Content hashes for duplicate detection
+import logging  # Reporting failed background filter rebuilds and index loads
+import os  # Database location and filter sizing from the environment
+import threading  # Locks shared by the pools
+import unicodedata  # Normalising text before hashing
+from abc import ABC, abstractmethod  # Backends must implement the whole interface
+from collections import OrderedDict  # Least recently used note indexes
+
+from utils.BloomFilter import BloomFilter  # In-memory "definitely free" check for emails and logins
+from utils.SortedIndex import SortedNoteIndex  # In-memory note listings in every sort order
+from utils.TTLCache import TTLCache  # Cache of recent email/login existence lookups
+
+# Storage is split into a backend-agnostic Repository (caches, sorted note indexes, sort options) and one subclass
+# per database engine holding the SQL: Database for SQLite files, PostgresDatabase for PostgreSQL servers.
+# open_database() picks the backend from DATABASE_URL, so pages never name an engine.
+
+POSTGRES_SCHEMES = ('postgresql://', 'postgres://')
+
+logger = logging.getLogger(__name__)
+
+
+# Open the database at url (default: DATABASE_URL, else app.db): a postgresql:// URL opens PostgresDatabase,
+# anything else is the path of a SQLite file
+def open_database(url=None):
+    from utils import Metrics
+    Metrics.enable_from_env()  # Tracing has to wrap the backends before their first connection opens
+
+    url = url or os.getenv('DATABASE_URL') or 'app.db'
+    if url.startswith(POSTGRES_SCHEMES):
+        from utils.PostgresDatabase import PostgresDatabase
+        return PostgresDatabase(url)
+
+    from utils.Database import Database
+    return Database(url)
+
+
+# Hash of a note or post text after normalisation (NFKC, case folded, whitespace collapsed),
+# so texts differing only in case or spacing count as duplicates
+def content_hash(text):
+    normalized = ' '.join(unicodedata.normalize('NFKC', text or '').casefold().split())
+    return hashlib.blake2b(normalized.encode(), digest_size=16).hexdigest()
+
+
+# In-memory state kept next to each backend's connection pool and shared by every repository instance using it
+class PoolState:
+
+    def __init__(self):
+        self.fts_enabled = False  # Set by create_db once full-text search is available
+        from utils import Cluster
+
+        self.lookup_cache = TTLCache(maxsize=10000, ttl=60)  # (column, value) -> identifier taken
+        # In a web worker other processes register users too, so a "free" answer from this process's filter or
+        # cache may be stale: only "taken" answers are trusted without asking the database
+        self.shared_identifiers = Cluster.is_worker()
+        self.identifier_filter = None  # BloomFilter over users.email and users.login, built by the repository
+        self.filter_rebuild_lock = threading.Lock()  # Held while a full filter is rebuilt in the background
+        self.filter_lock = threading.Lock()  # Guards filter_backlogs and swapping in a rebuilt filter
+        self.filter_backlogs = []  # Identifiers registered during each running rebuild, replayed before its swap
+        self.write_queue = None  # WriteBehindQueue for notes, created on first use
+        self.note_indexes = OrderedDict()  # user_id (None: all users) -> SortedNoteIndex, least recently used first
+        self.index_lock = threading.Lock()
+        self.index_generation = 0  # Bumped under index_lock whenever notes change, so loads can tell they raced
+        self.index_loads = set()  # user_ids whose index is being built in the background
+        self.notes_version = None  # Backend change marker the loaded indexes reflect
+        self.notes_version_checked = 0.0  # Monotonic time of the last check for writes by other processes
+
+    # Forget the loaded note indexes, e.g. after another process changed notes. Caller holds index_lock.
+    def clear_note_indexes(self):
+        self.note_indexes.clear()
+        self.index_generation += 1
+
+    # Record the backend change marker the loaded indexes reflect, dropping them if it moved. Caller holds
+    # index_lock.
+    def sync_notes_version(self, version):
+        if version != self.notes_version:
+            self.clear_note_indexes()
+            self.notes_version = version
+
+
+# Data access shared by the storage backends. Subclasses open self.pool (a PoolState with a connection() context
+# manager and in_transaction()) and implement every abstract method below; an incomplete backend cannot be created.
+class Repository(ABC):
+    # Columns returned for a note, in tuple order; scheduled_at is a unix time or None
+    note_columns = 'id, user_id, note, priority, created_at, scheduled_at'
+
+    # Sort options offered by PostPage mapped to the columns they order by; the only values allowed in ORDER BY
+    sort_columns = {'priority': 'priority', 'date': 'created_at'}
+
+    # Sorted in-memory note indexes: how many notes all loaded indexes may hold together (each index also counts
+    # as one, so many empty ones are bounded too), above how many notes a user is listed from SQL, and how often
+    # (seconds) listings check whether another process changed the notes
+    note_index_rows = 500000
+    note_index_max = 100000
+    index_check_interval = 1.0
+
+    # Connection pools of every backend shared by all repository instances, keyed by database path or URL
+    _pools = {}
+    _pools_lock = threading.Lock()
+
+    # True when note search can use the full-text index instead of LIKE
+    @property
+    def fts_enabled(self):
+        return self.pool.fts_enabled
+
+    # Context manager yielding a pooled connection wrapped in a transaction
+    def connection(self):
+        return self.pool.connection()
+
+    # Close all pooled connections of every database (called on shutdown)
+    @classmethod
+    def close_all(cls):
+        with Repository._pools_lock:
+            for pool in Repository._pools.values():
+                pool.close()
+            Repository._pools.clear()
+
+    # Rebuild the Bloom filter of registered emails and logins by streaming the users table.
+    # Sizing comes from BLOOM_CAPACITY / BLOOM_ERROR_RATE; capacity is raised to twice the current number of
+    # identifiers (two per user) so the filter has room to grow.
+    def rebuild_identifier_filter(self, capacity=None, error_rate=None):
+        capacity = capacity or int(os.getenv('BLOOM_CAPACITY', '100000'))
+        error_rate = error_rate or float(os.getenv('BLOOM_ERROR_RATE', '0.01'))
+
+        # Users registered after the table is read are recorded in a backlog, so the new filter misses none
+        backlog = []
+        with self.pool.filter_lock:
+            self.pool.filter_backlogs.append(backlog)
+        try:
+            with self.connection() as conn:
+                users = conn.execute('SELECT COUNT(*) FROM users').fetchone()[0]
+                identifier_filter = BloomFilter(max(capacity, 4 * users), error_rate)
+                for email, login in conn.execute('SELECT email, login FROM users'):
+                    identifier_filter.add(f'email:{email}')
+                    identifier_filter.add(f'login:{login}')
+
+            with self.pool.filter_lock:
+                for identifier in backlog:
+                    identifier_filter.add(identifier)
+                self.pool.identifier_filter = identifier_filter  # Swapped in whole, readers never see a partial filter
+        finally:
+            with self.pool.filter_lock:
+                self.pool.filter_backlogs.remove(backlog)
+        return identifier_filter
+
+    # Start a background rebuild once the filter holds as many identifiers as it was sized for: past that point
+    # its fill ratio passes one half and the false-positive rate climbs quickly
+    def _check_identifier_filter(self):
+        identifier_filter = self.pool.identifier_filter
+        if identifier_filter.count >= identifier_filter.capacity and self.pool.filter_rebuild_lock.acquire(False):
+            threading.Thread(target=self._rebuild_filter_in_background, name='identifier-filter', daemon=True).start()
+
+    def _rebuild_filter_in_background(self):
+        try:
+            self.rebuild_identifier_filter()
+        except Exception:
+            logger.exception('Rebuilding the email/login filter failed')
+        finally:
+            self.pool.filter_rebuild_lock.release()
+
+    # True if the identifier may be taken; False means it is definitely free, without touching the database
+    def may_be_taken(self, column, value):
+        return f'{column}:{value}' in self.pool.identifier_filter
+
+    # Check if an identifier (email or login) is taken, answering from the filter or lookup cache when possible
+    def _identifier_taken(self, column, value):
+        shared = self.pool.shared_identifiers
+        if not shared and not self.may_be_taken(column, value):
+            return False
+
+        cached = self.pool.lookup_cache.get((column, value))
+        if cached is not TTLCache.missing:
+            return cached
+
+        taken = self._identifier_exists(column, value)
+        if taken or not shared:
+            self.pool.lookup_cache.set((column, value), taken)
+        return taken
+
+    # Check if an email is already registered
+    def check_email(self, email):
+        return self._identifier_taken('email', email)  # Return True if email exists, False if it doesn't
+
+    # Check if a login is already taken
+    def check_login(self, login):
+        return self._identifier_taken('login', login)  # Return True if login exists, False if it doesn't
+
+    # Record a registered user in the lookup cache and the Bloom filter
+    def _remember_user(self, email, login):
+        self.pool.lookup_cache.set(('email', email), True)
+        self.pool.lookup_cache.set(('login', login), True)
+        identifiers = (f'email:{email}', f'login:{login}')
+        with self.pool.filter_lock:
+            for identifier in identifiers:
+                self.pool.identifier_filter.add(identifier)
+            for backlog in self.pool.filter_backlogs:
+                backlog.extend(identifiers)
+        self._check_identifier_filter()
+
+    # Record the identifier a failed registration collided with
+    def _remember_conflict(self, conflict, email, login):
+        self.pool.lookup_cache.set((conflict, email if conflict == 'email' else login), True)
+
+    # Number of stored notes
+    def count_notes(self):
+        with self.connection() as conn:
+            return conn.execute('SELECT COUNT(*) FROM notes').fetchone()[0]
+
+    # Unix time of the earliest pending attempt, or None if the outbox is empty
+    def next_post_due(self):
+        with self.connection() as conn:
+            return conn.execute("SELECT MIN(next_attempt_at) FROM outbox WHERE status = 'pending'").fetchone()[0]
+
+    # All stored settings as a {key: text value} dict
+    def get_settings(self):
+        with self.connection() as conn:
+            return dict(conn.execute('SELECT key, value FROM settings').fetchall())
+
+    # All scheduled notes as (note_id, scheduled_at), read through the partial index
+    def scheduled_notes(self):
+        with self.connection() as conn:
+            rows = conn.execute('SELECT id, scheduled_at FROM notes WHERE scheduled_at IS NOT NULL').fetchall()
+        return rows
+
+    # Sorted index of a user's notes (user_id None: everyone's), loaded on first use and then kept up to date
+    # by the write methods. None when the user has more than note_index_max notes.
+    def note_index(self, user_id=None):
+        with self.pool.index_lock:
+            self._check_notes_version()
+            indexes = self.pool.note_indexes
+            if user_id in indexes:
+                indexes.move_to_end(user_id)
+                return indexes[user_id]
+            generation = self.pool.index_generation
+
+        # Loaded without the lock so listings of other users and writes are not held up by the queries
+        version, notes = self._load_index_notes(user_id)
+        index = SortedNoteIndex(notes, self.sort_fields()) if notes is not None else None
+
+        with self.pool.index_lock:
+            if self.pool.index_generation != generation:
+                # Notes changed while loading and the snapshot may miss the change: use it for this listing only
+                return index
+            self.pool.sync_notes_version(version)
+            if user_id in indexes:
+                return indexes[user_id]  # Loaded by another thread meanwhile
+
+            indexes[user_id] = index
+            rows = sum(1 + len(loaded or ()) for loaded in indexes.values())
+            while rows > self.note_index_rows and len(indexes) > 1:
+                _, evicted = indexes.popitem(last=False)
+                rows -= 1 + len(evicted or ())
+            return index
+
+    # Loaded sorted index of a user's notes (None too when the user has more than note_index_max notes).
+    # Returns None at once if it is not loaded yet and starts building it in the background, so the caller serves
+    # this request with a keyset query instead of waiting for up to note_index_max rows to load.
+    def cached_note_index(self, user_id=None):
+        with self.pool.index_lock:
+            self._check_notes_version()
+            indexes = self.pool.note_indexes
+            if user_id in indexes:
+                indexes.move_to_end(user_id)
+                return indexes[user_id]
+            if user_id in self.pool.index_loads:
+                return None
+            self.pool.index_loads.add(user_id)
+
+        threading.Thread(target=self._load_note_index_in_background, args=(user_id,), name='note-index',
+                         daemon=True).start()
+        return None
+
+    def _load_note_index_in_background(self, user_id):
+        try:
+            self.note_index(user_id)
+        except Exception:
+            logger.exception('Loading the note index of user %s failed', user_id)
+        finally:
+            with self.pool.index_lock:
+                self.pool.index_loads.discard(user_id)
+
+    # Drop the loaded indexes if another process changed notes. Caller holds index_lock.
+    # Backends that are told about such changes as they happen leave this empty.
+    def _check_notes_version(self):
+        pass
+
+    # Position in a note tuple of each sort option's column
+    def sort_fields(self):
+        columns = self.note_columns.split(', ')
+        return {name: columns.index(column) for name, column in self.sort_columns.items()}
+
+    # Apply committed note inserts and deletes to the loaded indexes
+    def _index_notes(self, added=(), removed=()):
+        with self.pool.index_lock:
+            self.pool.index_generation += 1
+            for user_id, index in self.pool.note_indexes.items():
+                if index is None:
+                    continue
+                for note_id in removed:
+                    index.discard(note_id)
+                for note in added:
+                    if user_id is None or note[1] == user_id:
+                        index.add(note)
+
+    # Refresh one note in the loaded indexes after an update
+    def _reindex_note(self, note_id):
+        note = self.get_note(note_id)
+        if note is not None:
+            self._index_notes(added=[note])
+
+    # Forget all loaded indexes, e.g. after a bulk import
+    def _drop_note_indexes(self):
+        with self.pool.index_lock:
+            self.pool.clear_note_indexes()
+
+    # Process-wide write-behind queue batching note creates and deletes for this database
+    @property
+    def write_queue(self):
+        from utils.WriteBehind import WriteBehindQueue
+
+        with Repository._pools_lock:
+            if self.pool.write_queue is None:
+                self.pool.write_queue = WriteBehindQueue(self)
+            return self.pool.write_queue
+
+    # Name of a sort option ("Priority" -> "priority"); raises ValueError for options not in sort_columns
+    def sort_key(self, sort_by):
+        key = (sort_by or 'priority').lower()
+        if key not in self.sort_columns:
+            raise ValueError(f'Unknown sort option: {sort_by}')
+        return key
+
+    # Column a sort option orders by
+    def sort_column(self, sort_by):
+        return self.sort_columns[self.sort_key(sort_by)]
+
+    # Keyset cursor (sort value, id) of a note row for the given sort option
+    def note_cursor(self, note, sort_by="priority"):
+        return note[self.note_columns.split(', ').index(self.sort_column(sort_by))], note[0]
+
+    # Retrieve and sort user notes with optional search and sorting criteria
+    def get_user_notes_sorted(self, search_query="", sort_by="priority", user_id=None):
+        index = None if search_query else self.note_index(user_id)
+        if index is not None:
+            with self.pool.index_lock:
+                return index.page(self.sort_key(sort_by))
+        return self._select_notes(search_query, sort_by, user_id)
+
+    # Fetch one page of notes after the keyset cursor (after_value, after_id), where after_value is the
+    # sort column value of the last note already shown (its priority or created_at). Cost depends only on page_size.
+    # Without a search query the page comes from the in-memory sorted index, with no query at all, once that index
+    # is loaded; until then pages come from the keyset query while the index is built in the background.
+    def get_notes_page(self, search_query="", sort_by="priority", after_value=None, after_id=None, page_size=50,
+                       user_id=None):
+        self.sort_column(sort_by)  # Reject unknown sort options before touching the index
+        index = None if search_query else self.cached_note_index(user_id)
+        if index is not None:
+            with self.pool.index_lock:
+                return index.page(self.sort_key(sort_by), after_value, after_id, page_size)
+        return self._select_notes_page(search_query, sort_by, after_value, after_id, page_size, user_id)
+
+    # Backend interface. Notes are tuples in note_columns order; NULL sort values order first.
+
+    # Create the schema and apply pending migrations
+    @abstractmethod
+    def create_db(self):
+        ...
+
+    # Like connection(), but queries are aborted with an error once cancel_event is set
+    @abstractmethod
+    def cancellable(self, cancel_event):
+        ...
+
+    # Write transaction on notes that keeps this process's sorted note indexes in step with other processes
+    @abstractmethod
+    def notes_transaction(self):
+        ...
+
+    # (change marker, notes) of user_id (None: all) for a new sorted index; notes is None when there are more than
+    # note_index_max. The marker is the backend's notes version at the time of the read, or None if it has none.
+    # Called without index_lock.
+    @abstractmethod
+    def _load_index_notes(self, user_id):
+        ...
+
+    # True if a user with this email or login exists
+    @abstractmethod
+    def _identifier_exists(self, column, value):
+        ...
+
+    # Register a new user; returns (user_id, None) or (None, 'email' / 'login') naming the taken key
+    @abstractmethod
+    def register_user(self, email, login, password):
+        ...
+
+    # (user ID, stored password hash) for an email, or None
+    @abstractmethod
+    def get_credentials(self, email):
+        ...
+
+    # Replace a user's stored password hash
+    @abstractmethod
+    def update_password(self, user_id, password):
+        ...
+
+    # Create a note (or find the user's note with the same text); returns its ID
+    @abstractmethod
+    def create_note(self, user_id, note, priority):
+        ...
+
+    # Single note by ID, or None
+    @abstractmethod
+    def get_note(self, note_id):
+        ...
+
+    # Insert (user_id, note, priority) creates and delete note IDs in one transaction; returns the created IDs
+    @abstractmethod
+    def apply_note_batch(self, creates, deletes):
+        ...
+
+    # Bulk insert of (user_id, note, priority, created_at, scheduled_at) rows skipping duplicates; returns the
+    # number inserted
+    @abstractmethod
+    def insert_notes(self, rows):
+        ...
+
+    # Yield every note in id order, chunk_size rows at a time
+    @abstractmethod
+    def iter_notes(self, chunk_size=1000):
+        ...
+
+    # Queue a post for the publisher; returns (outbox ID, status). A duplicate text returns the earlier post's ID
+    # and status: 'pending' while it waits, 'sent' once it was published.
+    @abstractmethod
+    def enqueue_post(self, note_id, chat_id, text):
+        ...
+
+    # Pending posts due at unix time now: rows of (id, chat_id, text, attempts)
+    @abstractmethod
+    def due_posts(self, now, limit=50):
+        ...
+
+    # Record a delivered post
+    @abstractmethod
+    def mark_post_sent(self, post_id):
+        ...
+
+    # Record a failed attempt, retried at next_attempt_at or given up on when it is None
+    @abstractmethod
+    def mark_post_failed(self, post_id, attempts, error, next_attempt_at=None):
+        ...
+
+    # Store several settings in one transaction
+    @abstractmethod
+    def save_settings(self, values):
+        ...
+
+    # Set (or with None, clear) the unix time at which a note is published
+    @abstractmethod
+    def schedule_note(self, note_id, scheduled_at):
+        ...
+
+    # Move a due note into the outbox and clear its schedule; returns the outbox ID or None
+    @abstractmethod
+    def dispatch_scheduled_note(self, note_id, chat_id):
+        ...
+
+    # {original note ID: [duplicate IDs]} for notes duplicating another note of the same user
+    @abstractmethod
+    def duplicate_notes(self, chunk_size=1000):
+        ...
+
+    # Delete the duplicates found by duplicate_notes; returns the number deleted
+    @abstractmethod
+    def remove_duplicate_notes(self, duplicates):
+        ...
+
+    # All notes of a user, unsorted
+    @abstractmethod
+    def get_user_notes(self, user_id):
+        ...
+
+    # Delete a note by ID
+    @abstractmethod
+    def delete_note(self, note_id):
+        ...
+
+    # Notes matching a search and/or user, sorted, without the in-memory index
+    @abstractmethod
+    def _select_notes(self, search_query, sort_by, user_id):
+        ...
+
+    # One keyset page of notes matching a search and/or user, without the in-memory index
+    @abstractmethod
+    def _select_notes_page(self, search_query, sort_by, after_value, after_id, page_size, user_id):
+        ...
+
+    # Notes ranked by relevance with a highlighted snippet: rows are note columns + (snippet, rank), best first
+    @abstractmethod
+    def search_notes(self, search_query, user_id=None, limit=50, highlight=('[', ']')):
+        ...
+
+    # Query plan of a statement as text lines, for the slow-query log
+    @abstractmethod
+    def explain(self, sql, params=()):
+        ...
@@ -0,0 +1,190 @@
+import asyncio  # Sleeping until the next deadline
+import heapq  # Time-ordered queue of pending posts
+import itertools  # Tie-breaker for equal deadlines
+import logging  # Reporting dispatch failures
+import threading  # The scheduler runs its own event loop in a background thread
+import time  # Deadlines are unix times
+
+logger = logging.getLogger(__name__)
+
+
+# Publishes scheduled notes at their publish-at time.
+# Pending notes live in a min-heap keyed by time and backed by notes.scheduled_at, so the heap is
+# rebuilt from the database after a restart. Inserts are O(log n); cancellations mark the heap entry
+# as removed and it is discarded when it reaches the top. The worker sleeps until the next deadline.
+# With poll_interval set, the heap is also reloaded that often to pick up notes scheduled by other processes.
+# A note whose dispatch fails goes back on the heap and is retried with exponential backoff.
+class Scheduler:
+    removed = None  # Note id of a cancelled heap entry
+
+    def __init__(self, db, dispatch, poll_interval=None, retry_delay=30.0, max_retry_delay=3600.0):
+        self.db = db
+        self.dispatch = dispatch  # dispatch(note_id) publishes a due note; runs in a worker thread
+        self.poll_interval = poll_interval
+        self.retry_delay = retry_delay  # Delay before the first retry of a failed dispatch, doubled on each failure
+        self.max_retry_delay = max_retry_delay
+        self._heap = []  # [scheduled_at, sequence, note_id]
+        self._entries = {}  # note_id -> heap entry
+        self._in_flight = set()  # Ids popped for dispatch whose outcome is not recorded yet
+        self._retries = {}  # note_id -> (failed dispatches, retry deadline)
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._loaded = False  # The heap is kept only once loaded: a scheduler that never runs just records schedules
+
+        self.loop = None
+        self._wake = None
+        self._thread = None
+
+    # Schedule (or reschedule) a note for a unix time; persisted before it enters the heap. Thread-safe.
+    def schedule(self, note_id, scheduled_at):
+        self.db.schedule_note(note_id, scheduled_at)
+        if self._loaded:
+            self._push(note_id, scheduled_at)
+            self.wake()
+
+    # Cancel a note's schedule. Thread-safe.
+    def cancel(self, note_id):
+        self.db.schedule_note(note_id, None)
+        with self._lock:
+            self._discard(note_id)
+
+    # Number of pending scheduled notes
+    def __len__(self):
+        return len(self._entries)
+
+    # Rebuild the heap from the database, e.g. after a restart. Failed notes keep their retry deadline.
+    def load(self):
+        rows = self.db.scheduled_notes()
+        with self._lock:
+            self._retries = {note_id: self._retries[note_id] for note_id, _ in rows if note_id in self._retries}
+            self._entries = {note_id: [max(at, self._retries.get(note_id, (0, at))[1]), next(self._sequence), note_id]
+                             for note_id, at in rows}
+            self._heap = list(self._entries.values())
+            heapq.heapify(self._heap)
+            self._loaded = True
+
+    # Wake the worker so it recomputes its sleep, e.g. after an earlier deadline was added
+    def wake(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._wake.set)
+
+    # Load pending notes and run the worker on its own event loop in a daemon thread
+    def start(self):
+        if self._thread is not None:
+            return
+        self.load()
+        self.loop = asyncio.new_event_loop()
+        self._wake = asyncio.Event()
+        self._thread = threading.Thread(target=self.loop.run_until_complete, args=(self.run(),),
+                                        name='scheduler', daemon=True)
+        self._thread.start()
+
+    # Worker loop: dispatch every due note, then sleep until the next deadline or a wake-up
+    async def run(self):
+        if self._wake is None:
+            self._wake = asyncio.Event()
+        while True:
+            self._wake.clear()
+            for note_id in self._pop_due(time.time()):
+                try:
+                    await asyncio.to_thread(self.dispatch, note_id)
+                except Exception:
+                    logger.exception('Dispatching scheduled note %s failed', note_id)
+                    self._dispatched(note_id, failed=True)
+                else:
+                    self._dispatched(note_id, failed=False)
+
+            next_at = self._next_deadline()
+            timeout = None if next_at is None else max(0.0, next_at - time.time())
+            if self.poll_interval is not None and (timeout is None or timeout > self.poll_interval):
+                try:
+                    await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    await asyncio.to_thread(self.load)
+                continue
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _push(self, note_id, scheduled_at):
+        with self._lock:
+            self._discard(note_id)
+            self._add(note_id, scheduled_at)
+
+    # Add a heap entry; caller holds the lock
+    def _add(self, note_id, scheduled_at):
+        entry = [scheduled_at, next(self._sequence), note_id]
+        self._entries[note_id] = entry
+        heapq.heappush(self._heap, entry)
+
+    # Mark a note's entry as removed and forget its pending dispatch and retries; caller holds the lock
+    def _discard(self, note_id):
+        self._in_flight.discard(note_id)
+        self._retries.pop(note_id, None)
+        entry = self._entries.pop(note_id, None)
+        if entry is not None:
+            entry[2] = self.removed
+
+    # Record the outcome of a dispatch. A failed note goes back on the heap with a backoff deadline,
+    # unless it was cancelled or rescheduled while the dispatch ran.
+    def _dispatched(self, note_id, failed):
+        with self._lock:
+            if note_id not in self._in_flight:
+                return
+            self._in_flight.discard(note_id)
+            if not failed:
+                self._retries.pop(note_id, None)
+                return
+            attempts = self._retries.get(note_id, (0, None))[0] + 1
+            retry_at = time.time() + min(self.max_retry_delay, self.retry_delay * 2 ** (attempts - 1))
+            self._retries[note_id] = (attempts, retry_at)
+            self._add(note_id, retry_at)
+
+    # Pop the ids of all notes due at `now`, dropping cancelled entries on the way
+    def _pop_due(self, now):
+        due = []
+        with self._lock:
+            while self._heap and (self._heap[0][2] is self.removed or self._heap[0][0] <= now):
+                entry = heapq.heappop(self._heap)
+                if entry[2] is not self.removed:
+                    del self._entries[entry[2]]
+                    self._in_flight.add(entry[2])
+                    due.append(entry[2])
+        return due
+
+    def _next_deadline(self):
+        with self._lock:
+            while self._heap and self._heap[0][2] is self.removed:
+                heapq.heappop(self._heap)
+            return self._heap[0][0] if self._heap else None
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+# Process-wide scheduler, started on first use. Due notes go to the CHANNEL_LINK channel via the publisher;
+# without a channel link they stay scheduled and are retried.
+# In a web worker process (see utils/Cluster.py) it only records schedules; the supervisor dispatches them.
+def get_scheduler(db):
+    from utils import Cluster
+    from utils.Publisher import get_publisher, chat_id_from_link
+    from utils.Settings import get_settings
+
+    settings = get_settings(db)
+
+    def dispatch(note_id):
+        channel_link = settings.get('CHANNEL_LINK')
+        if not channel_link:
+            raise RuntimeError('No channel link is configured')
+        if db.dispatch_scheduled_note(note_id, chat_id_from_link(channel_link)) is not None:
+            get_publisher(db).wake()
+
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = Scheduler(db, dispatch, poll_interval=Cluster.poll_interval())
+            if Cluster.runs_background_services():
+                _scheduler.start()
+        return _scheduler
@@ -0,0 +1,44 @@
+import asyncio  # Debounce timers and tasks on the Flet event loop
+import threading  # Cancellation flag shared with the worker thread
+
+
+# Debounced search: waits for typing to pause, runs the query off the event loop,
+# cancels the previous query on every new keystroke and drops results of stale queries
+class SearchPipeline:
+
+    def __init__(self, fetch, apply, debounce=0.25):
+        self.fetch = fetch  # fetch(search_query, sort_by, cancel_event) -> result, runs in a worker thread
+        self.apply = apply  # apply(search_query, sort_by, result), runs on the event loop
+        self.debounce = debounce  # Seconds without a new keystroke before the query runs
+        self._task = None
+        self._cancel_event = None
+
+    # Start a search for the latest input, replacing any pending or running one.
+    # Must be called from the event loop, e.g. from an async Flet handler.
+    def submit(self, search_query, sort_by, debounce=None):
+        self.cancel()
+        self._cancel_event = threading.Event()
+        delay = self.debounce if debounce is None else debounce
+        self._task = asyncio.create_task(self._run(search_query, sort_by, delay, self._cancel_event))
+
+    # Cancel the pending debounce and interrupt the query in flight
+    def cancel(self):
+        if self._cancel_event is not None:
+            self._cancel_event.set()
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+
+    async def _run(self, search_query, sort_by, delay, cancel_event):
+        if delay:
+            await asyncio.sleep(delay)
+
+        try:
+            result = await asyncio.to_thread(self.fetch, search_query, sort_by, cancel_event)
+        except Exception:
+            if cancel_event.is_set():
+                return  # The query was interrupted by a newer one
+            raise
+
+        # A newer search started while this one was running
+        if not cancel_event.is_set():
+            self.apply(search_query, sort_by, result)
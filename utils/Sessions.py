@@ -0,0 +1,74 @@
+import logging  # Reporting failed prefetches
+import threading  # The store singleton
+from concurrent.futures import ThreadPoolExecutor  # Background prefetch after login
+
+from utils.TTLCache import TTLCache  # Idle expiry with least recently used eviction
+
+logger = logging.getLogger(__name__)
+
+
+# Server-side state of one signed-in Flet session
+class Session:
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+
+
+# Maps Flet session ids to signed-in users. Sessions expire after idle_timeout seconds without a request,
+# and the least recently used one is dropped when more than max_sessions are signed in.
+# Signing in warms up the user's sorted note index and the settings in the background.
+class SessionStore:
+
+    def __init__(self, max_sessions=1000, idle_timeout=3600, prefetch_workers=2):
+        self._sessions = TTLCache(maxsize=max_sessions, ttl=idle_timeout)
+        self._prefetcher = ThreadPoolExecutor(max_workers=prefetch_workers, thread_name_prefix='session-prefetch')
+
+    # Sign a Flet session in as user_id and start prefetching that user's data from db
+    def login(self, session_id, user_id, db):
+        session = Session(user_id)
+        self._sessions.set(session_id, session)
+        self._prefetcher.submit(self._prefetch, session, db)
+        return session
+
+    # Signed-in session for a Flet session id, or None; every lookup restarts the idle timer
+    def get(self, session_id):
+        session = self._sessions.get(session_id)
+        if session is TTLCache.missing:
+            return None
+        self._sessions.set(session_id, session)
+        return session
+
+    # Sign a Flet session out
+    def logout(self, session_id):
+        self._sessions.discard(session_id)
+
+    # Load what the first signed-in pages need into the shared caches, so they open without waiting on the database.
+    # Pages never wait for this: a listing that comes first is served by the keyset query instead.
+    def _prefetch(self, session, db):
+        from utils.Settings import get_settings
+
+        try:
+            get_settings(db)
+            # The notes page lists unfiltered notes from the user's in-memory sorted index
+            db.note_index(session.user_id)
+        except Exception:
+            logger.exception('Prefetch for user %s failed', session.user_id)
+
+
+_sessions = None
+_sessions_lock = threading.Lock()
+
+
+# Process-wide session store
+def get_sessions():
+    global _sessions
+    with _sessions_lock:
+        if _sessions is None:
+            _sessions = SessionStore()
+        return _sessions
+
+
+# ID of the user signed in to a Flet page's session, or None
+def current_user_id(page):
+    session = get_sessions().get(page.session_id)
+    return session.user_id if session else None
@@ -0,0 +1,146 @@
+import logging  # Reporting failed change listeners
+import os  # Legacy values from the environment
+import threading  # Settings are read and saved from every session thread
+import time  # Age of the cached values
+import weakref  # Listeners of closed sessions are dropped automatically
+from pathlib import Path  # Legacy env file location
+
+logger = logging.getLogger(__name__)
+
+# Known settings: key -> (type, default). Values are stored as text and converted on load.
+FIELDS = {
+    'TOKEN_BOT': (str, ''),
+    'CHANNEL_LINK': (str, ''),
+}
+
+# Env file the dashboard used to write; imported once into the settings table
+LEGACY_ENV_FILE = Path('.') / 'env.'
+
+
+# Typed application settings stored in the settings table of app.db.
+# Values are loaded once and served from memory; a save writes all changed keys in one transaction
+# and then notifies the listeners, so open pages update without re-reading anything.
+# With max_age set (several processes share the database) values older than that are reloaded,
+# and changes saved by other processes are passed to the listeners too.
+class SettingsStore:
+
+    def __init__(self, db, max_age=None):
+        self.db = db
+        self.max_age = max_age
+        self._loaded_at = 0.0
+        self._values = {}
+        self._listeners = []  # Weak references to callables taking the {key: value} dict of changes
+        self._lock = threading.Lock()
+        self.load()
+
+    # Load all settings from the database, importing missing keys from the legacy env file or environment once
+    def load(self):
+        stored = self.db.get_settings()
+        missing = [key for key in FIELDS if key not in stored]
+        if missing:
+            legacy = self.legacy_values()
+            imported = {key: legacy[key] for key in missing if legacy.get(key)}
+            if imported:
+                self.db.save_settings(imported)
+                stored.update(imported)
+
+        with self._lock:
+            values = {key: self.convert(key, stored.get(key)) for key in FIELDS}
+            changes = {key: value for key, value in values.items() if self._values and value != self._values[key]}
+            self._values = values
+            self._loaded_at = time.monotonic()
+
+        if changes:
+            self._notify(changes)
+
+    # Values from the env file the dashboard used to write, falling back to the process environment
+    @staticmethod
+    def legacy_values():
+        values = {}
+        if LEGACY_ENV_FILE.is_file():
+            from dotenv import dotenv_values
+            values = dotenv_values(LEGACY_ENV_FILE)
+        return {key: values.get(key) or os.getenv(key) for key in FIELDS}
+
+    # Convert a stored text value to the setting's type; None gives the default
+    @staticmethod
+    def convert(key, value):
+        kind, default = FIELDS[key]
+        return default if value is None else kind(value)
+
+    # Current value of a setting
+    def get(self, key):
+        if key not in FIELDS:
+            raise KeyError(f'Unknown setting: {key}')
+        self._refresh()
+        with self._lock:
+            return self._values[key]
+
+    # Snapshot of every setting
+    def all(self):
+        self._refresh()
+        with self._lock:
+            return dict(self._values)
+
+    # Save several settings at once and notify listeners of the keys that changed; returns the changes
+    def update(self, values):
+        unknown = [key for key in values if key not in FIELDS]
+        if unknown:
+            raise KeyError(f'Unknown settings: {", ".join(unknown)}')
+
+        with self._lock:
+            changes = {key: self.convert(key, value) for key, value in values.items()
+                       if self.convert(key, value) != self._values[key]}
+            if changes:
+                self.db.save_settings({key: str(value) for key, value in changes.items()})
+                self._values.update(changes)
+
+        if changes:
+            self._notify(changes)
+        return changes
+
+    # Call listener(changes) after every save that changes something; returns a function that unsubscribes.
+    # Bound methods are held weakly, so a closed session's page does not need to unsubscribe.
+    def subscribe(self, listener):
+        ref = weakref.WeakMethod(listener) if hasattr(listener, '__self__') else (lambda: listener)
+        with self._lock:
+            self._listeners.append(ref)
+
+        def unsubscribe():
+            with self._lock:
+                if ref in self._listeners:
+                    self._listeners.remove(ref)
+
+        return unsubscribe
+
+    # Reload values older than max_age
+    def _refresh(self):
+        if self.max_age is not None and time.monotonic() - self._loaded_at > self.max_age:
+            self.load()
+
+    def _notify(self, changes):
+        with self._lock:
+            listeners = [ref() for ref in self._listeners]
+            self._listeners = [ref for ref, listener in zip(self._listeners, listeners) if listener is not None]
+        for listener in listeners:
+            if listener is None:
+                continue
+            try:
+                listener(changes)
+            except Exception:
+                logger.exception('Settings listener failed')
+
+
+_settings = None
+_settings_lock = threading.Lock()
+
+
+# Process-wide settings store, loaded on first use
+def get_settings(db):
+    from utils import Cluster
+
+    global _settings
+    with _settings_lock:
+        if _settings is None:
+            _settings = SettingsStore(db, max_age=Cluster.poll_interval())
+        return _settings
@@ -0,0 +1,45 @@
+from bisect import bisect_left, bisect_right, insort  # Sorted list maintenance
+
+
+# In-memory copy of a user's notes kept in every sort order at once, so switching the sort or
+# paging needs no query. Each order is a list of (has value, value, id) keys maintained with bisect;
+# NULL values sort first, as in SQLite. Not thread-safe: Database guards it with a lock.
+class SortedNoteIndex:
+
+    def __init__(self, notes, sort_fields):
+        self.sort_fields = sort_fields  # Sort option name -> position of its value in a note tuple
+        self.notes = {note[0]: note for note in notes}  # Note id -> note tuple
+        self.orders = {name: sorted(self.key(note[position], note[0]) for note in self.notes.values())
+                       for name, position in sort_fields.items()}
+
+    # Sort key of a value and note id; the flag keeps NULLs first and apart from real values
+    @staticmethod
+    def key(value, note_id):
+        return value is not None, value if value is not None else 0, note_id
+
+    # Number of indexed notes
+    def __len__(self):
+        return len(self.notes)
+
+    # Add a note, replacing the stored copy if it is already indexed
+    def add(self, note):
+        self.discard(note[0])
+        self.notes[note[0]] = note
+        for name, position in self.sort_fields.items():
+            insort(self.orders[name], self.key(note[position], note[0]))
+
+    # Remove a note if it is indexed
+    def discard(self, note_id):
+        note = self.notes.pop(note_id, None)
+        if note is None:
+            return
+        for name, position in self.sort_fields.items():
+            order = self.orders[name]
+            del order[bisect_left(order, self.key(note[position], note_id))]
+
+    # Notes in the given sort order after the keyset cursor (after_value, after_id); limit None returns all
+    def page(self, sort_by, after_value=None, after_id=None, limit=None):
+        order = self.orders[sort_by]
+        start = bisect_right(order, self.key(after_value, after_id)) if after_id is not None else 0
+        end = None if limit is None else start + limit
+        return [self.notes[key[2]] for key in order[start:end]]
@@ -0,0 +1,47 @@
+import threading  # Cache is shared by every session thread
+import time  # Expiry timestamps
+from collections import OrderedDict  # Least recently used ordering
+
+
+# Bounded mapping whose entries expire after ttl seconds; the least recently used entry is evicted when full
+class TTLCache:
+    missing = object()  # Returned by get() when there is no live entry
+
+    def __init__(self, maxsize=10000, ttl=60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    # Return the cached value, or TTLCache.missing if absent or expired
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return self.missing
+            if entry[0] < time.monotonic():
+                del self._data[key]
+                return self.missing
+            self._data.move_to_end(key)
+            return entry[1]
+
+    # Store a value, evicting the least recently used entry if the cache is full
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    # Drop one entry
+    def discard(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    # Drop every entry
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
@@ -0,0 +1,176 @@
+import atexit  # Flushing pending writes on shutdown
+import itertools  # Temporary ids for notes not yet written
+import logging  # Reporting failed batches
+import threading  # Background flusher
+import time  # Flush deadlines
+
+from utils.TTLCache import TTLCache  # Recently flushed temporary id -> real id
+
+logger = logging.getLogger(__name__)
+
+
+# Write-behind queue in front of Database for note creation and deletion.
+# Writes are collected and committed in one transaction per batch, flushed when max_batch
+# operations are pending, when the oldest one is max_delay seconds old, or on shutdown.
+# Created notes get a negative temporary id right away so the UI can show them optimistically.
+# A failed batch is retried a few times with backoff; if it still fails, every callback gets None.
+class WriteBehindQueue:
+
+    def __init__(self, db, max_batch=50, max_delay=0.5, retries=3, retry_delay=0.5):
+        self.db = db
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.retries = retries  # Extra attempts for a failed batch, e.g. while the database is locked
+        self.retry_delay = retry_delay  # Seconds before the first retry, doubled after each failure
+
+        self._creates = {}  # temp id -> (user_id, note, priority, on_done)
+        self._deletes = {}  # note id -> on_done
+        self._oldest = None  # monotonic time of the oldest pending operation
+        self._in_flight = set()  # temp ids being written right now
+        self._deferred_deletes = set()  # temp ids deleted while their create was in flight
+        self._resolved = TTLCache(maxsize=10000, ttl=300)  # temp id -> real id after the flush
+        self._temp_ids = itertools.count(-1, -1)
+
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='note-write-behind', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    # Reserve a temporary id, so the caller can show the note under it before queueing it with create_note
+    def reserve_id(self):
+        with self._cond:
+            return next(self._temp_ids)
+
+    # Queue a new note under temp_id (a new one if None); returns the temporary id.
+    # on_done(real_id) runs after the batch commits (None on failure).
+    def create_note(self, user_id, note, priority, on_done=None, temp_id=None):
+        with self._cond:
+            if temp_id is None:
+                temp_id = next(self._temp_ids)
+            self._creates[temp_id] = (user_id, note, priority, on_done)
+            self._pending_added()
+        return temp_id
+
+    # Queue a note deletion; a note still waiting to be created is simply dropped from the queue.
+    # on_done(note_id) runs once the note is gone (None on failure).
+    def delete_note(self, note_id, on_done=None):
+        requested_id = note_id
+        with self._cond:
+            if note_id < 0:
+                real_id = self._resolved.get(note_id)
+                if note_id in self._creates:
+                    # Created and deleted within one batch: neither write reaches the database
+                    self._creates.pop(note_id)
+                elif note_id in self._in_flight:
+                    self._deferred_deletes.add(note_id)
+                elif real_id is not TTLCache.missing:
+                    note_id = real_id
+                if note_id < 0:
+                    note_id = None
+            if note_id is not None:
+                self._deletes[note_id] = on_done
+                self._pending_added()
+
+        if note_id is None:
+            self._call(on_done, requested_id)
+
+    # Write everything pending now, on the calling thread
+    def flush(self):
+        with self._cond:
+            creates, deletes = self._take()
+        self._write(creates, deletes)
+
+    # Flush pending writes and stop the background thread
+    def close(self):
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+        self.flush()
+
+    def _pending_added(self):
+        if self._oldest is None:
+            # Wake the flusher so it starts the max_delay timer
+            self._oldest = time.monotonic()
+            self._cond.notify()
+        elif len(self._creates) + len(self._deletes) >= self.max_batch:
+            self._cond.notify()
+
+    # Remove and return the pending operations; caller holds the lock
+    def _take(self):
+        creates, deletes = self._creates, self._deletes
+        self._creates, self._deletes, self._oldest = {}, {}, None
+        self._in_flight.update(creates)
+        return creates, deletes
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed:
+                    pending = len(self._creates) + len(self._deletes)
+                    if pending >= self.max_batch:
+                        break
+                    if pending:
+                        remaining = self._oldest + self.max_delay - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+                    else:
+                        self._cond.wait()
+                if self._closed:
+                    return
+                creates, deletes = self._take()
+            self._write(creates, deletes)
+
+    # Commit one batch and notify the callers
+    def _write(self, creates, deletes):
+        if not creates and not deletes:
+            return
+
+        temp_ids = list(creates)
+        ids = self._apply(creates, deletes)
+        failed = ids is None
+        if failed:
+            ids = [None] * len(temp_ids)
+
+        with self._cond:
+            for temp_id, real_id in zip(temp_ids, ids):
+                self._in_flight.discard(temp_id)
+                if real_id is not None:
+                    self._resolved.set(temp_id, real_id)
+                if temp_id in self._deferred_deletes:
+                    self._deferred_deletes.discard(temp_id)
+                    if real_id is not None:
+                        self._deletes[real_id] = None
+                        self._pending_added()
+
+        for temp_id, real_id in zip(temp_ids, ids):
+            self._call(creates[temp_id][3], real_id)
+        for note_id, on_done in deletes.items():
+            self._call(on_done, None if failed else note_id)
+
+    # Run apply_note_batch, retrying with backoff; returns the created ids, or None if every attempt failed
+    def _apply(self, creates, deletes):
+        rows = [create[:3] for create in creates.values()]
+        for attempt in range(self.retries + 1):
+            try:
+                return self.db.apply_note_batch(rows, list(deletes))
+            except Exception:
+                if attempt == self.retries:
+                    logger.exception('Note write batch failed (%d creates, %d deletes), giving up',
+                                     len(creates), len(deletes))
+                    return None
+                delay = self.retry_delay * 2 ** attempt
+                logger.warning('Note write batch failed, retrying in %.1fs', delay, exc_info=True)
+                time.sleep(delay)
+
+    def _call(self, callback, value):
+        if callback is None:
+            return
+        try:
+            callback(value)
+        except Exception:
+            logger.exception('Write-behind callback failed')
@@ -0,0 +1,90 @@
+import sys  # Installing the import timer on sys.meta_path
+import time  # Timestamps relative to process start
+
+# Startup profiler for `python main.py --profile-startup`.
+# Records how long each module takes to import and when startup milestones are reached,
+# and prints a breakdown once the first frame has been sent. Every function is a no-op unless enabled.
+
+_started = time.perf_counter()
+_enabled = False
+_reported = False
+_marks = []  # (label, seconds since start)
+_imports = []  # (module name, inclusive seconds, nesting depth, seconds since start)
+_depth = 0
+
+
+# Meta path finder that wraps loaders found by the other finders so their module execution is timed
+class _ImportTimer:
+
+    def find_spec(self, name, path=None, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(name, path, target)
+            if spec is not None:
+                if spec.loader is not None and hasattr(spec.loader, 'exec_module'):
+                    spec.loader = _TimedLoader(spec.loader)
+                return spec
+        return None
+
+
+class _TimedLoader:
+
+    def __init__(self, loader):
+        self.loader = loader
+
+    def __getattr__(self, name):
+        return getattr(self.loader, name)
+
+    def create_module(self, spec):
+        return self.loader.create_module(spec)
+
+    def exec_module(self, module):
+        global _depth
+        start = time.perf_counter()
+        _depth += 1
+        try:
+            self.loader.exec_module(module)
+        finally:
+            _depth -= 1
+            _imports.append((module.__name__, time.perf_counter() - start, _depth, start - _started))
+
+
+# Start recording; imports made before this call are not timed
+def enable():
+    global _enabled
+    if not _enabled:
+        _enabled = True
+        sys.meta_path.insert(0, _ImportTimer())
+        mark('profiler enabled')
+
+
+# Record a startup milestone
+def mark(label):
+    if _enabled:
+        _marks.append((label, time.perf_counter() - _started))
+
+
+# Record the first rendered frame and print the report (only once)
+def first_frame():
+    global _reported
+    if not _enabled or _reported:
+        return
+    _reported = True
+    mark('first frame')
+    report()
+
+
+# Print milestones and the slowest imports
+def report(top=20):
+    print('\n=== Startup profile ===')
+    print('Milestones (ms since start):')
+    for label, at in _marks:
+        print(f'  {at * 1000:9.1f}  {label}')
+
+    # Only top-level imports are summed, nested ones are already included in their parents
+    total = sum(seconds for _, seconds, depth, _ in _imports if depth == 0)
+    print(f'Imports: {len(_imports)} modules, {total * 1000:.1f} ms in top-level imports')
+    print(f'Slowest imports (inclusive ms, at ms):')
+    for name, seconds, depth, at in sorted(_imports, key=lambda item: item[1], reverse=True)[:top]:
+        print(f'  {seconds * 1000:9.1f}  {at * 1000:9.1f}  {"  " * depth}{name}')
@@ -0,0 +1,138 @@
+import atexit  # Printing the report on exit
+import json  # Measuring the serialized size of update commands
+import os  # PROFILE_UI for worker processes and relative source paths
+import sys  # Finding the handler that called update()
+import threading  # Stats are recorded from every session thread
+import time  # Build and update durations
+
+# Render-cost profiler for `python main.py --profile-ui` (or PROFILE_UI=1, e.g. for serve.py workers).
+# Times view()/content() builders and page/control update() calls and records, per route and calling handler,
+# how many controls were built or sent and how many bytes of update commands went over the websocket.
+# Prints a summary on exit. Every function is a no-op unless enabled.
+
+_enabled = False
+_stats = {}  # (kind, route, source) -> _Stat
+_lock = threading.Lock()
+_local = threading.local()  # Diff of the update in progress on each thread
+_flet_dir = None  # Frames inside Flet are skipped when looking for the calling handler
+_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# Totals of one builder or update call site
+class _Stat:
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.controls = 0
+        self.max_controls = 0
+        self.bytes = 0
+        self.max_bytes = 0
+
+    def add(self, seconds, controls, size):
+        self.calls += 1
+        self.seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.controls += controls
+        self.max_controls = max(self.max_controls, controls)
+        self.bytes += size
+        self.max_bytes = max(self.max_bytes, size)
+
+
+# True when the command line or environment asks for the profiler
+def requested():
+    return '--profile-ui' in sys.argv or os.getenv('PROFILE_UI') == '1'
+
+
+# Start recording: wraps Page.update and the diff it sends, and registers the report for exit
+def enable():
+    global _enabled, _flet_dir
+    if _enabled:
+        return
+    import flet as ft
+    from flet.core.protocol import CommandEncoder
+
+    _enabled = True
+    _flet_dir = os.path.dirname(os.path.abspath(ft.__file__))
+    original_update = ft.Page.update
+    original_prepare = ft.Page._Page__prepare_update  # Builds the command diff of an update
+
+    def update(page, *controls):
+        _local.diff = None
+        start = time.perf_counter()
+        try:
+            return original_update(page, *controls)
+        finally:
+            seconds = time.perf_counter() - start
+            size, added = _local.diff or (0, 0)
+            _record('update', page.route, _caller(), seconds, added, size)
+
+    def prepare_update(page, *controls):
+        commands, added_controls, removed_controls = original_prepare(page, *controls)
+        _local.diff = (len(json.dumps(commands, cls=CommandEncoder, separators=(',', ':'))), len(added_controls))
+        return commands, added_controls, removed_controls
+
+    ft.Page.update = update
+    ft.Page._Page__prepare_update = prepare_update
+    atexit.register(report)
+
+
+# Wrap a view()/content() builder (kind 'view' or 'content') so each build of the route is timed
+# and its control tree counted
+def measure(route, kind, builder):
+    if not _enabled:
+        return builder
+
+    def build():
+        start = time.perf_counter()
+        result = builder()
+        _record('build', route, f'{kind}()', time.perf_counter() - start, count_controls(result), 0)
+        return result
+
+    return build
+
+
+# Number of controls in a tree
+def count_controls(root):
+    count, stack = 0, [root]
+    while stack:
+        control = stack.pop()
+        if control is None:
+            continue
+        count += 1
+        stack.extend(control._get_children())
+    return count
+
+
+# "file:function" of the first frame outside Flet and this module, i.e. the handler that asked for the update
+def _caller():
+    frame = sys._getframe(2)
+    while frame is not None:
+        path = frame.f_code.co_filename
+        if not path.startswith(_flet_dir) and path != __file__:
+            return f'{os.path.relpath(path, _root)}:{frame.f_code.co_qualname}'
+        frame = frame.f_back
+    return '?'
+
+
+def _record(kind, route, source, seconds, controls, size):
+    with _lock:
+        _stats.setdefault((kind, route, source), _Stat()).add(seconds, controls, size)
+
+
+# Print builders and update call sites, most expensive first
+def report(top=30):
+    with _lock:
+        stats = sorted(_stats.items(), key=lambda item: item[1].seconds, reverse=True)
+    if not stats:
+        return
+
+    print('\n=== UI render profile ===')
+    print('Controls: tree size for builds, controls added for updates. Sent: serialized update commands.')
+    print(f'  {"calls":>6} {"total ms":>9} {"avg ms":>8} {"max ms":>8} {"controls":>9} {"max":>6} '
+          f'{"sent KiB":>9} {"max KiB":>8}  kind    route  source')
+    for (kind, route, source), stat in stats[:top]:
+        print(f'  {stat.calls:6d} {stat.seconds * 1000:9.1f} {stat.seconds / stat.calls * 1000:8.2f} '
+              f'{stat.max_seconds * 1000:8.2f} {stat.controls / stat.calls:9.1f} {stat.max_controls:6d} '
+              f'{stat.bytes / 1024:9.1f} {stat.max_bytes / 1024:8.1f}  {kind:<7} {route}  {source}')